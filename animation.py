@@ -0,0 +1,235 @@
+"""
+Data driven sprite animation
+
+Each kind of character is described by a table of states (which frames of
+its animation set to show and for how long) and a transition table saying
+which state it should be in for the way it is moving.  An Animator runs
+every character of a kind in one pass over NumPy arrays, advancing by the
+real time elapsed so animations play at the same speed at any frame rate,
+and only touches a sprite's texture when its frame has changed.
+
+A character doesn't need a sprite all the time.  Characters off screen are
+animated in the arrays all the same, and a sprite attached when they come
+on screen is shown the frame they are on.
+"""
+
+from collections import namedtuple
+
+import numpy
+
+from constants import *
+
+#The animations were made for the game running at 60 updates a second
+ANIMATION_TICK = 1 / 60
+
+#Fraction of a frame an animation may be early by
+FRAME_EPSILON = 1e-6
+
+# One state of an animation.
+#   textures        name of the field of the animation set holding its frames
+#   frame_duration  seconds each frame is shown for, None for a state that is a single (right, left) pair
+#   loop            start over after the last frame, or hold it
+#   speed           how fast time runs in this state, 0 to hold the frame
+#   clock           states sharing a clock carry on from each other's frame
+AnimationState = namedtuple("AnimationState", ["name", "textures", "frame_duration", "loop", "speed", "clock"])
+AnimationState.__new__.__defaults__ = (True, 1.0, None)
+
+PLAYER_STATES = (
+    AnimationState("idle", "idle", 7 * ANIMATION_TICK),
+    AnimationState("walk", "walk", 3 * ANIMATION_TICK),
+    AnimationState("climb", "climbing", 8 * ANIMATION_TICK, clock="climb"),
+    AnimationState("climb_still", "climbing", 8 * ANIMATION_TICK, speed=0.0, clock="climb"),
+    AnimationState("jump", "jump", None),
+    AnimationState("fall", "fall", None),
+    AnimationState("death", "death", 7 * ANIMATION_TICK, loop=False),
+)
+
+# The first row whose flags all match picks the state
+PLAYER_TRANSITIONS = (
+    ("death", {"dead": True}),
+    ("climb", {"on_ladder": True, "climbing": True}),
+    ("climb_still", {"on_ladder": True}),
+    ("jump", {"rising": True}),
+    ("fall", {"falling": True}),
+    ("walk", {"walking": True}),
+    ("idle", {}),
+)
+
+MOB_STATES = (
+    AnimationState("idle", "idle", 7 * ANIMATION_TICK),
+    AnimationState("walk", "walk", 5 * ANIMATION_TICK),
+)
+
+MOB_TRANSITIONS = (
+    ("walk", {"walking": True}),
+    ("idle", {}),
+)
+
+
+def motion_flags(change_x, change_y, dead=None, on_ladder=None):
+    """The flags transition tables match on, as bool arrays, from arrays of character state"""
+    change_x = numpy.asarray(change_x, dtype=numpy.float64)
+    change_y = numpy.asarray(change_y, dtype=numpy.float64)
+    flags = {
+        "walking": change_x != 0,
+        "rising": change_y > 0,
+        "falling": change_y < 0,
+        "climbing": numpy.abs(change_y) > 1,
+    }
+    if dead is not None:
+        flags["dead"] = numpy.asarray(dead, dtype=bool)
+    if on_ladder is not None:
+        flags["on_ladder"] = numpy.asarray(on_ladder, dtype=bool)
+    return flags
+
+
+def _facing_frames(state, frames):
+    """The frames of a state as (right, left) pairs. A frame without a facing shows the same both ways."""
+    if state.frame_duration is None:
+        return (frames,)
+    return tuple(frame if isinstance(frame, tuple) else (frame, frame) for frame in frames)
+
+
+class Animator:
+    """Animates every sprite of one kind of character in a single batched pass.
+
+    Sprites are added with their animation set (a PlayerAnimations or
+    MobAnimations), so characters of the same kind with different art can
+    share one Animator.  Each character refers to its animation set's
+    frames by index, so thousands of characters share a few frame tables.
+    """
+
+    def __init__(self, states, transitions):
+        self.states = states
+        self.state_indexes = {state.name: index for index, state in enumerate(states)}
+
+        clocks = {}
+        self.frame_duration = numpy.array([numpy.inf if state.frame_duration is None else state.frame_duration
+                                           for state in states])
+        self.loop = numpy.array([state.loop for state in states])
+        self.speed = numpy.array([state.speed for state in states])
+        self.clock = numpy.array([clocks.setdefault(state.clock, len(clocks)) if state.clock else -1
+                                  for state in states])
+        self.frame_count = None
+        self.frame_stride = 0
+
+        self.transitions = [(self.state_indexes[name], tuple(flags.items())) for name, flags in transitions]
+
+        self.sprites = []
+        self.texture_sets = []
+        self._texture_set_indexes = {}
+        self.texture_set = numpy.zeros(0, dtype=numpy.intp)
+        self.state = numpy.zeros(0, dtype=numpy.intp)
+        self.elapsed = numpy.zeros(0)
+        self.facing = numpy.zeros(0, dtype=numpy.intp)
+        self.shown = numpy.zeros(0, dtype=numpy.intp)
+
+    def __len__(self):
+        return len(self.sprites)
+
+    def _texture_set_index(self, animation_set):
+        """Index of the frame table of an animation set, made the first time the set is seen"""
+        index = self._texture_set_indexes.get(id(animation_set))
+        if index is not None:
+            return index
+        textures = [_facing_frames(state, getattr(animation_set, state.textures)) for state in self.states]
+        frame_count = numpy.array([len(frames) for frames in textures])
+        if self.frame_count is None:
+            self.frame_count = frame_count
+            self.frame_stride = int(frame_count.max())
+        elif not numpy.array_equal(self.frame_count, frame_count):
+            raise ValueError("Every animation set of an Animator needs the same number of frames per state")
+        index = len(self.texture_sets)
+        # The set is kept with its table so its id can't be reused by another set
+        self.texture_sets.append((textures, animation_set))
+        self._texture_set_indexes[id(animation_set)] = index
+        return index
+
+    def add(self, sprite, animation_set, facing=RIGHT_FACING):
+        """Adds a sprite, starting in the first state of the table. sprite can be None until one is attached."""
+        self.add_all([animation_set], facing)
+        self.sprites[-1] = sprite
+
+    def add_all(self, animation_sets, facing=RIGHT_FACING):
+        """Adds a character without a sprite for each animation set, at once"""
+        count = len(animation_sets)
+        self.sprites.extend([None] * count)
+        self.texture_set = numpy.concatenate((self.texture_set, numpy.array(
+            [self._texture_set_index(animation_set) for animation_set in animation_sets], dtype=numpy.intp)))
+        self.state = numpy.concatenate((self.state, numpy.zeros(count, dtype=numpy.intp)))
+        self.elapsed = numpy.concatenate((self.elapsed, numpy.zeros(count)))
+        self.facing = numpy.concatenate((self.facing, numpy.full(count, facing, dtype=numpy.intp)))
+        # Nothing has been shown yet, so the first update sets every texture
+        self.shown = numpy.concatenate((self.shown, numpy.full(count, -1, dtype=numpy.intp)))
+
+    def attach(self, index, sprite):
+        """Gives a character a sprite, showing the frame the character is on"""
+        self.sprites[index] = sprite
+        shown = int(self.shown[index])
+        if shown < 0:
+            state_index, frame_index, facing_index = int(self.state[index]), 0, int(self.facing[index])
+        else:
+            facing_index = shown % 2
+            state_index, frame_index = divmod(shown // 2, self.frame_stride)
+        sprite.texture = self.texture_sets[self.texture_set[index]][0][state_index][frame_index][facing_index]
+
+    def detach(self, index):
+        """Takes a character's sprite away. The character goes on being animated without it."""
+        self.sprites[index] = None
+
+    def update(self, delta_time, flags, facing=None):
+        """Advances every sprite by delta_time seconds.
+
+        flags is a dict of bool arrays, one entry per sprite, as made by
+        motion_flags.  facing is an array of RIGHT_FACING/LEFT_FACING, or
+        None to keep each sprite facing the way it was.
+        """
+        if not self.sprites:
+            return
+        if facing is not None:
+            self.facing = numpy.asarray(facing, dtype=numpy.intp)
+
+        # Pick the state from the first matching transition
+        conditions = []
+        choices = []
+        for state_index, required in self.transitions:
+            condition = numpy.ones(len(self.sprites), dtype=bool)
+            for flag, value in required:
+                condition &= flags[flag] == value
+            conditions.append(condition)
+            choices.append(state_index)
+        state = numpy.select(conditions, choices, default=self.state)
+
+        # A new state starts at its first frame unless it shares a clock with the old one
+        clock = self.clock[state]
+        restart = (state != self.state) & ((clock == -1) | (clock != self.clock[self.state]))
+        elapsed = numpy.where(restart, 0.0, self.elapsed + delta_time * self.speed[state])
+        self.state = state
+
+        frame_duration = self.frame_duration[state]
+        frame_count = self.frame_count[state]
+        loop = self.loop[state]
+        # Looping states wrap their time so it never grows without bound
+        cycle = frame_duration * frame_count
+        elapsed = numpy.where(loop & (elapsed >= cycle * (1 - FRAME_EPSILON)), elapsed - cycle, elapsed)
+        self.elapsed = elapsed
+        # The nudge keeps time summed from many small steps from landing just short of a frame
+        frame = numpy.floor(elapsed / frame_duration + FRAME_EPSILON).astype(numpy.intp)
+        frame = numpy.minimum(frame, frame_count - 1)
+
+        # Only sprites whose state, frame or facing changed get a new texture
+        shown = (state * self.frame_stride + frame) * 2 + self.facing
+        changed = numpy.flatnonzero(shown != self.shown)
+        self.shown = shown
+        if len(changed) == 0:
+            return
+        sprites = self.sprites
+        texture_sets = self.texture_sets
+        for index, texture_set, state_index, frame_index, facing_index in zip(changed.tolist(),
+                                                                              self.texture_set[changed].tolist(),
+                                                                              state[changed].tolist(),
+                                                                              frame[changed].tolist(),
+                                                                              self.facing[changed].tolist()):
+            sprite = sprites[index]
+            if sprite is not None:
+                sprite.texture = texture_sets[texture_set][0][state_index][frame_index][facing_index]
@@ -0,0 +1,360 @@
+"""
+Texture atlas of the tile and mob images
+
+Loading the tiles and the mob frames one file at a time decodes about two
+hundred small PNGs, and arcade works out the hit box of each texture, and
+of each flipped copy, pixel by pixel.  build_atlas packs every image under
+ATLAS_SOURCE_FOLDERS into a few ATLAS_SHEET_SIZE sheets in ATLAS_FOLDER,
+with a manifest of where each image is.  The manifest also holds, for every
+way an image can be flipped, the hit box arcade's "Simple" algorithm gives
+and the bounding box level_data uses, so none of that is done while the
+game starts.
+
+The manifest records the size, modification time and hash of each source
+image.  load_atlas checks them and builds the atlas again when an image has
+changed or been added or removed.  Run this file to build it ahead of time.
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy
+from PIL import Image
+
+from constants import *
+
+VERSION = 1
+
+MANIFEST_NAME = "atlas.json"
+
+#Transparent pixels between images on a sheet, so they don't bleed into each other when scaled
+PADDING = 1
+
+
+def flip_index(flipped_horizontally=False, flipped_vertically=False, flipped_diagonally=False):
+    """Index of a combination of flips in the lists of hit boxes of a manifest entry"""
+    return flipped_horizontally * 4 + flipped_vertically * 2 + flipped_diagonally
+
+
+#(flipped_horizontally, flipped_vertically, flipped_diagonally) for each flip_index
+FLIPS = tuple((bool(index & 4), bool(index & 2), bool(index & 1)) for index in range(8))
+
+
+def atlas_sources(source_folders=ATLAS_SOURCE_FOLDERS):
+    """Paths of the images that go in the atlas, sorted"""
+    paths = set()
+    for folder in source_folders:
+        paths.update(os.path.normpath(path)
+                     for path in glob.glob(os.path.join(folder, "**", "*.png"), recursive=True))
+    return sorted(paths)
+
+
+def file_hash(path):
+    with open(path, "rb") as image_file:
+        return hashlib.sha256(image_file.read()).hexdigest()
+
+
+def flip_image(image, flipped_horizontally=False, flipped_vertically=False, flipped_diagonally=False):
+    """Flips an image the way arcade.load_texture does"""
+    if flipped_diagonally:
+        image = image.transpose(Image.TRANSPOSE)
+    if flipped_horizontally:
+        image = image.transpose(Image.FLIP_LEFT_RIGHT)
+    if flipped_vertically:
+        image = image.transpose(Image.FLIP_TOP_BOTTOM)
+    return image
+
+
+def _flip_alpha(alpha, flipped_horizontally, flipped_vertically, flipped_diagonally):
+    """flip_image for an array of alpha values, rows top down"""
+    if flipped_diagonally:
+        alpha = alpha.T
+    if flipped_horizontally:
+        alpha = alpha[:, ::-1]
+    if flipped_vertically:
+        alpha = alpha[::-1]
+    return alpha
+
+
+def bounding_box(alpha):
+    """(left, bottom, right, top) of the non transparent pixels relative to the centre, as image_hit_box gives"""
+    height, width = alpha.shape
+    columns = numpy.flatnonzero(alpha.any(axis=0))
+    rows = numpy.flatnonzero(alpha.any(axis=1))
+    if len(columns) == 0:
+        return None
+    x1, x2 = int(columns[0]), int(columns[-1]) + 1
+    y1, y2 = int(rows[0]), int(rows[-1]) + 1
+    return (x1 - width / 2, height / 2 - y2, x2 - width / 2, height / 2 - y1)
+
+
+def simple_hit_box_points(alpha):
+    """The hit box points arcade's calculate_hit_box_points_simple gives for an image, from its alpha values.
+
+    The borders and corner cuts are found the same way, edge cases
+    included, so a texture from the atlas collides exactly as one loaded
+    from its file.
+    """
+    height, width = alpha.shape
+    columns = numpy.flatnonzero(alpha.any(axis=0))
+    rows = numpy.flatnonzero(alpha.any(axis=1))
+    left_border = int(columns[0]) if len(columns) else width
+    right_border = int(columns[-1]) if len(columns) else 0
+    top_border = int(rows[0]) if len(rows) else height
+    bottom_border = int(rows[-1]) if len(rows) else 0
+    # arcade's scans stop at 0, so an image only opaque in its top row counts as empty
+    if bottom_border == 0:
+        return ()
+
+    def corner_offset(start_x, start_y, x_direction, y_direction):
+        offset = 0
+        while True:
+            for step in range(offset + 1):
+                if alpha[start_y + (offset - step) * y_direction, start_x + step * x_direction]:
+                    return offset
+            offset += 1
+
+    top_left = corner_offset(left_border, top_border, 1, 1)
+    top_right = corner_offset(right_border, top_border, -1, 1)
+    bottom_left = corner_offset(left_border, bottom_border, 1, -1)
+    bottom_right = corner_offset(right_border, bottom_border, -1, -1)
+
+    corners = [(left_border, bottom_border + 1 - bottom_left)]
+    if bottom_left:
+        corners.append((left_border + bottom_left, bottom_border + 1))
+    corners.append((right_border + 1 - bottom_right, bottom_border + 1))
+    if bottom_right:
+        corners.append((right_border + 1, bottom_border + 1 - bottom_right))
+    corners.append((right_border + 1, top_border + top_right))
+    if top_right:
+        corners.append((right_border + 1 - top_right, top_border))
+    corners.append((left_border + top_left, top_border))
+    if top_left:
+        corners.append((left_border, top_border + top_left))
+
+    points = [(x - width / 2, (height - y) - height / 2) for x, y in corners]
+    return tuple(dict.fromkeys(points))
+
+
+def pack(sizes, sheet_size=ATLAS_SHEET_SIZE, padding=PADDING):
+    """Places rectangles on sheets in shelves, tallest first.
+
+    Returns ([(sheet, x, y) for each size], [(width, height) of each sheet]).
+    """
+    places = [None] * len(sizes)
+    sheets = []
+    shelf_x = shelf_y = shelf_height = 0
+    for index in sorted(range(len(sizes)), key=lambda index: (-sizes[index][1], -sizes[index][0])):
+        width, height = sizes[index][0] + padding, sizes[index][1] + padding
+        if width > sheet_size or height > sheet_size:
+            raise ValueError("A {}x{} image doesn't fit on a {} pixel atlas sheet".format(
+                sizes[index][0], sizes[index][1], sheet_size))
+        if sheets and shelf_x + width > sheet_size:
+            # Start a shelf under the last one, no taller than it as the images are tallest first
+            shelf_x, shelf_y, shelf_height = 0, shelf_y + shelf_height, height
+        if not sheets or shelf_y + height > sheet_size:
+            sheets.append(0)
+            shelf_x, shelf_y, shelf_height = 0, 0, height
+        places[index] = (len(sheets) - 1, shelf_x, shelf_y)
+        shelf_x += width
+        sheets[-1] = shelf_y + shelf_height
+    return places, [(sheet_size, sheet_height) for sheet_height in sheets]
+
+
+def build_atlas(folder=ATLAS_FOLDER, source_folders=ATLAS_SOURCE_FOLDERS, sheet_size=ATLAS_SHEET_SIZE):
+    """Packs the source images into sheets and writes them with their manifest. Returns the manifest."""
+    paths = atlas_sources(source_folders)
+    images = [Image.open(path).convert("RGBA") for path in paths]
+    places, sheet_sizes = pack([image.size for image in images], sheet_size)
+    sheets = [Image.new("RGBA", size) for size in sheet_sizes]
+
+    sources = {}
+    entries = {}
+    for path, image, (sheet, x, y) in zip(paths, images, places):
+        sheets[sheet].paste(image, (x, y))
+        stat = os.stat(path)
+        sources[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_hash(path)}
+        alpha = numpy.asarray(image.getchannel("A")) != 0
+        flipped = [_flip_alpha(alpha, *flips) for flips in FLIPS]
+        entries[path] = {"sheet": sheet, "x": x, "y": y, "width": image.width, "height": image.height,
+                         "boxes": [bounding_box(flipped_alpha) for flipped_alpha in flipped],
+                         "points": [simple_hit_box_points(flipped_alpha) for flipped_alpha in flipped]}
+
+    manifest = {"version": VERSION, "sheet_size": sheet_size,
+                "sheets": ["sheet_{}.png".format(index) for index in range(len(sheets))],
+                "sources": sources, "images": entries}
+
+    # Written into a temporary folder and swapped in, so an atlas cut short is never read
+    temp_folder = "{}.tmp{}".format(folder, os.getpid())
+    shutil.rmtree(temp_folder, ignore_errors=True)
+    os.makedirs(temp_folder)
+    try:
+        for sheet, name in zip(sheets, manifest["sheets"]):
+            sheet.save(os.path.join(temp_folder, name))
+        with open(os.path.join(temp_folder, MANIFEST_NAME), "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        shutil.rmtree(folder, ignore_errors=True)
+        try:
+            os.replace(temp_folder, folder)
+        except OSError:
+            # Another process built the atlas first
+            pass
+    finally:
+        shutil.rmtree(temp_folder, ignore_errors=True)
+    return manifest
+
+
+def is_fresh(manifest, source_folders=ATLAS_SOURCE_FOLDERS):
+    """True if a manifest was built from the source images as they are now.
+
+    Images whose size and modification time match aren't read.  The others
+    are hashed, so an image that was only touched doesn't make the atlas stale.
+    """
+    if manifest.get("version") != VERSION or manifest.get("sheet_size") != ATLAS_SHEET_SIZE:
+        return False
+    sources = manifest["sources"]
+    if sorted(sources) != atlas_sources(source_folders):
+        return False
+    for path, source in sources.items():
+        stat = os.stat(path)
+        if (stat.st_size, stat.st_mtime_ns) == (source["size"], source["mtime_ns"]):
+            continue
+        if file_hash(path) != source["sha256"]:
+            return False
+    return True
+
+
+class AssetAtlas:
+    """The images of a built atlas, cut from their sheets as they are asked for"""
+
+    def __init__(self, folder, manifest):
+        self.folder = folder
+        self.images = manifest["images"]
+        self.sheet_names = manifest["sheets"]
+        self._sheets = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, path):
+        return os.path.normpath(path) in self.images
+
+    def __len__(self):
+        return len(self.images)
+
+    def _sheet(self, index):
+        """A sheet image, decoded the first time one of its images is asked for"""
+        with self._lock:
+            sheet = self._sheets.get(index)
+            if sheet is None:
+                sheet = Image.open(os.path.join(self.folder, self.sheet_names[index])).convert("RGBA")
+                self._sheets[index] = sheet
+        return sheet
+
+    def image(self, path, flipped_horizontally=False, flipped_vertically=False, flipped_diagonally=False):
+        """The image of a source file, flipped as arcade.load_texture would"""
+        entry = self.images[os.path.normpath(path)]
+        x, y = entry["x"], entry["y"]
+        image = self._sheet(entry["sheet"]).crop((x, y, x + entry["width"], y + entry["height"]))
+        return flip_image(image, flipped_horizontally, flipped_vertically, flipped_diagonally)
+
+    def hit_box(self, path, flipped_horizontally=False, flipped_vertically=False, flipped_diagonally=False):
+        """The (left, bottom, right, top) box image_hit_box gives for a source file, None if it is empty"""
+        box = self.images[os.path.normpath(path)]["boxes"][
+            flip_index(flipped_horizontally, flipped_vertically, flipped_diagonally)]
+        return tuple(box) if box is not None else None
+
+    def hit_box_points(self, path, flipped_horizontally=False, flipped_vertically=False,
+                       flipped_diagonally=False):
+        """The points arcade's "Simple" hit box algorithm gives for a source file"""
+        points = self.images[os.path.normpath(path)]["points"][
+            flip_index(flipped_horizontally, flipped_vertically, flipped_diagonally)]
+        return tuple(tuple(point) for point in points)
+
+
+def load_atlas(folder=ATLAS_FOLDER, build=True):
+    """Reads the atlas, building it first if build and it is missing or stale. None if there is none to read."""
+    try:
+        with open(os.path.join(folder, MANIFEST_NAME)) as manifest_file:
+            manifest = json.load(manifest_file)
+        fresh = is_fresh(manifest)
+    except (OSError, ValueError, KeyError):
+        fresh = False
+    if not fresh:
+        if not build:
+            return None
+        manifest = build_atlas(folder)
+    return AssetAtlas(folder, manifest)
+
+
+_atlas = None
+_atlas_read = False
+_atlas_lock = threading.Lock()
+
+
+def asset_atlas(build=True):
+    """The atlas shared by the process, read the first time it is asked for.
+
+    With build False a missing or stale atlas isn't built and None is
+    returned, so headless runs never write to the assets folder.
+    """
+    global _atlas, _atlas_read
+    with _atlas_lock:
+        if _atlas is None and (build or not _atlas_read):
+            _atlas = load_atlas(build=build)
+            _atlas_read = True
+        return _atlas
+
+
+def _load_from_files(paths):
+    """Decodes every image and works out its hit boxes, as loading without the atlas does.
+
+    The hit boxes are worked out with the NumPy version here, which is quicker than arcade's.
+    """
+    for path in paths:
+        alpha = numpy.asarray(Image.open(path).convert("RGBA").getchannel("A")) != 0
+        for flips in ((False, False, False), (True, False, False)):
+            simple_hit_box_points(_flip_alpha(alpha, *flips))
+
+
+def _load_from_atlas(atlas, paths):
+    for path in paths:
+        for flips in ((False, False, False), (True, False, False)):
+            atlas.image(path, *flips)
+            atlas.hit_box_points(path, *flips)
+
+
+def main():
+    """Builds the texture atlas if it is stale and reports what it holds"""
+    parser = argparse.ArgumentParser(description="Pack the tile and mob images into a texture atlas.")
+    parser.add_argument("--force", action="store_true", help="build the atlas even if it is up to date")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    if args.force:
+        build_atlas()
+    atlas = load_atlas()
+    build_time = time.perf_counter() - start_time
+    sheets = len(atlas.sheet_names)
+    print("{}: {} images on {} sheets of {} pixels ({:.1f} ms)".format(
+        ATLAS_FOLDER, len(atlas), sheets, ATLAS_SHEET_SIZE, build_time * 1000))
+
+    # Both ways load each image and its left facing copy, as load_texture_pair does
+    paths = sorted(atlas.images)
+    start_time = time.perf_counter()
+    _load_from_files(paths)
+    files_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    atlas = load_atlas(build=False)
+    _load_from_atlas(atlas, paths)
+    atlas_time = time.perf_counter() - start_time
+    print("Images and hit boxes: {:.1f} ms from the files, {:.1f} ms from the atlas".format(
+        files_time * 1000, atlas_time * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""
+Benchmarks of the setup, update and draw paths
+
+Times MyGame.setup, MyGame.on_update, MyGame.on_draw and the
+PlayerCharacter and EnemyCharacter constructors on the shipped levels and
+on synthetic maps from mapgen, along with the headless prepare_level and
+Simulation.step they are built on.  Results are written as JSON and
+compared against a saved baseline, failing when the median of a benchmark
+has got slower by more than the tolerance, or when there is no baseline to
+compare against.  The committed benchmark_baseline.json is a --headless run
+of the shipped levels, made with
+python benchmark.py --headless --no-synthetic --save-baseline.
+
+--headless leaves out everything that needs a window, for machines with no
+display.
+"""
+
+import argparse
+import functools
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+from constants import *
+from levelpack import load_level
+from mapgen import map_spec, generate_map
+from simulation import Simulation, Inputs, PHYSICS_ENGINES, prepare_level
+
+VERSION = 1
+
+DEFAULT_OUTPUT = "benchmark_results.json"
+DEFAULT_BASELINE = "benchmark_baseline.json"
+
+#How much slower than the baseline a median may get before it counts as a regression
+DEFAULT_TOLERANCE = 0.25
+#Differences smaller than this are timer noise, in milliseconds
+DEFAULT_MIN_DIFFERENCE_MS = 0.05
+
+#Every setup and update benchmark ticks at the game's frame rate
+DELTA_TIME = 1 / 60
+
+
+def scripted_inputs(tick):
+    """The keys held on a tick of a benchmark run: right all the time, jumping every 40 ticks"""
+    return Inputs(up=tick % 40 < 20, right=True)
+
+
+def summary(times, first=None):
+    """Statistics of a list of times in seconds, in milliseconds"""
+    times_ms = [run_time * 1000 for run_time in times]
+    result = {
+        "runs": len(times_ms),
+        "min_ms": min(times_ms),
+        "median_ms": statistics.median(times_ms),
+        "mean_ms": statistics.mean(times_ms),
+        "max_ms": max(times_ms),
+    }
+    if first is not None:
+        result["first_ms"] = first * 1000
+    return result
+
+
+def timed(function, *args):
+    """Calls a function and returns (seconds taken, its result)"""
+    start_time = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start_time, result
+
+
+class BenchmarkMap:
+    """A map the benchmarks run on: a shipped level or a synthetic map played as level 1"""
+
+    def __init__(self, name, level, map_name=MAP_NAME):
+        self.name = name
+        self.level = level
+        self.map_name = map_name
+
+    def level_data(self):
+        return load_level(self.level, self.map_name)
+
+    def info(self):
+        level_data = self.level_data()
+        return {
+            "map_name": self.map_name.format(self.level),
+            "width": level_data.width,
+            "height": level_data.height,
+            "coins": len(level_data.objects.get(COINS_LAYER_NAME, ())),
+            "enemies": len(level_data.objects.get(MOVING_ENEMIES_LAYER_NAME, ())),
+            "moving_platforms": len(level_data.objects.get(MOVING_PLATFORMS_LAYER_NAME, ())),
+        }
+
+    def mob_types(self):
+        return sorted({map_object.properties["mob_type"]
+                       for map_object in self.level_data().objects.get(MOVING_ENEMIES_LAYER_NAME, ())})
+
+
+def bench_prepare_level(benchmark_map, engine, repeat):
+    """prepare_level, the headless part of a level start"""
+    times = [timed(prepare_level, benchmark_map.level, engine, benchmark_map.map_name)[0]
+             for _ in range(repeat + 1)]
+    return summary(times[1:], times[0])
+
+
+def bench_simulation_step(benchmark_map, engine, ticks):
+    """Simulation.step with the scripted inputs"""
+    simulation = Simulation(level_loader=functools.partial(prepare_level, engine=engine,
+                                                           map_name=benchmark_map.map_name))
+    simulation.setup(benchmark_map.level)
+    times = []
+    for tick in range(ticks):
+        times.append(timed(simulation.step, scripted_inputs(tick))[0])
+        if simulation.game_over:
+            break
+    return summary(times)
+
+
+def _finish(window):
+    """Waits for the GPU, so a draw is timed until it is done rather than queued"""
+    ctx = getattr(window, "ctx", None)
+    if ctx is not None:
+        ctx.finish()
+
+
+def _new_game(benchmark_map, engine):
+    import game
+    # Nothing is prefetched, so no worker thread runs during the timings
+    return game.MyGame(engine, map_name=benchmark_map.map_name, last_level=benchmark_map.level)
+
+
+def bench_setup(benchmark_map, engine, repeat):
+    """MyGame.setup, the whole level start including building the sprites"""
+    times = []
+    for _ in range(repeat + 1):
+        game_view = _new_game(benchmark_map, engine)
+        times.append(timed(game_view.setup, benchmark_map.level)[0])
+        game_view.prefetcher.shutdown()
+    return summary(times[1:], times[0])
+
+
+def bench_update_draw(window, benchmark_map, engine, ticks):
+    """MyGame.on_update and MyGame.on_draw, one of each per tick"""
+    import arcade
+
+    game_view = _new_game(benchmark_map, engine)
+    game_view.setup(benchmark_map.level)
+    window.show_view(game_view)
+    arcade.set_viewport(0, SCREEN_WIDTH, 0, SCREEN_HEIGHT)
+
+    update_times = []
+    draw_times = []
+    inputs = Inputs()
+    for tick in range(ticks):
+        # Keys go through the key handlers, as they do when playing
+        new_inputs = scripted_inputs(tick)
+        if new_inputs.up != inputs.up:
+            (game_view.on_key_press if new_inputs.up else game_view.on_key_release)(arcade.key.UP, 0)
+        if new_inputs.right != inputs.right:
+            (game_view.on_key_press if new_inputs.right else game_view.on_key_release)(arcade.key.RIGHT, 0)
+        inputs = new_inputs
+
+        update_times.append(timed(game_view.on_update, DELTA_TIME)[0])
+        if game_view.simulation.game_over:
+            break
+        start_time = time.perf_counter()
+        game_view.on_draw()
+        _finish(window)
+        draw_times.append(time.perf_counter() - start_time)
+
+    game_view.prefetcher.shutdown()
+    return summary(update_times), summary(draw_times)
+
+
+def bench_constructor(constructor, repeat, *args):
+    """A sprite constructor, with its textures already loaded"""
+    first = timed(constructor, *args)[0]
+    return summary([timed(constructor, *args)[0] for _ in range(repeat)], first)
+
+
+def run_benchmarks(benchmark_maps, engine, repeat, ticks, constructions, headless, log=print):
+    """Runs every benchmark on every map. Returns the results dict written as JSON."""
+    window = None
+    if not headless:
+        import arcade
+        window = arcade.Window(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE)
+
+    results = {}
+    maps = {}
+    for benchmark_map in benchmark_maps:
+        maps[benchmark_map.name] = benchmark_map.info()
+        benchmarks = {}
+        results[benchmark_map.name] = benchmarks
+
+        for benchmark_engine in sorted(PHYSICS_ENGINES):
+            benchmarks["prepare_level[{}]".format(benchmark_engine)] = bench_prepare_level(
+                benchmark_map, benchmark_engine, repeat)
+        benchmarks["Simulation.step"] = bench_simulation_step(benchmark_map, engine, ticks)
+
+        if window is not None:
+            from game import PlayerCharacter, EnemyCharacter
+            from texture_cache import level_scope
+
+            benchmarks["MyGame.setup"] = bench_setup(benchmark_map, engine, repeat)
+            benchmarks["MyGame.on_update"], benchmarks["MyGame.on_draw"] = bench_update_draw(
+                window, benchmark_map, engine, ticks)
+            benchmarks["PlayerCharacter"] = bench_constructor(PlayerCharacter, constructions)
+            for mob_type in benchmark_map.mob_types():
+                benchmarks["EnemyCharacter[{}]".format(mob_type)] = bench_constructor(
+                    EnemyCharacter, constructions, mob_type, level_scope(benchmark_map.level))
+
+        for name, result in benchmarks.items():
+            log("{:<24} {:<28} median {:9.3f} ms  min {:9.3f} ms  max {:9.3f} ms  ({} runs)".format(
+                benchmark_map.name, name, result["median_ms"], result["min_ms"], result["max_ms"], result["runs"]))
+
+    if window is not None:
+        window.close()
+
+    return {
+        "version": VERSION,
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "settings": {
+            "engine": engine,
+            "repeat": repeat,
+            "ticks": ticks,
+            "constructions": constructions,
+            "headless": headless,
+        },
+        "maps": maps,
+        "results": results,
+    }
+
+
+def compare_results(baseline, current, tolerance=DEFAULT_TOLERANCE, min_difference_ms=DEFAULT_MIN_DIFFERENCE_MS):
+    """Compares the medians of two results dicts.
+
+    Returns a list of (map name, benchmark, baseline ms, current ms,
+    regressed) for every benchmark both of them ran.
+    """
+    comparisons = []
+    for map_name, benchmarks in sorted(current["results"].items()):
+        baseline_benchmarks = baseline["results"].get(map_name, {})
+        for name, result in sorted(benchmarks.items()):
+            baseline_result = baseline_benchmarks.get(name)
+            if baseline_result is None:
+                continue
+            baseline_ms = baseline_result["median_ms"]
+            current_ms = result["median_ms"]
+            regressed = (current_ms > baseline_ms * (1 + tolerance)
+                         and current_ms - baseline_ms > min_difference_ms)
+            comparisons.append((map_name, name, baseline_ms, current_ms, regressed))
+    return comparisons
+
+
+def write_json(data, path):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path, "w") as json_file:
+        json.dump(data, json_file, indent=2, sort_keys=True)
+        json_file.write("\n")
+
+
+def parse_size(text):
+    """Parses a WIDTHxHEIGHT map size"""
+    try:
+        width, height = (int(value) for value in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected WIDTHxHEIGHT, got {!r}".format(text))
+    return width, height
+
+
+def main():
+    """Runs the benchmarks and compares them against the baseline"""
+    parser = argparse.ArgumentParser(description="Benchmark the setup, update and draw paths of the game.")
+    parser.add_argument("--levels", type=int, nargs="*", default=list(range(1, TOTAL_LEVELS + 1)),
+                        help="shipped levels to benchmark")
+    parser.add_argument("--synthetic", type=parse_size, action="append", metavar="WIDTHxHEIGHT",
+                        help="synthetic map sizes to benchmark, defaults to 2000x500")
+    parser.add_argument("--no-synthetic", action="store_true", help="only benchmark the shipped levels")
+    parser.add_argument("--coins", type=int, help="coins on the synthetic maps")
+    parser.add_argument("--enemies", type=int, help="enemies on the synthetic maps")
+    parser.add_argument("--moving-platforms", type=int, help="moving platforms on the synthetic maps")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic maps")
+    parser.add_argument("--engine", choices=sorted(PHYSICS_ENGINES), default=PHYSICS_ENGINE,
+                        help="collision engine for the setup and update benchmarks")
+    parser.add_argument("--repeat", type=int, default=5, help="times to repeat each level start")
+    parser.add_argument("--ticks", type=int, default=600, help="ticks to update and draw")
+    parser.add_argument("--constructions", type=int, default=200, help="sprites to construct")
+    parser.add_argument("--headless", action="store_true", help="skip the benchmarks that need a window")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="JSON file to write the results to")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="JSON results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="fraction slower than the baseline that counts as a regression")
+    args = parser.parse_args()
+
+    benchmark_maps = [BenchmarkMap("level_{}".format(level), level) for level in args.levels]
+    if not args.no_synthetic:
+        for width, height in args.synthetic or [(2000, 500)]:
+            spec = map_spec(width, height, args.coins, args.enemies, args.moving_platforms, args.seed)
+            benchmark_maps.append(BenchmarkMap("synthetic_{}x{}".format(width, height), 1, generate_map(spec)))
+
+    results = run_benchmarks(benchmark_maps, args.engine, args.repeat, args.ticks,
+                             args.constructions, args.headless)
+    write_json(results, args.output)
+    print("Results written to {}".format(args.output))
+
+    if args.save_baseline:
+        write_json(results, args.baseline)
+        print("Baseline saved to {}".format(args.baseline))
+        return
+
+    # Without a baseline nothing can be reported as a regression, so that is a failure rather than a pass
+    if not os.path.exists(args.baseline):
+        print("No baseline at {}, run with --save-baseline to make one".format(args.baseline), file=sys.stderr)
+        sys.exit(2)
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+
+    comparisons = compare_results(baseline, results, args.tolerance)
+    benchmark_count = sum(len(benchmarks) for benchmarks in results["results"].values())
+    if len(comparisons) < benchmark_count:
+        print("Warning: {} of {} benchmarks are not in {} and were not compared".format(
+            benchmark_count - len(comparisons), benchmark_count, args.baseline), file=sys.stderr)
+    if not comparisons:
+        sys.exit(2)
+
+    regressions = 0
+    for map_name, name, baseline_ms, current_ms, regressed in comparisons:
+        change = (current_ms / baseline_ms - 1) * 100 if baseline_ms else 0.0
+        print("{:<24} {:<28} {:9.3f} ms -> {:9.3f} ms  {:+6.1f}%{}".format(
+            map_name, name, baseline_ms, current_ms, change, "  REGRESSED" if regressed else ""))
+        regressions += regressed
+    if regressions:
+        print("{} benchmarks are more than {:.0f}% slower than the baseline".format(regressions,
+                                                                                   args.tolerance * 100))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
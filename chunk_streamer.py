@@ -0,0 +1,241 @@
+"""
+Tile layer sprites built a chunk at a time around the camera
+
+With map streaming on, the game doesn't build a sprite for every tile of a
+level.  A ChunkStreamer builds the sprites of the chunks the viewport
+covers, and of a ring of chunks around them on a worker thread, keeping
+them in a ChunkCache that drops the least recently used chunks once their
+sprites go over the memory budget.  Each tile layer is drawn through a
+StreamedLayer, which stands in for a ChunkedLayer.
+"""
+
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import arcade
+
+from chunked_layer import catch_up_animation
+from constants import *
+from streaming import ChunkCache
+
+
+class ChunkSprites:
+    """The sprites of one chunk, a static SpriteList and the animated sprites for each layer"""
+
+    def __init__(self, layers):
+        self.sprite_lists = []
+        self.animated = []
+        for sprites in layers:
+            sprite_list = arcade.SpriteList(use_spatial_hash=False, is_static=True)
+            sprite_list.extend(sprites)
+            self.sprite_lists.append(sprite_list)
+            self.animated.append([sprite for sprite in sprites
+                                  if isinstance(sprite, arcade.AnimatedTimeBasedSprite)])
+        self.sprite_count = sum(len(sprite_list) for sprite_list in self.sprite_lists)
+        #The layer clock each layer's animated tiles were last moved on to, new sprites are at the start
+        self.animated_at = [0.0] * len(layers)
+
+    def catch_up(self, animation_time):
+        """Moves the animated tiles on to the layer clocks in animation_time"""
+        for layer_index, animated in enumerate(self.animated):
+            elapsed = animation_time[layer_index] - self.animated_at[layer_index]
+            if elapsed > 0:
+                for sprite in animated:
+                    catch_up_animation(sprite, elapsed)
+            self.animated_at[layer_index] = animation_time[layer_index]
+
+
+class ChunkStreamer:
+    """Builds, caches and drops the chunks of the tile layers of a level.
+
+    build_chunk is called with (chunk_x, chunk_y) and returns a list with
+    the sprites of every layer in that chunk.  Chunks the viewport needs
+    are built on the spot if the worker hasn't got to them yet.
+    overhang is how far a tile can stick out of its chunk.  Animated tiles
+    of a rebuilt chunk are moved on to where they would be had they never
+    been dropped.  Only the chunks on screen are animated, the cached ones
+    around them are caught up the same way when they come on screen.
+    """
+
+    def __init__(self, build_chunk, layer_count, width, height, chunk_size=RENDER_CHUNK_TILES * GRID_PIXEL_SIZE,
+                 overhang=0, memory_budget=STREAMING_MEMORY_BUDGET, preload=STREAMING_PRELOAD_CHUNKS):
+        self.build_chunk = build_chunk
+        self.layer_count = layer_count
+        self.chunk_columns = int(math.ceil(width / chunk_size))
+        self.chunk_rows = int(math.ceil(height / chunk_size))
+        self.chunk_size = chunk_size
+        self.overhang = overhang
+        self.preload = preload
+        self.chunks = ChunkCache(memory_budget)
+        self.executor = None
+        self.loading = {}
+        self._lock = threading.Lock()
+        self.visible = []
+        self.visible_keys = set()
+        self.visible_range = None
+        self.animation_time = [0.0] * layer_count
+        self.chunk_builds = 0
+        self.chunk_waits = 0
+
+    def __len__(self):
+        """Number of sprites in the cached chunks"""
+        return sum(chunk.sprite_count for chunk in self.chunks.values())
+
+    def _chunk_range(self, view_left, view_bottom, width, height, margin):
+        chunk_size = self.chunk_size
+        overhang = self.overhang
+        return (max(int(math.floor((view_left - overhang) / chunk_size)) - margin, 0),
+                min(int(math.floor((view_left + width + overhang) / chunk_size)) + margin, self.chunk_columns - 1),
+                max(int(math.floor((view_bottom - overhang) / chunk_size)) - margin, 0),
+                min(int(math.floor((view_bottom + height + overhang) / chunk_size)) + margin, self.chunk_rows - 1))
+
+    def _build(self, key):
+        """Runs on the worker thread, or on the caller's if the chunk is needed now"""
+        chunk = ChunkSprites(self.build_chunk(*key))
+        with self._lock:
+            self.chunk_builds += 1
+        return chunk
+
+    def _install(self, key, chunk):
+        """Puts a built chunk in the cache, its animations caught up"""
+        chunk.catch_up(self.animation_time)
+        self.chunks.put(key, chunk, chunk.sprite_count * STREAMING_SPRITE_BYTES)
+
+    def _harvest(self):
+        """Installs the chunks the worker has finished"""
+        installed = False
+        for key, future in list(self.loading.items()):
+            if future.done():
+                del self.loading[key]
+                if not future.cancelled() and future.exception() is None:
+                    self._install(key, future.result())
+                    installed = True
+        if installed:
+            self.chunks.trim(keep=self.visible_keys)
+
+    def update_viewport(self, view_left, view_bottom, width=SCREEN_WIDTH, height=SCREEN_HEIGHT):
+        """Builds the chunks on screen and queues the ones around them. Returns True if the visible chunks changed."""
+        self._harvest()
+        visible_range = self._chunk_range(view_left, view_bottom, width, height, 0)
+        if visible_range == self.visible_range:
+            return False
+        self.visible_range = visible_range
+
+        min_x, max_x, min_y, max_y = visible_range
+        visible_keys = [(chunk_x, chunk_y)
+                        for chunk_y in range(min_y, max_y + 1)
+                        for chunk_x in range(min_x, max_x + 1)]
+        self.visible_keys = set(visible_keys)
+        self.visible = []
+        for key in visible_keys:
+            chunk = self.chunks.get(key)
+            if chunk is None:
+                future = self.loading.pop(key, None)
+                if future is not None:
+                    self.chunk_waits += 1
+                    try:
+                        chunk = future.result()
+                    except Exception:
+                        chunk = None
+                if chunk is None:
+                    chunk = self._build(key)
+                self._install(key, chunk)
+            else:
+                chunk.catch_up(self.animation_time)
+            self.visible.append(chunk)
+
+        #Queues the chunks around the screen for the worker
+        if self.preload:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chunk-stream")
+            min_x, max_x, min_y, max_y = self._chunk_range(view_left, view_bottom, width, height, self.preload)
+            for chunk_y in range(min_y, max_y + 1):
+                for chunk_x in range(min_x, max_x + 1):
+                    key = (chunk_x, chunk_y)
+                    if key not in self.chunks and key not in self.loading:
+                        self.loading[key] = self.executor.submit(self._build, key)
+
+        self.chunks.trim(keep=self.visible_keys)
+        return True
+
+    def draw(self, layer_index):
+        for chunk in self.visible:
+            chunk.sprite_lists[layer_index].draw()
+
+    def update_animation(self, layer_index, delta_time=1 / 60):
+        """Advances the animated tiles of a layer in the chunks on screen"""
+        animation_time = self.animation_time[layer_index] + delta_time
+        self.animation_time[layer_index] = animation_time
+        for chunk in self.visible:
+            for sprite in chunk.animated[layer_index]:
+                sprite.update_animation(delta_time)
+            chunk.animated_at[layer_index] = animation_time
+
+    def shutdown(self):
+        """Drops the queued and cached chunks and stops the worker thread.
+
+        The streamer builds them again if update_viewport is called after, so
+        a level that is played again starts with nothing but its tiles kept.
+        """
+        for future in self.loading.values():
+            future.cancel()
+        self.loading.clear()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        self.chunks = ChunkCache(self.chunks.budget)
+        self.visible = []
+        self.visible_keys = set()
+        self.visible_range = None
+
+    def metrics(self):
+        """Cache size and build counts of the streamer"""
+        return {
+            "cached_chunks": len(self.chunks),
+            "cached_bytes": self.chunks.size,
+            "memory_budget": self.chunks.budget,
+            "evictions": self.chunks.evictions,
+            "builds": self.chunk_builds,
+            "waits": self.chunk_waits,
+            "loading": len(self.loading),
+        }
+
+
+class StreamedLayer:
+    """One tile layer of a ChunkStreamer, used like a ChunkedLayer.
+
+    Only sprites appended with moving=True (moving platforms, enemies) are
+    kept here, in one list that is always drawn after the chunks.
+    """
+
+    def __init__(self, streamer, layer_index):
+        self.streamer = streamer
+        self.layer_index = layer_index
+        self.dynamic = arcade.SpriteList()
+
+    def __len__(self):
+        return (sum(len(chunk.sprite_lists[self.layer_index]) for chunk in self.streamer.chunks.values())
+                + len(self.dynamic))
+
+    def append(self, sprite, moving=False):
+        if not moving:
+            raise ValueError("The static sprites of a StreamedLayer are built by its ChunkStreamer")
+        self.dynamic.append(sprite)
+
+    def extend(self, sprites, moving=False):
+        for sprite in sprites:
+            self.append(sprite, moving)
+
+    def update_viewport(self, view_left, view_bottom, width=SCREEN_WIDTH, height=SCREEN_HEIGHT):
+        """The streamer picks the chunks of every layer at once"""
+        return False
+
+    def draw(self):
+        """Draws the chunks on screen, then the moving sprites"""
+        self.streamer.draw(self.layer_index)
+        self.dynamic.draw()
+
+    def update_animation(self, delta_time=1 / 60):
+        self.streamer.update_animation(self.layer_index, delta_time)
+        self.dynamic.update_animation(delta_time)
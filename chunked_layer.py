@@ -0,0 +1,135 @@
+"""
+Tile layers split into chunks so only what is on screen gets drawn
+
+A map is far wider than the window, so drawing a whole layer every frame
+submits mostly off screen tiles.  ChunkedLayer puts the sprites of a layer
+into one SpriteList per block of RENDER_CHUNK_TILES x RENDER_CHUNK_TILES
+tiles and draws only the blocks that overlap the viewport, so the draw cost
+depends on the window size rather than the map size.
+"""
+
+import math
+
+import arcade
+
+from constants import *
+
+
+def catch_up_animation(sprite, elapsed):
+    """Moves an animated tile on by elapsed seconds, skipping whole loops of its frames"""
+    cycle = sum(frame.duration for frame in sprite.frames) / 1000
+    if cycle > 0:
+        sprite.update_animation(elapsed % cycle)
+
+
+class ChunkedLayer:
+    """A layer of sprites, drawn one on screen chunk at a time.
+
+    Static sprites are put in the chunk their centre is in.  Sprites that
+    move (moving platforms, enemies) are appended with moving=True and kept
+    in one small list that is always drawn, after the chunks, as they were
+    appended after the tiles before.  Only the animated tiles of chunks on
+    screen are updated.  The others are caught up when their chunk comes on
+    screen, so every tile still shows the frame it would have anyway.
+    """
+
+    def __init__(self, chunk_size=RENDER_CHUNK_TILES * GRID_PIXEL_SIZE):
+        self.chunk_size = chunk_size
+        self.chunks = {}
+        self.dynamic = arcade.SpriteList()
+        #Animated tiles by chunk, how long the layer has been animated and when each chunk was last
+        self.animated = {}
+        self.animation_time = 0.0
+        self.animated_at = {}
+        self.visible_animated = []
+        self.visible = []
+        self.visible_range = None
+        # How far any sprite sticks out of its chunk, the viewport is widened by this
+        self.overhang = 0
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self.chunks.values()) + len(self.dynamic)
+
+    def __iter__(self):
+        for chunk in self.chunks.values():
+            yield from chunk
+        yield from self.dynamic
+
+    def append(self, sprite, moving=False):
+        if moving:
+            self.dynamic.append(sprite)
+            return
+        chunk_size = self.chunk_size
+        chunk_x = int(sprite.center_x // chunk_size)
+        chunk_y = int(sprite.center_y // chunk_size)
+        if isinstance(sprite, arcade.AnimatedTimeBasedSprite):
+            self.animated.setdefault((chunk_x, chunk_y), []).append(sprite)
+            self.visible_range = None
+        chunk = self.chunks.get((chunk_x, chunk_y))
+        if chunk is None:
+            chunk = arcade.SpriteList(use_spatial_hash=False, is_static=True)
+            self.chunks[(chunk_x, chunk_y)] = chunk
+            self.visible_range = None
+        chunk.append(sprite)
+
+        self.overhang = max(self.overhang,
+                            chunk_x * chunk_size - sprite.left,
+                            sprite.right - (chunk_x + 1) * chunk_size,
+                            chunk_y * chunk_size - sprite.bottom,
+                            sprite.top - (chunk_y + 1) * chunk_size)
+
+    def extend(self, sprites, moving=False):
+        for sprite in sprites:
+            self.append(sprite, moving)
+
+    def update_viewport(self, view_left, view_bottom, width=SCREEN_WIDTH, height=SCREEN_HEIGHT):
+        """Picks the chunks to draw for a viewport. Returns True if they changed.
+
+        Scrolling within the same chunks does nothing, so this is cheap to
+        call every frame.
+        """
+        chunk_size = self.chunk_size
+        overhang = self.overhang
+        visible_range = (int(math.floor((view_left - overhang) / chunk_size)),
+                         int(math.floor((view_left + width + overhang) / chunk_size)),
+                         int(math.floor((view_bottom - overhang) / chunk_size)),
+                         int(math.floor((view_bottom + height + overhang) / chunk_size)))
+        if visible_range == self.visible_range:
+            return False
+        self.visible_range = visible_range
+
+        min_x, max_x, min_y, max_y = visible_range
+        chunks = self.chunks
+        keys = [(chunk_x, chunk_y)
+                for chunk_y in range(min_y, max_y + 1)
+                for chunk_x in range(min_x, max_x + 1)]
+        self.visible = [chunks[key] for key in keys if key in chunks]
+
+        self.visible_animated = []
+        for key in keys:
+            animated = self.animated.get(key)
+            if animated is None:
+                continue
+            elapsed = self.animation_time - self.animated_at.get(key, 0.0)
+            if elapsed > 0:
+                for sprite in animated:
+                    catch_up_animation(sprite, elapsed)
+            self.animated_at[key] = self.animation_time
+            self.visible_animated.append((key, animated))
+        return True
+
+    def draw(self):
+        """Draws the chunks on screen, then the moving sprites"""
+        for chunk in self.visible:
+            chunk.draw()
+        self.dynamic.draw()
+
+    def update_animation(self, delta_time=1 / 60):
+        """Animates the tiles on screen and the moving sprites"""
+        self.animation_time += delta_time
+        animated_at = self.animated_at
+        for key, animated in self.visible_animated:
+            for sprite in animated:
+                sprite.update_animation(delta_time)
+            animated_at[key] = self.animation_time
+        self.dynamic.update_animation(delta_time)
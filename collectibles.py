@@ -0,0 +1,161 @@
+"""
+Grid index of the collectibles of a level
+
+Coins never move, so instead of checking the player against a list of them
+every tick a CollectibleGrid files each coin under every cell of a coarse
+grid its hit box touches, once, when the level is prepared.  A pickup check
+only looks at the few cells under the player, so a level with tens of
+thousands of coins costs the same per tick as one with ten.  Picked up
+coins are marked in a flag array rather than removed, so nothing is
+reallocated while the level is played, and the order they were picked up
+in is kept so a restart only has to put those back.
+
+A level can have tens of thousands of coins, so the grid keeps no object
+per coin, only a few typed arrays with an entry for each.  Iterating makes
+a small Collectible record for each coin as it goes.
+"""
+
+import math
+from array import array
+from collections import namedtuple
+
+import numpy
+
+#Width and height of a cell of the index, in tiles
+COLLECTIBLE_CELL_TILES = 2
+
+# A coin as iterating a CollectibleGrid gives it, made on the spot from the grid's arrays
+Collectible = namedtuple("Collectible", ["index", "center_x", "center_y", "gid", "points"])
+
+
+class CollectibleGrid:
+    """The coins of a level, indexed by the grid cells they overlap.
+
+    The cells are stored as one flat array of coin indexes sorted by cell,
+    with cell_starts[cell] giving where the coins of each cell begin.  Coins
+    outside the map are kept in a short list checked one by one.
+    Iterating gives the coins that haven't been collected, in index order.
+    The bodies are only read here, so they can be dropped once it is built.
+    """
+
+    def __init__(self, bodies, width, height, cell_size):
+        bodies = list(bodies)
+        self.count = len(bodies)
+        self.width = width
+        self.height = height
+        self.cell_size = cell_size
+
+        self.center_x = array("d", [body.center_x for body in bodies])
+        self.center_y = array("d", [body.center_y for body in bodies])
+        self.gid = array("l", [body.gid for body in bodies])
+        self.points = array("l", [int(body.properties.get("Points", 0)) for body in bodies])
+        self.collected = bytearray(self.count)
+        self.remaining = self.count
+        self.picked_up = []
+
+        #Hit boxes in world coordinates
+        self.left = array("d", [body.center_x + body.hit_box[0] for body in bodies])
+        self.bottom = array("d", [body.center_y + body.hit_box[1] for body in bodies])
+        self.right = array("d", [body.center_x + body.hit_box[2] for body in bodies])
+        self.top = array("d", [body.center_y + body.hit_box[3] for body in bodies])
+
+        cell_indexes = []
+        coin_indexes = []
+        self.outside = []
+        for index in range(self.count):
+            columns, rows = self._cell_range(self.left[index], self.bottom[index],
+                                             self.right[index], self.top[index])
+            cells = [row * width + column for row in rows for column in columns]
+            if not cells:
+                self.outside.append(index)
+            cell_indexes.extend(cells)
+            coin_indexes.extend([index] * len(cells))
+
+        cell_indexes = numpy.array(cell_indexes, dtype=numpy.intp)
+        order = numpy.argsort(cell_indexes, kind="stable")
+        self.cell_coins = array("l", numpy.array(coin_indexes, dtype=numpy.intp)[order].tolist())
+        counts = numpy.bincount(cell_indexes, minlength=width * height)
+        self.cell_starts = array("l", numpy.concatenate(([0], numpy.cumsum(counts))).tolist())
+
+    @classmethod
+    def for_level(cls, level_data, bodies, scaling):
+        """Indexes the coin bodies of a level"""
+        return cls(bodies,
+                   int(math.ceil(level_data.width / COLLECTIBLE_CELL_TILES)),
+                   int(math.ceil(level_data.height / COLLECTIBLE_CELL_TILES)),
+                   COLLECTIBLE_CELL_TILES * level_data.tile_width * scaling)
+
+    def __len__(self):
+        return self.remaining
+
+    def __iter__(self):
+        collected = self.collected
+        return (Collectible(index, self.center_x[index], self.center_y[index], self.gid[index], self.points[index])
+                for index in range(self.count) if not collected[index])
+
+    def _cell_range(self, left, bottom, right, top):
+        """Columns and rows a box overlaps, clipped to the map. Touching edges don't count."""
+        cell_size = self.cell_size
+        min_x = max(int(left // cell_size), 0)
+        max_x = min(int(math.ceil(right / cell_size)) - 1, self.width - 1)
+        min_y = max(int(bottom // cell_size), 0)
+        max_y = min(int(math.ceil(top / cell_size)) - 1, self.height - 1)
+        return range(min_x, max_x + 1), range(min_y, max_y + 1)
+
+    def collect(self, body):
+        """Marks the coins overlapping body as collected and returns their indexes, lowest first"""
+        if not self.remaining:
+            return []
+        left = body.center_x + body.hit_box[0]
+        bottom = body.center_y + body.hit_box[1]
+        right = body.center_x + body.hit_box[2]
+        top = body.center_y + body.hit_box[3]
+        columns, rows = self._cell_range(left, bottom, right, top)
+
+        collected = self.collected
+        cell_starts = self.cell_starts
+        cell_coins = self.cell_coins
+        hits = []
+        for row in rows:
+            row_start = row * self.width
+            for column in columns:
+                cell_index = row_start + column
+                for index in cell_coins[cell_starts[cell_index]:cell_starts[cell_index + 1]]:
+                    # Marking a coin straight away also stops a coin in two cells being counted twice
+                    if not collected[index] and self._overlaps(index, left, bottom, right, top):
+                        collected[index] = 1
+                        hits.append(index)
+        for index in self.outside:
+            if not collected[index] and self._overlaps(index, left, bottom, right, top):
+                collected[index] = 1
+                hits.append(index)
+
+        if hits:
+            self.remaining -= len(hits)
+            hits.sort()
+            self.picked_up.extend(hits)
+        return hits
+
+    def reset(self):
+        """Puts back the coins collected since the last reset and returns their indexes"""
+        return self.unpick(0)
+
+    def unpick(self, count):
+        """Puts back the coins picked up after the first count of them and returns their indexes"""
+        restored = self.picked_up[count:]
+        collected = self.collected
+        for index in restored:
+            collected[index] = 0
+        self.remaining += len(restored)
+        del self.picked_up[count:]
+        return restored
+
+    def load_collected(self, flags):
+        """Sets which coins are collected from a flag per coin"""
+        self.collected[:] = flags
+        self.picked_up = [index for index, flag in enumerate(self.collected) if flag]
+        self.remaining = self.count - len(self.picked_up)
+
+    def _overlaps(self, index, left, bottom, right, top):
+        return (left < self.right[index] and self.left[index] < right
+                and bottom < self.top[index] and self.bottom[index] < top)
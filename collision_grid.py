@@ -0,0 +1,167 @@
+"""
+Occupancy grid for the static tile layers
+
+The Platforms, Ladders and Don't Touch layers sit on the map's tile grid, so
+instead of hashing every tile into buckets the grid keeps one slot per map
+cell holding the index of the body there.  A collision check only looks at
+the cells under the body being checked, so its cost doesn't depend on how
+big the map is or how many tiles it has.
+"""
+
+import math
+from array import array
+
+#Slot value of a cell with no body in it
+EMPTY_CELL = -1
+
+
+class CollisionGrid:
+    """Drop in for simulation.BodyList built for tile layers.
+
+    Static bodies are put in every cell their hit box overlaps.  A cell
+    normally holds one tile, the rare extra bodies of a cell (tiles bigger
+    than the grid) go in an overflow dict.  Bodies appended with moving=True,
+    and static ones outside the map, are checked one by one as in BodyList.
+    """
+
+    def __init__(self, width, height, cell_size):
+        self.width = width
+        self.height = height
+        self.cell_size = cell_size
+        self.cells = array("i", [EMPTY_CELL]) * (width * height)
+        self.overflow = {}
+        self.bodies = []
+        self.static = []
+        self.moving = []
+
+    @classmethod
+    def for_level(cls, level_data, scaling):
+        """An empty grid covering a level's map"""
+        return cls(level_data.width, level_data.height, level_data.tile_width * scaling)
+
+    def __len__(self):
+        return len(self.bodies)
+
+    def __iter__(self):
+        return iter(self.bodies)
+
+    def __getitem__(self, index):
+        return self.bodies[index]
+
+    def _cell_range(self, left, bottom, right, top):
+        """Columns and rows a box overlaps, clipped to the map. Touching edges don't count."""
+        cell_size = self.cell_size
+        min_x = max(int(left // cell_size), 0)
+        max_x = min(int(math.ceil(right / cell_size)) - 1, self.width - 1)
+        min_y = max(int(bottom // cell_size), 0)
+        max_y = min(int(math.ceil(top / cell_size)) - 1, self.height - 1)
+        return range(min_x, max_x + 1), range(min_y, max_y + 1)
+
+    def _cell_indexes(self, body):
+        columns, rows = self._cell_range(body.left, body.bottom, body.right, body.top)
+        width = self.width
+        return [row * width + column for row in rows for column in columns]
+
+    def append(self, body, moving=False):
+        self.bodies.append(body)
+        cell_indexes = [] if moving else self._cell_indexes(body)
+        if not cell_indexes:
+            self.moving.append(body)
+            return
+
+        body_index = len(self.static)
+        self.static.append(body)
+        cells = self.cells
+        for cell_index in cell_indexes:
+            if cells[cell_index] == EMPTY_CELL:
+                cells[cell_index] = body_index
+            else:
+                self.overflow.setdefault(cell_index, []).append(body_index)
+
+    def extend(self, bodies, moving=False):
+        for body in bodies:
+            self.append(body, moving)
+
+    def remove(self, body):
+        """Removes a body. Static bodies leave their slot, so removing them is not cheap."""
+        self.bodies.remove(body)
+        if body in self.moving:
+            self.moving.remove(body)
+            return
+        body_index = self.static.index(body)
+        self.static[body_index] = None
+        for cell_index in self._cell_indexes(body):
+            if self.cells[cell_index] == body_index:
+                extra = self.overflow.pop(cell_index, None)
+                self.cells[cell_index] = extra.pop(0) if extra else EMPTY_CELL
+                if extra:
+                    self.overflow[cell_index] = extra
+            elif body_index in self.overflow.get(cell_index, ()):
+                self.overflow[cell_index].remove(body_index)
+
+    def _static_hits(self, body):
+        """Yields the static bodies overlapping body"""
+        left = body.center_x + body.hit_box[0]
+        bottom = body.center_y + body.hit_box[1]
+        right = body.center_x + body.hit_box[2]
+        top = body.center_y + body.hit_box[3]
+        columns, rows = self._cell_range(left, bottom, right, top)
+
+        cells = self.cells
+        static = self.static
+        overflow = self.overflow
+        width = self.width
+        seen = None
+        for row in rows:
+            row_start = row * width
+            for column in columns:
+                cell_index = row_start + column
+                body_index = cells[cell_index]
+                if body_index == EMPTY_CELL:
+                    continue
+                if cell_index in overflow:
+                    body_indexes = [body_index] + overflow[cell_index]
+                else:
+                    body_indexes = (body_index,)
+                for body_index in body_indexes:
+                    other = static[body_index]
+                    if other is None or other is body:
+                        continue
+                    # Bodies that span cells are only reported once
+                    if seen is None:
+                        seen = set()
+                    elif body_index in seen:
+                        continue
+                    seen.add(body_index)
+                    if (left < other.center_x + other.hit_box[2]
+                            and other.center_x + other.hit_box[0] < right
+                            and bottom < other.center_y + other.hit_box[3]
+                            and other.center_y + other.hit_box[1] < top):
+                        yield other
+
+    def _moving_hits(self, body):
+        left = body.center_x + body.hit_box[0]
+        bottom = body.center_y + body.hit_box[1]
+        right = body.center_x + body.hit_box[2]
+        top = body.center_y + body.hit_box[3]
+        for other in self.moving:
+            if (other is not body
+                    and left < other.center_x + other.hit_box[2]
+                    and other.center_x + other.hit_box[0] < right
+                    and bottom < other.center_y + other.hit_box[3]
+                    and other.center_y + other.hit_box[1] < top):
+                yield other
+
+    def check_for_collision(self, body):
+        """Returns the bodies in this grid that overlap body, moving ones first as in BodyList"""
+        hit_list = list(self._moving_hits(body))
+        hit_list.extend(self._static_hits(body))
+        return hit_list
+
+    def collides(self, body):
+        """True if any body in this grid overlaps body. Stops at the first hit."""
+        for _ in self._moving_hits(body):
+            return True
+        for _ in self._static_hits(body):
+            return True
+        return False
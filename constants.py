@@ -0,0 +1,123 @@
+"""
+Constants shared by the game window and the headless simulation
+"""
+
+#Dimensions of the window
+SCREEN_WIDTH = 1600
+SCREEN_HEIGHT = 900
+
+SCREEN_TITLE = "Platformer Game"
+
+CHARACTER_SCALING = 0.7
+TILE_SCALING = 1
+COIN_SCALING = 0.5
+
+#Viewport margins before the screen starts scrolling
+LEFT_VIEWPORT_MARGIN = 500
+RIGHT_VIEWPORT_MARGIN = 800
+BOTTOM_VIEWPORT_MARGIN = 250
+TOP_VIEWPORT_MARGIN = 250
+
+PLAYER_MOVEMENT_SPEED = 7
+GRAVITY = 1
+PLAYER_JUMP_SPEED = 20
+
+#Starting position of the character sprite
+PLAYER_START_X = 200
+PLAYER_START_Y = 500
+
+RIGHT_FACING = 0
+LEFT_FACING = 1
+
+SPRITE_PIXEL_SIZE = 32
+GRID_PIXEL_SIZE = (SPRITE_PIXEL_SIZE * TILE_SCALING)
+
+#Tile layers are drawn in square chunks of this many tiles a side
+RENDER_CHUNK_TILES = 16
+
+TOTAL_LEVELS = 3
+
+#How the static tile layers are checked for collisions, "grid" or "spatial_hash"
+PHYSICS_ENGINE = "grid"
+
+#Build the tile layers a chunk at a time near the player instead of all at once
+MAP_STREAMING = False
+
+#Bytes of sprites the game keeps for streamed chunks before dropping the least recently used
+STREAMING_MEMORY_BUDGET = 32 * 1024 * 1024
+
+#Rough bytes used by one tile sprite, to weigh chunks against the budget
+STREAMING_SPRITE_BYTES = 2048
+
+#Chunks of collision bodies the simulation keeps per streamed layer
+STREAMING_GRID_CHUNKS = 64
+
+#Rings of chunks around the visible ones that are built ahead on a worker thread
+STREAMING_PRELOAD_CHUNKS = 1
+
+#Pixels past the edge of the screen within which coins, enemies and moving platforms have sprites
+ENTITY_SPRITE_MARGIN = 256
+
+#Pixels past the edge of the screen within which enemies are moved every tick
+LOD_ACTIVE_MARGIN = 128
+
+#Pixels past the edge of the screen within which enemies are moved every LOD_NEAR_INTERVAL ticks, the rest sleep
+LOD_NEAR_DISTANCE = 1024
+LOD_NEAR_INTERVAL = 4
+
+#Ticks of the game rules per second. Speeds and gravity are per tick, so this sets how fast the game plays
+SIMULATION_RATE = 60
+
+#Frames per second the window updates and draws at, which can be anything without changing the game
+RENDER_RATE = 60
+
+#Most ticks run in one frame to catch up after a stall, the rest of the stall is skipped
+MAX_CATCH_UP_STEPS = 5
+
+#Images of HUD texts kept so a text that comes back isn't rasterised again
+HUD_TEXT_CACHE_SIZE = 256
+
+#Seconds the frame rate shown on the HUD is averaged over
+HUD_FPS_INTERVAL = 0.5
+
+#Bytes kept for rewinding, a minute or more of play on the shipped levels
+REWIND_BUFFER_BYTES = 2 * 1024 * 1024
+
+#How many ticks are taken back for each tick the rewind key is held
+REWIND_SPEED = 2
+
+#Ticks between the keyframes sent to spectators, which a spectator joining or catching up starts from
+SPECTATOR_KEYFRAME_INTERVAL = 120
+
+#Ticks a spectator can fall behind before it is skipped, to be sent a keyframe of the latest tick once it catches up
+SPECTATOR_LAG_LIMIT = 60
+
+#Bytes waiting to be sent to a spectator before it is skipped the same way, whatever its lag
+SPECTATOR_BUFFER_LIMIT = 256 * 1024
+
+#File F5 quicksaves to and F9 loads from
+QUICKSAVE_FILE = "saves/quicksave.sav"
+
+#Map file for each level
+MAP_NAME = "maps/map1_level_{}.tmx"
+
+#Layer names used in the tmx map files
+PLATFORMS_LAYER_NAME = 'Platforms'
+MOVING_PLATFORMS_LAYER_NAME = 'Moving Platforms'
+COINS_LAYER_NAME = 'Coins'
+FOREGROUND_LAYER_NAME = 'Foreground'
+BACKGROUND_LAYER_NAME = 'Background'
+DONT_TOUCH_LAYER_NAME = "Don't Touch"
+MOVING_ENEMIES_LAYER_NAME = 'Moving Enemies'
+LADDERS_LAYER_NAME = "Ladders"
+
+#Sprite asset folders
+PLAYER_ASSET_PATH = "assets/mob/lion/"
+MOB_ASSET_PATH = "assets/mob/monsters/{}/"
+
+#Folders whose images are packed into the texture atlas, and where the atlas is written
+ATLAS_SOURCE_FOLDERS = ("assets/tiles", "assets/mob")
+ATLAS_FOLDER = "assets/.atlas"
+
+#Width and height of each atlas sheet in pixels
+ATLAS_SHEET_SIZE = 1024
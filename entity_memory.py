@@ -0,0 +1,138 @@
+"""
+Memory used by the coins, enemies and moving platforms of a level
+
+Builds the entities of a synthetic map from mapgen the way prepare_level
+does and measures the bytes each kind holds with tracemalloc, divided by
+how many there are.  With arcade installed it also compares a sprite for
+every entity against the EntitySprites the game keeps, which only gives
+sprites to the entities near the screen.  --headless leaves the sprites out.
+"""
+
+import argparse
+import gc
+import tracemalloc
+
+from constants import *
+from collectibles import CollectibleGrid
+from kinematics import KinematicStore
+from levelpack import load_level
+from lod import UpdateLOD
+from mapgen import map_spec, generate_map
+from simulation import object_bodies, enemy_bodies
+
+
+def measure(build):
+    """Returns (bytes still held by what build() returns, what it returned)"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return after - before, kept
+
+
+def coin_state(level_data):
+    coins = list(object_bodies(level_data, COINS_LAYER_NAME))
+    for index, coin in enumerate(coins):
+        coin.index = index
+    return CollectibleGrid.for_level(level_data, coins, TILE_SCALING)
+
+
+def moving_platform_state(level_data):
+    platforms = list(object_bodies(level_data, MOVING_PLATFORMS_LAYER_NAME))
+    for index, platform in enumerate(platforms):
+        platform.index = index
+    return platforms, KinematicStore(platforms)
+
+
+def enemy_state(level_data):
+    enemies = list(enemy_bodies(level_data))
+    store = KinematicStore(enemies, mirror=False)
+    return [enemy.mob_type for enemy in enemies], store, UpdateLOD(store)
+
+
+def simulation_report(level_data):
+    """Bytes per coin, moving platform and enemy in the simulation"""
+    # Hit boxes and textures read from the images are cached for the process, so they are loaded first
+    enemy_state(level_data)
+    counts = {
+        "coins": len(level_data.objects[COINS_LAYER_NAME]),
+        "moving_platforms": len(level_data.objects[MOVING_PLATFORMS_LAYER_NAME]),
+        "enemies": len(level_data.objects[MOVING_ENEMIES_LAYER_NAME]),
+    }
+    report = {}
+    for name, build in (("coins", coin_state), ("moving_platforms", moving_platform_state),
+                        ("enemies", enemy_state)):
+        size, _ = measure(lambda: build(level_data))
+        report[name] = {"count": counts[name], "bytes": size,
+                        "bytes_each": size / counts[name] if counts[name] else 0.0}
+    return report
+
+
+def sprite_report(level_data, sample):
+    """Bytes of a sprite for every coin and enemy against the EntitySprites kept at the level start"""
+    from entity_sprites import EntitySprites
+    from game import EnemyCharacter, tile_sprite
+
+    coins = coin_state(level_data)
+    mob_types, enemies, _ = enemy_state(level_data)
+    center_xs, center_ys, _, _ = enemies.state()
+    kinds = {
+        "coins": (len(coins), lambda index: tile_sprite(level_data.tiles[coins.gid[index]]),
+                  coins.center_x, coins.center_y, coins.gid),
+        "enemies": (len(mob_types), lambda index: EnemyCharacter(mob_types[index]),
+                    center_xs, center_ys, mob_types),
+    }
+    report = {}
+    for name, (count, make_sprite, xs, ys, kind) in kinds.items():
+        if not count:
+            continue
+        make_sprite(0)
+        sampled = min(sample, count)
+        size, _ = measure(lambda: [make_sprite(index) for index in range(sampled)])
+        sprite_bytes = size / sampled
+
+        def pooled():
+            sprites = EntitySprites(xs, ys, make_sprite, kinds=kind)
+            sprites.update_viewport(0, 0)
+            return sprites
+        pooled_size, sprites = measure(pooled)
+        report[name] = {"count": count, "sprite_bytes": sprite_bytes,
+                        "one_sprite_each_bytes": sprite_bytes * count,
+                        "sprites_near_screen": len(sprites.sprites), "entity_sprites_bytes": pooled_size}
+    return report
+
+
+def main():
+    """Prints the memory used by the entities of a synthetic map"""
+    parser = argparse.ArgumentParser(description="Measure the memory used per coin, enemy and moving platform.")
+    parser.add_argument("--width", type=int, default=2000, help="map width in tiles")
+    parser.add_argument("--height", type=int, default=100, help="map height in tiles")
+    parser.add_argument("--coins", type=int, default=20000, help="coins on the map")
+    parser.add_argument("--enemies", type=int, default=3000, help="enemies on the map")
+    parser.add_argument("--moving-platforms", type=int, default=500, help="moving platforms on the map")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the map")
+    parser.add_argument("--sample", type=int, default=500, help="sprites built to weigh one sprite")
+    parser.add_argument("--headless", action="store_true", help="leave out the sprites, which need arcade")
+    args = parser.parse_args()
+
+    spec = map_spec(args.width, args.height, args.coins, args.enemies, args.moving_platforms, args.seed)
+    level_data = load_level(1, generate_map(spec))
+    print("{}x{} tiles".format(level_data.width, level_data.height))
+    for name, entry in simulation_report(level_data).items():
+        print("  {:<18} {:>7} {:>8.0f} bytes each".format(name, entry["count"], entry["bytes_each"]))
+
+    if args.headless:
+        return
+    for name, entry in sprite_report(level_data, args.sample).items():
+        print("  {} sprites: {:.0f} KiB with one each, {:.0f} KiB for the {} near the screen".format(
+            name, entry["one_sprite_each_bytes"] / 1024, entry["entity_sprites_bytes"] / 1024,
+            entry["sprites_near_screen"]))
+
+
+if __name__ == "__main__":
+    main()
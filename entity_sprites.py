@@ -0,0 +1,128 @@
+"""
+Sprites for the entities near the screen only
+
+A level can have thousands of coins and enemies, and an arcade.Sprite for
+each costs a few kilobytes whether or not it is ever on screen.  An
+EntitySprites keeps where every entity of a kind is in arrays and only
+gives a sprite to the ones within ENTITY_SPRITE_MARGIN of the viewport.
+The sprites of entities that go off screen are pooled and handed to the
+next ones of the same kind that come on, so scrolling doesn't allocate.
+"""
+
+import arcade
+import numpy
+
+from constants import *
+
+
+class EntitySprites:
+    """Pooled sprites for the entities of one layer that are near the viewport.
+
+    make_sprite(index) builds a sprite for an entity.  kinds gives each
+    entity a key (a gid, a mob type), and a pooled sprite only goes to an
+    entity of the same kind, so it already has the right textures.
+    on_show(index, sprite) and on_hide(index) are called as entities get
+    and lose their sprite.  The sprites in use are kept in sprite_list,
+    which can be the moving sprite list of a layer so they are drawn with it.
+    """
+
+    def __init__(self, center_x, center_y, make_sprite, kinds=None, sprite_list=None,
+                 on_show=None, on_hide=None, margin=ENTITY_SPRITE_MARGIN):
+        self.center_x = numpy.array(center_x, dtype=numpy.float64)
+        self.center_y = numpy.array(center_y, dtype=numpy.float64)
+        self.make_sprite = make_sprite
+        self.kinds = kinds
+        self.sprite_list = sprite_list if sprite_list is not None else arcade.SpriteList()
+        self.on_show = on_show
+        self.on_hide = on_hide
+        self.margin = margin
+
+        #Entities that aren't drawn wherever they are, like coins picked up
+        self.hidden = numpy.zeros(len(self.center_x), dtype=bool)
+        self.sprites = {}
+        self.pool = {}
+        self.view = None
+        self.sprites_made = 0
+
+    def __len__(self):
+        return len(self.center_x)
+
+    def sprite(self, index):
+        """The sprite of an entity, None if it has none"""
+        return self.sprites.get(index)
+
+    def update_viewport(self, view_left, view_bottom, width=SCREEN_WIDTH, height=SCREEN_HEIGHT):
+        """Gives sprites to the entities near a viewport and takes them from the rest"""
+        self.view = (view_left - self.margin, view_bottom - self.margin,
+                     view_left + width + self.margin, view_bottom + height + self.margin)
+        self._refresh()
+
+    def move(self, center_x, center_y):
+        """Moves every entity, and the sprites of the ones near the viewport"""
+        self.center_x[:] = center_x
+        self.center_y[:] = center_y
+        self._refresh()
+        for index, sprite in self.sprites.items():
+            sprite.center_x = self.center_x[index]
+            sprite.center_y = self.center_y[index]
+
+    def hide(self, index):
+        self.hidden[index] = True
+        self._release(index)
+
+    def show(self, indexes):
+        """Shows the entities at indexes again"""
+        self.hidden[list(indexes)] = False
+        self._refresh()
+
+    def set_hidden(self, flags):
+        """Hides the entities whose flag is set and shows the rest"""
+        self.hidden[:] = numpy.frombuffer(bytes(flags), dtype=numpy.uint8).astype(bool)
+        self._refresh()
+
+    def _refresh(self):
+        if self.view is None:
+            return
+        left, bottom, right, top = self.view
+        center_x = self.center_x
+        center_y = self.center_y
+        near = (left <= center_x) & (center_x <= right) & (bottom <= center_y) & (center_y <= top)
+        near &= ~self.hidden
+        wanted = set(numpy.flatnonzero(near).tolist())
+        sprites = self.sprites
+        for index in [index for index in sprites if index not in wanted]:
+            self._release(index)
+        for index in wanted:
+            if index not in sprites:
+                self._take(index)
+
+    def _take(self, index):
+        """Gives an entity a sprite, from the pool if one of its kind is free"""
+        pool = self.pool.get(self.kinds[index] if self.kinds is not None else None)
+        if pool:
+            sprite = pool.pop()
+        else:
+            sprite = self.make_sprite(index)
+            self.sprites_made += 1
+        sprite.center_x = self.center_x[index]
+        sprite.center_y = self.center_y[index]
+        self.sprites[index] = sprite
+        self.sprite_list.append(sprite)
+        if self.on_show is not None:
+            self.on_show(index, sprite)
+
+    def _release(self, index):
+        """Takes an entity's sprite back into the pool"""
+        sprite = self.sprites.pop(index, None)
+        if sprite is None:
+            return
+        self.sprite_list.remove(sprite)
+        self.pool.setdefault(self.kinds[index] if self.kinds is not None else None, []).append(sprite)
+        if self.on_hide is not None:
+            self.on_hide(index)
+
+    def draw(self):
+        self.sprite_list.draw()
+
+    def update_animation(self, delta_time=1 / 60):
+        self.sprite_list.update_animation(delta_time)
@@ -2,50 +2,234 @@
 Platformer Game
 """
 
+#Times the imports and every other step up to the first frame of play
+from startup import startup_timer
+
 #Imports arcade module
+import argparse
+import functools
+import os
+import time
+from collections import namedtuple
+
 import arcade 
-#Dimensions of the window
-SCREEN_WIDTH = 1600
-SCREEN_HEIGHT = 900
+startup_timer.mark("import arcade")
+import numpy
+
+from animation import Animator, motion_flags, PLAYER_STATES, PLAYER_TRANSITIONS, MOB_STATES, MOB_TRANSITIONS
+from chunk_streamer import ChunkStreamer, StreamedLayer
+from atlas import asset_atlas
+from chunked_layer import ChunkedLayer
+from constants import *
+from entity_sprites import EntitySprites
+from hud import GameHud
+from prebake import baked_chunks
+from prefetch import LevelPrefetcher
+from profiler import FrameProfiler
+from replay import InputRecorder
+from scheduler import FixedStepScheduler
+from simulation import Simulation, Inputs, prepare_level, EVENT_COIN, EVENT_RESPAWN, EVENT_LEVEL, EVENT_GAME_OVER
+from snapshots import RewindBuffer, SaveFormatError, write_save, load_save
+from spectate import SpectatorServer
+from texture_cache import texture_cache, level_scope, PERSISTENT_SCOPE
+startup_timer.mark("import game")
+
+# Where the things that move were after a tick, to draw frames between two ticks
+Positions = namedtuple("Positions", ["player_x", "player_y", "platform_xs", "platform_ys",
+                                     "enemy_xs", "enemy_ys", "view_left", "view_bottom"])
+
+
+def interpolate(start, end, alpha):
+    """The value alpha of the way from start to end"""
+    return start + (end - start) * alpha
 
-SCREEN_TITLE = "Platformer Game" 
 
-CHARACTER_SCALING = 0.7
-TILE_SCALING = 1 
-COIN_SCALING = 0.5 
+def load_texture_pair(filename):
+    """Function what loads two verions of the texture for left/right movement"""
+    return texture_cache.texture_pair(filename)
+
+def tile_sprite(tile, scope=PERSISTENT_SCOPE):
+    """Creates the sprite for a tile of the map, animated if the tile is"""
+    if tile.frames:
+        sprite = arcade.AnimatedTimeBasedSprite(scale=TILE_SCALING)
+        sprite.frames = [arcade.AnimationKeyframe(index, duration, texture_cache.texture(source, scope=scope))
+                         for index, (source, duration) in enumerate(tile.frames)]
+        sprite.texture = sprite.frames[0].texture
+    else:
+        sprite = arcade.Sprite(scale=TILE_SCALING)
+        sprite.texture = texture_cache.tile_texture(tile, scope)
+    return sprite
+
+def tile_layer_sprites(level_data, layer_name, scope=PERSISTENT_SCOPE):
+    """Creates a chunked layer holding every tile of a tile layer"""
+    sprite_list = ChunkedLayer()
+    for gid, tile, center_x, center_y in level_data.tile_positions(layer_name, TILE_SCALING):
+        sprite = tile_sprite(tile, scope)
+        sprite.center_x = center_x
+        sprite.center_y = center_y
+        sprite_list.append(sprite)
+    return sprite_list
+
+def baked_layer_sprites(level_data, layer_name, scope=PERSISTENT_SCOPE):
+    """Creates a chunked layer from the pre-baked chunk images of a layer plus its animated tiles"""
+    try:
+        chunks = list(baked_chunks(level_data, layer_name))
+    except OSError:
+        #The maps folder can't be written to, so draw the tiles one by one
+        return tile_layer_sprites(level_data, layer_name, scope)
+
+    sprite_list = ChunkedLayer()
+    for path, center_x, center_y in chunks:
+        #Chunk images are baked at TILE_SCALING already
+        sprite = arcade.Sprite()
+        sprite.texture = texture_cache.texture(path, scope=scope)
+        sprite.center_x = center_x
+        sprite.center_y = center_y
+        sprite_list.append(sprite)
+
+    #Animated tiles like torches aren't in the chunk images
+    for gid, tile, center_x, center_y in level_data.tile_positions(layer_name, TILE_SCALING):
+        if tile.frames:
+            sprite = tile_sprite(tile, scope)
+            sprite.center_x = center_x
+            sprite.center_y = center_y
+            sprite_list.append(sprite)
+    return sprite_list
+
+def chunk_tile_sprites(level_data, layer_names, chunk_x, chunk_y, scope=PERSISTENT_SCOPE):
+    """Creates the sprites of every tile in a chunk, one list per layer. Runs on the chunk streaming thread"""
+    left = chunk_x * RENDER_CHUNK_TILES
+    bottom = chunk_y * RENDER_CHUNK_TILES
+    area = (left, bottom, left + RENDER_CHUNK_TILES, bottom + RENDER_CHUNK_TILES)
+    layers = []
+    for layer_name in layer_names:
+        sprites = []
+        for gid, tile, center_x, center_y in level_data.tile_positions(layer_name, TILE_SCALING, area):
+            sprite = tile_sprite(tile, scope)
+            sprite.center_x = center_x
+            sprite.center_y = center_y
+            sprites.append(sprite)
+        layers.append(sprites)
+    return layers
+
+def chunk_overhang(level_data):
+    """How far the biggest tile of a map sticks out of the chunk of its cell"""
+    cell_width = level_data.tile_width * TILE_SCALING
+    cell_height = level_data.tile_height * TILE_SCALING
+    return max([0] + [max(tile.width * TILE_SCALING - cell_width, tile.height * TILE_SCALING - cell_height)
+                      for tile in level_data.tiles.values()])
+
+#Tile layers a ChunkStreamer builds sprites for, background and foreground from tiles rather than baked images
+STREAMED_LAYER_NAMES = (BACKGROUND_LAYER_NAME, PLATFORMS_LAYER_NAME, FOREGROUND_LAYER_NAME,
+                        LADDERS_LAYER_NAME, DONT_TOUCH_LAYER_NAME)
+
+class LevelSprites:
+    """ The sprite lists of a level, built from its PreparedLevel """
+    def __init__(self, prepared_level):
+
+        #Textures only this level needs are loaded into its own cache scope
+        scope = level_scope(prepared_level.level)
+        level_data = prepared_level.level_data
 
-#Viewport margins before the screen starts scrolling
-LEFT_VIEWPORT_MARGIN = 500 
-RIGHT_VIEWPORT_MARGIN = 800
-BOTTOM_VIEWPORT_MARGIN = 250
-TOP_VIEWPORT_MARGIN = 250
+        #Initialises the sprite and position of the character
+        self.player_list = arcade.SpriteList()
+        self.player_sprite = PlayerCharacter()
+        self.player_list.append(self.player_sprite)
+        self.player_sprite.sync(prepared_level.player_sprite)
 
-PLAYER_MOVEMENT_SPEED = 7
-GRAVITY = 1
-PLAYER_JUMP_SPEED = 20 
+        #With streaming the tile layers only get sprites for the chunks around the camera
+        self.streamer = None
+        if prepared_level.streaming:
+            self.streamer = ChunkStreamer(
+                functools.partial(chunk_tile_sprites, level_data, STREAMED_LAYER_NAMES, scope=scope),
+                len(STREAMED_LAYER_NAMES), level_data.end_of_map, level_data.top_of_map,
+                overhang=chunk_overhang(level_data))
 
-#Starting position of the character sprite
-PLAYER_START_X = 200
-PLAYER_START_Y = 500
+        #Background
+        self.background_list = self.tile_layer(level_data, BACKGROUND_LAYER_NAME, scope, baked=True)
 
-RIGHT_FACING = 0
-LEFT_FACING = 1
+        #Foreground
+        self.foreground_list = self.tile_layer(level_data, FOREGROUND_LAYER_NAME, scope, baked=True)
 
-SPRITE_PIXEL_SIZE = 32
-GRID_PIXEL_SIZE = (SPRITE_PIXEL_SIZE * TILE_SCALING)
+        #Platforms
+        self.wall_list = self.tile_layer(level_data, PLATFORMS_LAYER_NAME, scope)
 
-TOTAL_LEVELS = 3
+        #Coins, moving platforms and enemies only get sprites near the screen, indexed as the simulation's are
 
+        #Moving Platforms
+        platforms = prepared_level.moving_platform_list
+        platform_gids = [platform.gid for platform in platforms]
+        self.moving_platform_sprites = EntitySprites(
+            [platform.center_x for platform in platforms], [platform.center_y for platform in platforms],
+            lambda index: tile_sprite(level_data.tiles[platform_gids[index]], scope),
+            kinds=platform_gids, sprite_list=self.wall_list.dynamic)
+
+        #Coins
+        coins = prepared_level.coin_list
+        self.coin_list = EntitySprites(coins.center_x, coins.center_y,
+                                       lambda index: tile_sprite(level_data.tiles[coins.gid[index]], scope),
+                                       kinds=coins.gid)
+
+        #Ladder
+        self.ladder_list = self.tile_layer(level_data, LADDERS_LAYER_NAME, scope)
+
+        #Don't Touch
+        self.dont_touch_list = self.tile_layer(level_data, DONT_TOUCH_LAYER_NAME, scope)
+
+        #The player and the enemies are animated in batches from their animation tables
+        self.player_animator = Animator(PLAYER_STATES, PLAYER_TRANSITIONS)
+        self.player_animator.add(self.player_sprite, self.player_sprite.animations)
+        self.enemy_animator = Animator(MOB_STATES, MOB_TRANSITIONS)
+        mob_types = prepared_level.enemy_mob_types
+        self.enemy_animator.add_all([texture_cache.mob_animations(mob_type, scope) for mob_type in mob_types])
+
+        #Moving Enemies, animated whether they have a sprite or not
+        center_xs, center_ys, _, _ = prepared_level.enemies.state()
+        self.enemy_sprites = EntitySprites(center_xs, center_ys,
+                                           lambda index: EnemyCharacter(mob_types[index], scope),
+                                           kinds=mob_types, sprite_list=self.dont_touch_list.dynamic,
+                                           on_show=self.enemy_animator.attach, on_hide=self.enemy_animator.detach)
+
+        #Layers that are only drawn where the viewport is
+        self.chunked_layers = [self.background_list, self.wall_list, self.coin_list,
+                               self.foreground_list, self.ladder_list, self.dont_touch_list,
+                               self.moving_platform_sprites, self.enemy_sprites]
+
+        #Builds the chunks the level starts on here, on the prefetch thread
+        if self.streamer is not None:
+            self.streamer.update_viewport(0, 0)
+
+    def tile_layer(self, level_data, layer_name, scope, baked=False):
+        """The sprites of a tile layer, streamed, from baked chunk images or one per tile"""
+        if self.streamer is not None:
+            return StreamedLayer(self.streamer, STREAMED_LAYER_NAMES.index(layer_name))
+        if baked:
+            return baked_layer_sprites(level_data, layer_name, scope)
+        return tile_layer_sprites(level_data, layer_name, scope)
+
+    def update_viewport(self, view_left, view_bottom):
+        """Picks the chunks of every layer that are on screen"""
+        if self.streamer is not None:
+            self.streamer.update_viewport(view_left, view_bottom)
+        for layer in self.chunked_layers:
+            layer.update_viewport(view_left, view_bottom)
+
+    def reset(self, restored_coins):
+        """Shows the coins a level reset put back"""
+        self.coin_list.show(restored_coins)
+
+    def show_coins(self, collected):
+        """Shows or hides every coin, from a flag per coin that is set if it was collected"""
+        self.coin_list.set_hidden(collected)
+
+    def close(self):
+        """Stops building chunks for a level that is no longer played"""
+        if self.streamer is not None:
+            self.streamer.shutdown()
 
-def load_texture_pair(filename):
-    """Function what loads two verions of the texture for left/right movement"""
-    return [
-            arcade.load_texture(filename),
-            arcade.load_texture(filename, flipped_horizontally=True)
-        ]
 
 class PlayerCharacter(arcade.Sprite):
-    """ Player Sprite"""
+    """ Player Sprite, animated by an Animator with the PLAYER_STATES table"""
     def __init__(self):
 
         # Set up parent class
@@ -54,122 +238,31 @@ class PlayerCharacter(arcade.Sprite):
         # Sets default direction to right
         self.character_face_direction = RIGHT_FACING
 
-        # The counter for the current active texture of an animation
-        self.cur_walk_texture = 0
-        self.cur_idle_texture = 0
-        self.cur_death_texture = 0
-
         self.scale = CHARACTER_SCALING
 
         # Track the state
-        self.jumping = False
-        self.climbing = False
         self.is_on_ladder = False
         self.dead = False
-        self.respawned = False
-        self.frames = 0
 
-        # Loads the sprite textures
-        main_path = "assets/mob/lion/"
-
-
-        # Load textures for jumping, falling and the intial standing.
-        self.jump_texture_pair = load_texture_pair("{}jump.png".format(main_path))
-        self.fall_texture_pair = load_texture_pair("{}fall.png".format(main_path))
-        self.inital_texture_pair = load_texture_pair("{}idle0.png".format(main_path))
-        
-        #Loads the idle animation textures into a list
-        self.idle_textures = []
-        for i in range(5):
-            texture = load_texture_pair("{}idle{}.png".format(main_path,i))
-            self.idle_textures.append(texture)
-
-        #Loads the walking animation textures into a list
-        self.walk_textures = []
-        for i in range(6):
-            texture = load_texture_pair("{}run{}.png".format(main_path,i))
-            self.walk_textures.append(texture)
-
-        #Loads the death animation textures into a list
-        self.death_textures = []
-        for i in range(7):
-            texture = load_texture_pair("{}death{}.png".format(main_path,i))
-            self.death_textures.append(texture)
-
-        # Loads the climbing textures
-        self.climbing_textures = []
-        texture = arcade.load_texture("{}climb0.png".format(main_path))
-        self.climbing_textures.append(texture)
-        texture = arcade.load_texture("{}climb1.png".format(main_path))
-        self.climbing_textures.append(texture)
+        # Shares the player textures with every other PlayerCharacter
+        self.animations = texture_cache.player_animations()
 
         # Set the initial texture
-        self.texture = self.inital_texture_pair[0]
-
-    def update_animation(self, delta_time):
-        '''Method that sets the texture everytime the game updates'''
-
-        #Updates the current frame
-        self.frames += 1
-
-        # Flips the texture depending on the direction of motion
-        if self.change_x < 0 and self.character_face_direction == RIGHT_FACING and not self.dead:
-            self.character_face_direction = LEFT_FACING
-        elif self.change_x > 0 and self.character_face_direction == LEFT_FACING and not self.dead:
-            self.character_face_direction = RIGHT_FACING
-
-        # Death Animation
-        if self.dead:
-            if self.frames % 7 == 0:
-                self.cur_death_texture += 1
-                if self.cur_death_texture > 6:
-                    self.cur_death_texture = 0
-                    self.respawned = True
-                else:
-                    self.texture = self.death_textures[self.cur_death_texture][self.character_face_direction]
-            return
-
-        # Climbing animation
-        if self.is_on_ladder:
-            self.climbing = True
-        if not self.is_on_ladder and self.climbing:
-            self.climbing = False
-        if self.climbing and abs(self.change_y) > 1:
-            if self.frames & 1: self.cur_walk_texture += 1 
-            if self.cur_walk_texture > 7:
-                self.cur_walk_texture = 0
-        if self.climbing:
-            self.texture = self.climbing_textures[self.cur_walk_texture // 4]
-            return
-
-        # Jumping animation, dependant on whether the sprite is on a ladder or not
-        if self.change_y > 0 and not self.is_on_ladder:
-            self.texture = self.jump_texture_pair[self.character_face_direction]
-            return
-        elif self.change_y < 0 and not self.is_on_ladder:
-            self.texture = self.fall_texture_pair[self.character_face_direction]    
-            return
-
-        
-
-        # Idle animation
-        if self.change_x == 0:
-            if self.frames % 7 == 0:
-                self.cur_idle_texture += 1
-                if self.cur_idle_texture > 4:
-                    self.cur_idle_texture = 0
-                self.texture = self.idle_textures[self.cur_idle_texture][self.character_face_direction]
-            return
-
-        # Walking animation
-        if self.frames % 3 == 0: self.cur_walk_texture += 1
-        if self.cur_walk_texture > 5:
-            self.cur_walk_texture = 0
-        self.texture = self.walk_textures[self.cur_walk_texture][self.character_face_direction]
+        self.texture = self.animations.initial[0]
+
+    def sync(self, body):
+        """Copies the position and state of the simulated player"""
+        self.center_x = body.center_x
+        self.center_y = body.center_y
+        self.change_x = body.change_x
+        self.change_y = body.change_y
+        self.character_face_direction = body.character_face_direction
+        self.is_on_ladder = body.is_on_ladder
+        self.dead = body.dead
 
 class EnemyCharacter(arcade.Sprite):
-    """ Player Sprite"""
-    def __init__(self, mob_type):
+    """ Enemy Sprite, animated by an Animator with the MOB_STATES table"""
+    def __init__(self, mob_type, scope=PERSISTENT_SCOPE):
 
         # Set up parent class
         super().__init__()
@@ -177,73 +270,29 @@ class EnemyCharacter(arcade.Sprite):
         # Sets default direction to right
         self.character_face_direction = RIGHT_FACING
 
-        # The counter for the current active texture of an animation
-        self.cur_walk_texture = 0
-        self.cur_idle_texture = 0
-
         self.scale = 1
 
-        self.frames = 0
-
-        # Loads the sprite textures depending on which mob type it is
-        main_path = "assets/mob/monsters/{}/".format(mob_type)
-
-
-        #Loads the initial standing texture
-        self.inital_texture_pair = load_texture_pair("{}idle0.png".format(main_path))
-
-        #Loads the idle animation textures into a list
-        self.idle_textures = []
-        for i in range(4):
-            texture = load_texture_pair("{}idle{}.png".format(main_path,i))
-            self.idle_textures.append(texture)
-
-        #Loads the walking animation textures into a list
-        self.walk_textures = []
-        for i in range(6):
-            texture = load_texture_pair("{}run{}.png".format(main_path,i))
-            self.walk_textures.append(texture)
+        # Shares the textures with every other enemy of the same mob type
+        self.animations = texture_cache.mob_animations(mob_type, scope)
 
         # Set the initial texture
-        self.texture = self.inital_texture_pair[0]
-    def update_animation(self, delta_time): 
-        '''Method that sets the texture everytime the game updates'''
-
-        #Updates the current frame
-        self.frames += 1
-
-        # Flips the texture depending on the direction of motion
-        if self.change_x < 0 and self.character_face_direction == LEFT_FACING:
-            self.character_face_direction = RIGHT_FACING
-        elif self.change_x > 0 and self.character_face_direction == RIGHT_FACING:
-            self.character_face_direction = LEFT_FACING
-
-        # Idle animation
-        if self.change_x == 0:
-            if self.frames % 7 == 0:
-                self.cur_idle_texture += 1
-                if self.cur_idle_texture > 3:
-                    self.cur_idle_texture = 0
-                self.texture = self.idle_textures[self.cur_idle_texture][self.character_face_direction]
-            return
-
-        # Walking animation
-        if self.frames % 5 == 0: self.cur_walk_texture += 1
-        if self.cur_walk_texture > 5:
-            self.cur_walk_texture = 0
-        self.texture = self.walk_textures[self.cur_walk_texture][self.character_face_direction]
+        self.texture = self.animations.initial[0]
 
   
 class GameOverView(arcade.View):
     """ View that shows when game is over """
 
-    def __init__(self):
+    def __init__(self, game_view=None):
         """ This is run once when we switch to this view """
         super().__init__()
          #Loads the image that is displayed
-        self.texture = arcade.load_texture("assets/game_over.png")
+        self.texture = texture_cache.texture("assets/game_over.png")
 
-               
+        #The game that ended is played again, or a new one is warmed up while this screen is shown
+        self.game_view = game_view
+        if game_view is None:
+            self.game_view = MyGame()
+            self.game_view.warm_up()
 
     def on_draw(self):
         """ Draws on the screen"""
@@ -255,8 +304,11 @@ class GameOverView(arcade.View):
 
     def on_mouse_press(self, _x, _y, _button, _modifiers):
         """Starts the game on click """
-        game_view = MyGame()
-        game_view.setup(game_view.level)
+        game_view = self.game_view
+        if game_view.first_level is not None:
+            game_view.new_game()
+        else:
+            game_view.setup(game_view.level)
         #Reloads the game on the mouse click
         self.window.show_view(game_view)
 
@@ -268,9 +320,11 @@ class InstructionView(arcade.View):
         """ This is run once when we switch to this view """
         super().__init__()
          #Loads the image that is displayed
-        self.texture = arcade.load_texture("assets/startscreen.png")
+        self.texture = texture_cache.texture("assets/startscreen.png")
 
-               
+        #Loads the first level and the textures on the prefetch thread while the instructions are read
+        self.game_view = MyGame()
+        self.game_view.warm_up()
 
     def on_draw(self):
         """ Draws on the screen"""
@@ -278,201 +332,404 @@ class InstructionView(arcade.View):
         #Draws the image on the screen
         self.texture.draw_sized(SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2,
                                 SCREEN_WIDTH, SCREEN_HEIGHT)
+        startup_timer.mark("title drawn")
+
     def on_mouse_press(self, _x, _y, _button, _modifiers):
         """ If the user presses the mouse button, start the game. """
-        game_view = MyGame()
+        startup_timer.mark("start clicked")
+        game_view = self.game_view
         game_view.setup(game_view.level)
+        startup_timer.mark("game set up")
         #Reloads the game on the mouse click
         self.window.show_view(game_view)
 
 
 class MyGame(arcade.View):
-    '''The main game'''
-    def __init__(self):
+    '''The main game, drawing the state of a headless Simulation'''
+
+    #Folder every game's key presses are recorded to as a replay, None to not record
+    record_folder = None
+
+    #Folder frame profiles are dumped to. Games start with the profiler on if it is set
+    profile_folder = None
+
+    #Builds the tile layers a chunk at a time around the player instead of all at once
+    streaming = MAP_STREAMING
+
+    #Prints the startup timings once the first frame of play is drawn
+    startup_report = False
+
+    #SpectatorServer every tick is sent to, None when nobody is spectating
+    spectators = None
+
+    def __init__(self, physics_engine=PHYSICS_ENGINE, map_name=MAP_NAME, last_level=TOTAL_LEVELS,
+                 streaming=None):
 
         super().__init__()
 
+        #Collision engine the levels are prepared for, "grid" or "spatial_hash"
+        self.physics_engine = physics_engine
+
+        #Map file pattern the levels are loaded from
+        self.map_name = map_name
+
+        self.last_level = last_level
+
+        if streaming is not None:
+            self.streaming = streaming
+
+        #Prepares the next level on a worker thread while this one is played, up to last_level
+        self.prefetcher = LevelPrefetcher(self.prepare_level, last_level)
+
+        #Times each phase of a frame, F3 turns it and its overlay on and off, F4 dumps it
+        self.profiler = FrameProfiler(enabled=self.profile_folder is not None)
+
+        #Score, level, frame rate and profiler readouts, drawn in screen space
+        self.hud = GameHud()
+
+        #The game rules run in the simulation, this view only draws them
+        self.simulation = Simulation(level_loader=self.take_level, profiler=self.profiler)
+
+        #The level the game started on, kept to start the game again without building it again
+        self.first_level = None
+
+        #What changed each tick, so the game can be taken back while BACKSPACE is held
+        self.rewind_buffer = RewindBuffer()
+        self.rewinding = False
+
+        #Runs the simulation at SIMULATION_RATE whatever rate the window updates at
+        self.scheduler = FixedStepScheduler()
+
+        #Positions before the last tick, None when the next frame shouldn't be drawn between ticks
+        self.previous_positions = None
+
+        #(left, bottom) of the viewport as it was last set
+        self.viewport = None
+
         #Initialises all the variables
         self.coin_list=None 
         self.wall_list=None 
         self.ladder_list = None
         self.player_list=None 
         self.player_sprite=None
-        self.enemy_sprite=None
-        self.enemy_sprite=None  
-        self.physics_engine=None
-        self.view_bottom=0 
-        self.view_left=0 
-        self.score=0 
         self.foreground_list = None
         self.background_list = None
         self.dont_touch_list = None
-        self.end_of_map = None
+        self.enemy_sprites = None
+        self.moving_platform_sprites = None
+        self.level_sprites = None
+        self.recorder = None
         self.up_pressed = False
         self.down_pressed = False
         self.left_pressed = False
         self.right_pressed = False
-        self.jump_needs_reset = False
-        self.level = 1
         self.background = None
+        self.frames_drawn = 0
+
+    @property
+    def level(self):
+        return self.simulation.level
+
+    @property
+    def score(self):
+        return self.simulation.score
+
+    @property
+    def view_left(self):
+        return self.simulation.view_left
+
+    @property
+    def view_bottom(self):
+        return self.simulation.view_bottom
+
+    @property
+    def end_of_map(self):
+        return self.simulation.end_of_map
+
+    def prepare_level(self, level):
+        """ Builds the bodies and sprites of a level. Runs on the prefetch thread """
+        prepared_level = prepare_level(level, self.physics_engine, self.map_name, self.streaming)
+        prepared_level.sprites = LevelSprites(prepared_level)
+        return prepared_level
+
+    def take_level(self, level):
+        """ The prepared level the simulation switches to, from the prefetcher """
+        return self.prefetcher.take(level)
+
+    def warm_up(self):
+        """ Starts preparing the first level and loading the textures every level uses on the prefetch thread """
+        self.prefetcher.prefetch(self.level)
+        self.prefetcher.run(self.load_textures)
+
+    def load_textures(self):
+        """ Loads the textures the game needs whatever the level """
+        asset_atlas()
+        startup_timer.mark("atlas read")
+        texture_cache.player_animations()
+        texture_cache.texture("assets/background.png")
+        texture_cache.texture("assets/game_over.png")
+        startup_timer.mark("warm up done")
 
     def setup(self, level):
         """ Set up the game here. This is run for each level """
+        self.simulation.setup(level)
+        if self.first_level is None:
+            self.first_level = self.simulation.prepared_level
+        self.install_sprites()
+        self.scheduler.reset()
+        self.show_state()
+
+        if self.recorder is None:
+            self.start_recording()
+
+    def restart_level(self):
+        """ Plays the current level again, putting back only what the player changed """
+        restored = self.simulation.restart_level()
+        self.level_sprites.reset(restored)
+        self.restarted()
+
+    def new_game(self):
+        """ Plays the game again from its first level, reusing what was built for it """
+        self.prefetcher.shutdown()
+        self.prefetcher = LevelPrefetcher(self.prepare_level, self.last_level)
+        restored = self.simulation.restart_level(self.first_level)
+        self.prefetcher.prefetch(self.level + 1)
+        self.install_sprites()
+        self.level_sprites.reset(restored)
+        self.up_pressed = False
+        self.down_pressed = False
+        self.left_pressed = False
+        self.right_pressed = False
+        self.restarted()
+
+    def restarted(self):
+        """ Catches the view up with a level the simulation started again """
+        #A replay can't go back in time, so what follows is recorded to a new one
+        self.save_recording()
+        self.start_recording()
+        self.rewind_buffer.clear()
+        self.apply_inputs()
+        self.scheduler.reset()
+        self.show_state()
+
+    def show_state(self):
+        """ Moves the sprites and the viewport to where the simulation was put """
+        #Things jumped there, so nothing is drawn on the way
+        self.previous_positions = None
+        self.sync_sprites()
+        self.scroll()
+
+    def scroll(self):
+        """ Moves the viewport to the camera of the last synced frame, if it moved """
+        viewport = (int(round(self.drawn_view_left)), int(round(self.drawn_view_bottom)))
+        if viewport != self.viewport:
+            self.viewport = viewport
+            view_left, view_bottom = viewport
+            arcade.set_viewport(view_left, SCREEN_WIDTH + view_left, view_bottom, SCREEN_HEIGHT + view_bottom)
+            self.level_sprites.update_viewport(view_left, view_bottom)
+
+    def stop_recording(self):
+        """ Saves the replay so far and records no more of this game """
+        #A replay has to start at the start of a level, so it can't carry on after going back in time
+        self.save_recording()
+        self.recorder = None
+
+    def rewind(self, ticks):
+        """ Takes the game back ticks ticks, as far as the rewind buffer goes """
+        back, restored = self.rewind_buffer.rewind(self.simulation, ticks)
+        if back:
+            self.stop_recording()
+            self.level_sprites.reset(restored)
+            self.show_state()
+
+    def quicksave(self):
+        """ Saves the state of the game to QUICKSAVE_FILE """
+        write_save(self.simulation, QUICKSAVE_FILE)
+
+    def quickload(self):
+        """ Puts the game back in the state of QUICKSAVE_FILE """
+        level = self.level
+        try:
+            load_save(self.simulation, QUICKSAVE_FILE)
+        except (OSError, SaveFormatError) as error:
+            print("Could not load the quicksave: {}".format(error))
+            #The level only changes once the save is known to fit it, but the sprites have to follow it regardless
+            if self.level != level:
+                self.install_sprites()
+                self.stop_recording()
+                self.rewind_buffer.clear()
+            return
+        if self.level != level:
+            self.install_sprites()
+        self.level_sprites.show_coins(self.simulation.coin_list.collected)
+        self.stop_recording()
+        self.rewind_buffer.clear()
+        self.apply_inputs()
+        self.show_state()
+
+    def start_recording(self):
+        """ Records the game from here on, if games are recorded """
+        if self.record_folder is None:
+            return
+        self.recorder = InputRecorder(self.simulation)
+        name = time.strftime("replay_%Y%m%d-%H%M%S")
+        if self.simulation.ticks:
+            name += "_{}".format(self.simulation.ticks)
+        self.record_path = os.path.join(self.record_folder, name + ".rpl")
+
+    def save_recording(self):
+        """ Writes the replay of this game so far, if it is being recorded """
+        if self.recorder is not None:
+            self.recorder.save(self.record_path)
+
+    def save_profile(self):
+        """ Dumps the frame profile to JSON and CSV files, if any frames were profiled """
+        if self.profiler.frame_count == 0:
+            return
+        path = os.path.join(self.profile_folder or "profiles", time.strftime("profile_%Y%m%d-%H%M%S"))
+        self.profiler.write_json(path + ".json")
+        self.profiler.write_csv(path + ".csv")
+
+    def install_sprites(self):
+        """ Switches to the sprites of the level the simulation has loaded """
+        level_sprites = self.simulation.prepared_level.sprites
+        if self.level_sprites is not None and self.level_sprites is not level_sprites:
+            self.level_sprites.close()
+        self.level_sprites = level_sprites
+        level_sprites.update_viewport(self.view_left, self.view_bottom)
+
+        self.player_list = level_sprites.player_list
+        self.player_sprite = level_sprites.player_sprite
+        self.background_list = level_sprites.background_list
+        self.foreground_list = level_sprites.foreground_list
+        self.wall_list = level_sprites.wall_list
+        self.coin_list = level_sprites.coin_list
+        self.ladder_list = level_sprites.ladder_list
+        self.dont_touch_list = level_sprites.dont_touch_list
+        self.enemy_sprites = level_sprites.enemy_sprites
+        self.moving_platform_sprites = level_sprites.moving_platform_sprites
+
+        self.background = texture_cache.texture("assets/background.png")
+
+        #Drops the textures that only earlier levels used, keeping the one being prefetched
+        texture_cache.evict_levels(level_scope(self.level), level_scope(self.level + 1))
+
+    def positions(self):
+        """ Where the things that move are in the simulation now """
+        player = self.simulation.player_sprite
+        platform_xs, platform_ys, _, _ = self.simulation.moving_platforms.state()
+        enemy_xs, enemy_ys, _, _ = self.simulation.enemies.state()
+        return Positions(player.center_x, player.center_y, platform_xs, platform_ys,
+                         enemy_xs, enemy_ys, self.view_left, self.view_bottom)
+
+    def sync_sprites(self, alpha=1.0):
+        """ Moves the sprites to where the simulation has put things.
+
+        With alpha under 1 they are drawn that far of the way from where they
+        were before the last tick to where they are now.
+        """
+        self.player_sprite.sync(self.simulation.player_sprite)
+        current = self.positions()
+        previous = self.previous_positions
+        if previous is not None and alpha < 1:
+            current = Positions(interpolate(previous.player_x, current.player_x, alpha),
+                                interpolate(previous.player_y, current.player_y, alpha),
+                                [interpolate(start, end, alpha)
+                                 for start, end in zip(previous.platform_xs, current.platform_xs)],
+                                [interpolate(start, end, alpha)
+                                 for start, end in zip(previous.platform_ys, current.platform_ys)],
+                                [interpolate(start, end, alpha)
+                                 for start, end in zip(previous.enemy_xs, current.enemy_xs)],
+                                [interpolate(start, end, alpha)
+                                 for start, end in zip(previous.enemy_ys, current.enemy_ys)],
+                                interpolate(previous.view_left, current.view_left, alpha),
+                                interpolate(previous.view_bottom, current.view_bottom, alpha))
+            self.player_sprite.center_x = current.player_x
+            self.player_sprite.center_y = current.player_y
+        self.drawn_view_left = current.view_left
+        self.drawn_view_bottom = current.view_bottom
+
+        #Moving platforms and enemies sync from the simulation's kinematic stores
+        self.moving_platform_sprites.move(current.platform_xs, current.platform_ys)
+        self.enemy_sprites.move(current.enemy_xs, current.enemy_ys)
+
+    def animate(self, delta_time):
+        """ Advances the player and enemy animations by delta_time seconds """
+        player = self.player_sprite
+        self.level_sprites.player_animator.update(delta_time,
+                                                  motion_flags([player.change_x], [player.change_y],
+                                                               [player.dead], [player.is_on_ladder]),
+                                                  [player.character_face_direction])
+
+        enemy_animator = self.level_sprites.enemy_animator
+        _, _, change_xs, _ = self.simulation.enemies.state()
+        change_x = numpy.array(change_xs, dtype=numpy.float64)
+        #The mob images face left, so they are flipped to face the way they walk
+        facing = numpy.where(change_x < 0, RIGHT_FACING,
+                             numpy.where(change_x > 0, LEFT_FACING, enemy_animator.facing))
+        enemy_animator.update(delta_time, motion_flags(change_x, 0), facing)
 
-        #Sets up the main lists
-        self.player_list = arcade.SpriteList()
-        self.wall_list = arcade.SpriteList()
-        self.coin_list = arcade.SpriteList()
-        self.dont_touch_list = arcade.SpriteList()
-        self.ladder_list = arcade.SpriteList()
-        self.foreground_list = arcade.SpriteList()
-        self.background_list = arcade.SpriteList()
-        self.foreground_list = arcade.SpriteList()
-        
-        #Initialises the sprite and position of the character
-        self.player_sprite = PlayerCharacter()
-        self.player_list.append(self.player_sprite)
-        self.player_sprite.center_x = PLAYER_START_X
-        self.player_sprite.center_y = PLAYER_START_Y
-
-        self.view_bottom=0 
-        self.view_left=0 
-        self.score=0
-        self.background = arcade.load_texture("assets/background.png")
-        self.dont_touch_list = arcade.SpriteList()
-
-        #Sets the layers from the tmx map file
-        platforms_layer_name = 'Platforms'
-        moving_platforms_layer_name = 'Moving Platforms'
-        coins_layer_name = 'Coins'
-        foreground_layer_name = 'Foreground'
-        background_layer_name = 'Background'
-        foreground_layer_name = 'Foreground'
-        dont_touch_layer_name = "Don't Touch"       
-        moving_enemies_layer_name = 'Moving Enemies'
-        ladders_layer_name = "Ladders"
-
-        #Sets the map name based on the current level
-        map_name = ("maps/map1_level_{}.tmx".format(level))
-
-        # Read in the tiled map
-        my_map = arcade.tilemap.read_tmx(map_name)
-
-        # Calculates the top and right edge of the map
-        self.end_of_map = my_map.map_size.width * GRID_PIXEL_SIZE
-        self.top_of_map = my_map.map_size.height * GRID_PIXEL_SIZE
-
-        #Adds the map elements into lists
-
-        #Background
-        self.background_list = arcade.tilemap.process_layer(my_map,
-                                                            background_layer_name,
-                                                            TILE_SCALING)
-        self.foreground_list = arcade.tilemap.process_layer(my_map,
-                                                            foreground_layer_name,
-                                                            TILE_SCALING)
-
-        #Foreground
-        self.foreground_list = arcade.tilemap.process_layer(my_map,
-                                                            foreground_layer_name,
-                                                            TILE_SCALING)
-
-        #Platforms
-        self.wall_list = arcade.tilemap.process_layer(map_object=my_map,
-                                                      layer_name=platforms_layer_name,
-                                                      scaling=TILE_SCALING,
-                                                      use_spatial_hash=True)
-        
-        #Moving Platforms
-        moving_platforms_list = arcade.tilemap.process_layer(my_map, moving_platforms_layer_name, TILE_SCALING)
-        for sprite in moving_platforms_list:
-            self.wall_list.append(sprite)                                            
-
-        #Coins
-        self.coin_list = arcade.tilemap.process_layer(my_map,
-                                                      coins_layer_name,
-                                                      TILE_SCALING,
-                                                      use_spatial_hash=True)
-        #Ladder
-        self.ladder_list = arcade.tilemap.process_layer(my_map,
-                                                      ladders_layer_name,
-                                                      TILE_SCALING,
-                                                      use_spatial_hash=True)
-        #Don't Touch
-        self.dont_touch_list = arcade.tilemap.process_layer(my_map,
-                                                            dont_touch_layer_name,
-                                                            TILE_SCALING,
-                                                            use_spatial_hash=True)
-        #Moving Enemies                                                    
-        moving_enemies_list = arcade.tilemap.process_layer(my_map, moving_enemies_layer_name, TILE_SCALING)
-        for mob in moving_enemies_list:
-            self.enemy_sprite = EnemyCharacter(mob.properties['mob_type'])
-            self.dont_touch_list.append(self.enemy_sprite)
-            #Sets the properties of the enemy to the properties specified in the map file
-            self.enemy_sprite.center_x = mob.center_x   
-            self.enemy_sprite.center_y = mob.center_y
-            self.enemy_sprite.boundary_left = mob.boundary_left
-            self.enemy_sprite.boundary_right = mob.boundary_right
-            self.enemy_sprite.change_x = mob.change_x
-
-        
-        #Initialises the physics engine
-        self.physics_engine = arcade.PhysicsEnginePlatformer(self.player_sprite,
-                                                            self.wall_list,GRAVITY,
-                                                            ladders=self.ladder_list) 
-
-
- 
     def on_draw(self):
         """ Render the screen. """
+        profiler = self.profiler
+        profiler.start("draw")
         
         arcade.start_render()
 
         #Draws the background image
-        arcade.draw_lrwh_rectangle_textured(0+self.view_left, 0+self.view_bottom,
+        view_left, view_bottom = self.viewport
+        arcade.draw_lrwh_rectangle_textured(0+view_left, 0+view_bottom,
                                             SCREEN_WIDTH, SCREEN_HEIGHT,
                                             self.background) 
+        profiler.lap("draw.sky")
         #Draws all the lists   
         self.background_list.draw()
+        profiler.lap("draw.background")
         self.wall_list.draw()
+        profiler.lap("draw.walls")
         self.coin_list.draw()
+        profiler.lap("draw.coins")
         self.foreground_list.draw()
+        profiler.lap("draw.foreground")
         self.ladder_list.draw()
+        profiler.lap("draw.ladders")
         self.dont_touch_list.draw()
+        profiler.lap("draw.dont_touch")
         self.player_list.draw()
-        #Draws the score
-        score_text=("Score: {}".format(self.score)) 
-        arcade.draw_text(score_text, 10 + self.view_left, 10 + self.view_bottom, arcade.csscolor.BLACK, 30) 
-
-
-    def process_keychange(self):
-
-        # Process up/down 
-        if self.up_pressed and not self.down_pressed and not self.player_sprite.dead:
-            if self.physics_engine.is_on_ladder():
-                self.player_sprite.change_y = PLAYER_MOVEMENT_SPEED
-            elif self.physics_engine.can_jump() and not self.jump_needs_reset:
-                self.player_sprite.change_y = PLAYER_JUMP_SPEED
-                self.jump_needs_reset = True
-                
-        elif self.down_pressed and not self.up_pressed:
-            if self.physics_engine.is_on_ladder():
-                self.player_sprite.change_y = -PLAYER_MOVEMENT_SPEED
-
-        # Process up/down when on a ladder and no movement
-        if self.physics_engine.is_on_ladder():
-            if not self.up_pressed and not self.down_pressed:
-                self.player_sprite.change_y = 0
-            elif self.up_pressed and self.down_pressed:
-                self.player_sprite.change_y = 0
-
-        # Process left/right
-        if self.right_pressed and not self.left_pressed:
-            self.player_sprite.change_x = PLAYER_MOVEMENT_SPEED
-        elif self.left_pressed and not self.right_pressed and self.player_sprite.left>0:
-            self.player_sprite.change_x = -PLAYER_MOVEMENT_SPEED
-        else:
-            self.player_sprite.change_x = 0
+        profiler.lap("draw.player")
+        #Draws the score, level, frame rate and profiler readouts, only rasterising the ones that changed
+        self.hud.update(self.score, self.level, profiler)
+        self.hud.draw()
+        profiler.lap("draw.hud")
+        profiler.stop("draw")
+        profiler.end_frame()
+
+        #The game is interactive once its first frame is up
+        self.frames_drawn += 1
+        if self.frames_drawn == 1:
+            startup_timer.mark("first game frame")
+            if self.startup_report:
+                self.report_startup()
+
+    def report_startup(self):
+        """ Prints how long each step up to the first frame of play took """
+        for line in startup_timer.report_lines():
+            print(line)
+        click_to_play = startup_timer.between("start clicked", "first game frame")
+        if click_to_play is not None:
+            print("  Click to first frame: {:.1f} ms, level {}".format(
+                click_to_play * 1000, "warmed" if self.prefetcher.waits == 0 else "still loading"))
+
+    def inputs(self):
+        """ The keys currently held, as simulation inputs """
+        return Inputs(self.up_pressed, self.down_pressed, self.left_pressed, self.right_pressed)
+
+    def apply_inputs(self):
+        """ Passes the keys held to the simulation, recording them if asked to """
+        inputs = self.inputs()
+        if self.recorder is not None:
+            self.recorder.record(inputs)
+        self.simulation.set_inputs(inputs)
 
     def on_key_press(self, key, modifiers):
         """Called whenever a key is pressed. """
@@ -485,150 +742,150 @@ class MyGame(arcade.View):
             self.left_pressed = True
         elif key == arcade.key.RIGHT or key == arcade.key.D:
             self.right_pressed = True
-        self.process_keychange()
+        elif key == arcade.key.F3:
+            self.profiler.enabled = not self.profiler.enabled
+        elif key == arcade.key.F4:
+            self.save_profile()
+        elif key == arcade.key.R:
+            self.restart_level()
+            return
+        elif key == arcade.key.BACKSPACE:
+            self.rewinding = True
+        elif key == arcade.key.F5:
+            self.quicksave()
+        elif key == arcade.key.F9:
+            self.quickload()
+            return
+        self.apply_inputs()
 
     def on_key_release(self, key, modifiers):
         """Called when the user releases a key. """
 
         if key == arcade.key.UP or key == arcade.key.W:
             self.up_pressed = False
-            self.jump_needs_reset = False
         elif key == arcade.key.DOWN or key == arcade.key.S:
             self.down_pressed = False
         elif key == arcade.key.LEFT or key == arcade.key.A:
             self.left_pressed = False
         elif key == arcade.key.RIGHT or key == arcade.key.D:
             self.right_pressed = False
-        self.process_keychange()
+        elif key == arcade.key.BACKSPACE:
+            self.rewinding = False
+        self.apply_inputs()
 
 
     def on_update(self, delta_time):
-        self.physics_engine.update()
-        # Update animations
-        if self.physics_engine.can_jump():
-            self.player_sprite.can_jump = False
-        else:
-            self.player_sprite.can_jump = True
+        profiler = self.profiler
+        profiler.start("update")
 
-        if self.physics_engine.is_on_ladder() and not self.physics_engine.can_jump():
-            self.player_sprite.is_on_ladder = True
-            self.process_keychange()
-        else:
-            self.player_sprite.is_on_ladder = False
-            self.process_keychange()
-
-        self.wall_list.update()
-    
-        # Sees if the wall hit a boundary and needs to reverse direction.
-        for wall in self.wall_list:
-
-            if wall.boundary_right and wall.right > wall.boundary_right and wall.change_x > 0:
-                wall.change_x *= -1
-            if wall.boundary_left and wall.left < wall.boundary_left and wall.change_x < 0:
-                wall.change_x *= -1
-            if wall.boundary_top and wall.top > wall.boundary_top and wall.change_y > 0:
-                wall.change_y *= -1
-            if wall.boundary_bottom and wall.bottom < wall.boundary_bottom and wall.change_y < 0:
-                wall.change_y *= -1
-        
-        self.dont_touch_list.update_animation(delta_time)
-        self.dont_touch_list.update()
+        #Runs the ticks due for the time that has passed, so the game plays at the same speed at any frame rate
+        steps = self.scheduler.advance(delta_time)
+        for step in range(steps):
+            if step == steps - 1:
+                self.previous_positions = self.positions()
+            if not self.tick():
+                profiler.stop("update")
+                return
 
-        #Sees if the enemy his a boundary and needs to reverse direction
-        for enemy in self.dont_touch_list:
+        self.sync_sprites(self.scheduler.alpha)
+        profiler.lap("update.sync")
 
-            if enemy.boundary_right and enemy.right > enemy.boundary_right and enemy.change_x > 0:
-                enemy.change_x *= -1
-            if enemy.boundary_left and enemy.left < enemy.boundary_left and enemy.change_x < 0:
-                enemy.change_x *= -1
-    
         #calls the update_animation method
-        self.player_list.update_animation(delta_time)
+        self.animate(delta_time)
+        self.dont_touch_list.update_animation(delta_time)
         self.foreground_list.update_animation(delta_time)
+        profiler.lap("update.animation")
+
+        #Scrolls the viewport if the camera has moved
+        self.scroll()
+        profiler.lap("update.viewport")
+        profiler.stop("update")
+
+    def tick(self):
+        """ Runs one tick of the game rules. Returns False if the game ended. """
+        profiler = self.profiler
+
+        #While BACKSPACE is held the game goes back instead of on
+        if self.rewinding:
+            self.rewind(REWIND_SPEED)
+            profiler.lap("update.rewind")
+            self.publish()
+            return True
+
+        events = self.simulation.step()
+
+        for event in events:
+            if event.kind == EVENT_COIN:
+                # Hide the coin the player picked up, its sprite goes back to the pool
+                self.coin_list.hide(event.index)
+            elif event.kind == EVENT_RESPAWN:
+                self.previous_positions = None
+            elif event.kind == EVENT_LEVEL:
+                # The simulation switched to the next level, prefetched if it was ready
+                self.install_sprites()
+                self.previous_positions = None
+            elif event.kind == EVENT_GAME_OVER:
+                self.prefetcher.shutdown()
+                self.level_sprites.close()
+                self.save_recording()
+                if self.profile_folder is not None:
+                    self.save_profile()
+                #Calls the game over view method
+                view = GameOverView(self)
+                self.window.show_view(view)
+                return False
 
-        # See if we hit any coins, removing duplicates 
-        coin_hit_list = list(set(arcade.check_for_collision_with_list(self.player_sprite,self.coin_list)))
-
-        # Loop through each coin we hit (if any) and remove it 
-        for coin in coin_hit_list: 
-            # Remove the coin 
-            coin.remove_from_sprite_lists()
-            self.score += coin.properties["Points"]  
-
-        # Track if we need to change the viewport 
-        changed = False 
-
-        # See if the played collided with an enemy/water
-        if arcade.check_for_collision_with_list(self.player_sprite,self.dont_touch_list):
-            self.player_sprite.dead = True
-        #Makes the player movement speed 0 if they are dead.    
-        if self.player_sprite.dead:
-            self.player_sprite.change_x = 0
-            self.player_sprite.change_y = 0
-
-        #Respawns the player at the start of the level
-        if self.player_sprite.respawned:
-            self.player_sprite.center_x = PLAYER_START_X
-            self.player_sprite.center_y = PLAYER_START_Y
-            self.player_sprite.respawned = False
-            self.player_sprite.dead = False
-            self.view_left = 0
-            self.view_bottom = 0
-            changed = True
+        profiler.lap("update.events")
 
-        
-        # Scroll left 
-        left_boundary = self.view_left + LEFT_VIEWPORT_MARGIN 
-        if self.player_sprite.left < left_boundary and self.view_left>15: 
-            self.view_left -= left_boundary - self.player_sprite.left 
-            changed = True 
-        #Scroll right 
-        right_boundary = self.view_left + SCREEN_WIDTH - RIGHT_VIEWPORT_MARGIN 
-        if self.player_sprite.right > right_boundary and self.view_left<self.end_of_map - SCREEN_WIDTH: 
-            self.view_left += self.player_sprite.right - right_boundary 
-            changed = True 
-        # Scroll up 
-        top_boundary = self.view_bottom + SCREEN_HEIGHT - TOP_VIEWPORT_MARGIN 
-        if self.player_sprite.top > top_boundary and self.view_bottom<self.top_of_map - SCREEN_HEIGHT: 
-            self.view_bottom += self.player_sprite.top - top_boundary 
-            changed = True 
-        # Scroll down 
-        bottom_boundary = self.view_bottom + BOTTOM_VIEWPORT_MARGIN 
-        if self.player_sprite.bottom < bottom_boundary and self.view_bottom>20: 
-            self.view_bottom -= bottom_boundary - self.player_sprite.bottom 
-            changed = True 
+        self.rewind_buffer.capture(self.simulation)
+        profiler.lap("update.snapshot")
+        self.publish()
+        return True
 
-        
-        # See if the user got to the end of the level
-        if self.player_sprite.center_x >= self.end_of_map:
-            # Advance to the next level
-            self.level += 1
-            # Set the camera to the start
-            self.view_left = 0
-            self.view_bottom = 0
-            changed = True
-
-            if self.level <= TOTAL_LEVELS:
-                # Load the next level
-                self.setup(self.level)
-
-            else:
-                #Calls the game over view method
-                view = GameOverView()
-                self.window.show_view(view)
-        
-        #Scrolls the viewport is the viewport has changed
-        if changed: 
-            self.view_bottom = int(self.view_bottom) 
-            self.view_left = int(self.view_left) 
-            arcade.set_viewport(self.view_left, (SCREEN_WIDTH + self.view_left), self.view_bottom, (SCREEN_HEIGHT + self.view_bottom)) 
+    def publish(self):
+        """ Sends the tick to the spectators, only encoding it on this thread """
+        if self.spectators is not None:
+            self.spectators.publish(self.simulation)
+            self.profiler.lap("update.spectators")
 
 
 def main():
     """ Main method """
+    parser = argparse.ArgumentParser(description=SCREEN_TITLE)
+    parser.add_argument("--record", metavar="FOLDER", help="record every game to a replay file in FOLDER")
+    parser.add_argument("--profile", metavar="FOLDER",
+                        help="profile every frame and dump the timings to FOLDER on game over and exit")
+    parser.add_argument("--streaming", action="store_true",
+                        help="build the tile layers a chunk at a time around the player")
+    parser.add_argument("--fps", type=float, default=RENDER_RATE,
+                        help="frames drawn per second, the game plays at the same speed whatever it is")
+    parser.add_argument("--startup", action="store_true",
+                        help="print how long each step of starting up took, up to the first frame of play")
+    parser.add_argument("--spectate", metavar="ADDRESS",
+                        help="stream the game to spectators on HOST:PORT or a Unix socket path")
+    args = parser.parse_args()
+    MyGame.record_folder = args.record
+    MyGame.profile_folder = args.profile
+    MyGame.streaming = args.streaming or MAP_STREAMING
+    MyGame.startup_report = args.startup
+    if args.spectate:
+        MyGame.spectators = SpectatorServer(args.spectate).start()
+        print("Spectate with: python spectate.py --connect {}".format(MyGame.spectators.bound_address))
+
     window = arcade.Window(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE)
+    window.set_update_rate(1 / args.fps)
+    startup_timer.mark("window created")
     start_view = InstructionView()
     window.show_view(start_view)
     arcade.run()
+
+    #Saves the game that was still being played when the window closed
+    current_view = getattr(window, "current_view", None)
+    if isinstance(current_view, MyGame):
+        current_view.save_recording()
+        if current_view.profile_folder is not None:
+            current_view.save_profile()
+    if MyGame.spectators is not None:
+        MyGame.spectators.close()
 if __name__ == "__main__":
     main()
@@ -0,0 +1,160 @@
+"""
+Heads up display drawn in screen space
+
+arcade.draw_text builds a cache key and draws through a sprite list of its
+own on every call, and its text has to be placed where the viewport has
+scrolled to.  A Hud keeps one sprite per element in a single sprite list
+and draws it with the projection set to the screen, so elements stay where
+they were put whatever the camera does.  An element is only rasterised
+again when its text changes, and the images of the texts shown lately are
+kept, so a value that comes back (a frame rate, a profiler readout) is not
+rasterised again either.
+"""
+
+import time
+from collections import OrderedDict
+
+import arcade
+
+from constants import *
+
+
+class HudText:
+    """A line of text at a fixed place on the screen, made by Hud.text"""
+
+    def __init__(self, hud, x, y, font_size, color, anchor_x):
+        self.hud = hud
+        self.x = x
+        self.y = y
+        self.font_size = font_size
+        self.color = color
+        self.anchor_x = anchor_x
+        self.text = ""
+        self.sprite = None
+        self.shown = False
+
+    def set(self, text):
+        """Shows text, or nothing if it is empty. The image is only changed on the next draw if text is new."""
+        if text != self.text:
+            self.text = text
+            self.hud.dirty.add(self)
+
+    def refresh(self):
+        """Puts the image of the text on the sprite, and the sprite in the HUD's list or out of it"""
+        sprite_list = self.hud.sprite_list
+        if not self.text:
+            if self.shown:
+                sprite_list.remove(self.sprite)
+                self.shown = False
+            return
+        if self.sprite is None:
+            self.sprite = arcade.Sprite()
+        sprite = self.sprite
+        sprite.texture = self.hud.text_texture(self.text, self.color, self.font_size)
+        # Placed by the bottom left, or bottom right, corner as draw_text does
+        if self.anchor_x == "right":
+            sprite.center_x = self.x - sprite.width / 2
+        else:
+            sprite.center_x = self.x + sprite.width / 2
+        sprite.center_y = self.y + sprite.height / 2
+        if not self.shown:
+            sprite_list.append(sprite)
+            self.shown = True
+
+
+class Hud:
+    """Text elements in screen coordinates, drawn in one batch"""
+
+    def __init__(self, width=SCREEN_WIDTH, height=SCREEN_HEIGHT, cache_size=HUD_TEXT_CACHE_SIZE):
+        self.width = width
+        self.height = height
+        self.sprite_list = arcade.SpriteList()
+        self.dirty = set()
+        self.cache_size = cache_size
+        self.textures = OrderedDict()
+        self.renders = 0
+        self.cache_hits = 0
+
+    def text(self, x, y, font_size, color=arcade.csscolor.BLACK, anchor_x="left"):
+        """Adds a text element with its bottom left (or right) corner at x, y on the screen"""
+        return HudText(self, x, y, font_size, color, anchor_x)
+
+    def text_texture(self, text, color, font_size):
+        """The texture of a text, rasterised the first time it is seen lately"""
+        key = (text, tuple(color), font_size)
+        texture = self.textures.get(key)
+        if texture is not None:
+            self.cache_hits += 1
+            self.textures.move_to_end(key)
+            return texture
+        self.renders += 1
+        # Sprite lists tell textures apart by name, so the name is the whole key
+        texture = arcade.Texture("hud-{}-{}-{}".format(text, key[1], font_size),
+                                 arcade.get_text_image(text, color, font_size))
+        self.textures[key] = texture
+        if len(self.textures) > self.cache_size:
+            self.textures.popitem(last=False)
+        return texture
+
+    def draw(self):
+        """Draws every element over whatever the world viewport is"""
+        for element in self.dirty:
+            element.refresh()
+        self.dirty.clear()
+        if not len(self.sprite_list):
+            return
+        left, right, bottom, top = arcade.get_viewport()
+        arcade.set_viewport(0, self.width, 0, self.height)
+        self.sprite_list.draw()
+        arcade.set_viewport(left, right, bottom, top)
+
+
+class FrameRateCounter:
+    """Frames drawn per second, averaged over interval seconds so the readout doesn't flicker"""
+
+    def __init__(self, interval=HUD_FPS_INTERVAL):
+        self.interval = interval
+        self.start_time = None
+        self.frames = 0
+        self.fps = None
+
+    def frame(self, now=None):
+        """Counts a frame. Returns the frame rate, None until the first interval has passed."""
+        if now is None:
+            now = time.perf_counter()
+        if self.start_time is None:
+            self.start_time = now
+            return self.fps
+        self.frames += 1
+        elapsed = now - self.start_time
+        if elapsed >= self.interval:
+            self.fps = self.frames / elapsed
+            self.start_time = now
+            self.frames = 0
+        return self.fps
+
+
+class GameHud(Hud):
+    """The score, level, frame rate and profiler readouts of the game"""
+
+    def __init__(self, width=SCREEN_WIDTH, height=SCREEN_HEIGHT):
+        super().__init__(width, height)
+        self.score = self.text(10, 10, 30)
+        self.level = self.text(10, height - 40, 20)
+        self.fps = self.text(width - 10, height - 30, 14, anchor_x="right")
+        self.profiler_lines = []
+        self.frame_rate = FrameRateCounter()
+
+    def update(self, score, level, profiler=None):
+        """Sets the readouts, counting a frame for the frame rate. Only the ones that changed are rasterised."""
+        self.score.set("Score: {}".format(score))
+        self.level.set("Level: {}".format(level))
+        fps = self.frame_rate.frame()
+        self.fps.set("{:.0f} FPS".format(fps) if fps is not None else "")
+
+        #The profiler readouts go above the score, one element per phase
+        lines = profiler.overlay_lines() if profiler is not None and profiler.enabled else []
+        while len(self.profiler_lines) < len(lines):
+            self.profiler_lines.append(self.text(10, 60 + 16 * len(self.profiler_lines), 12))
+        for index, element in enumerate(self.profiler_lines):
+            element.set(lines[index] if index < len(lines) else "")
@@ -0,0 +1,469 @@
+"""
+Struct of arrays store for the moving platforms and enemies
+
+Position, velocity, hit box and bounds of every kinematic body of a level
+live in NumPy arrays, so moving them and reversing them at their bounds is
+a handful of array operations instead of a Python loop.  The Body objects
+the collision code reads are written back afterwards, so the per tick cost
+depends on the number of moving things, never on the number of tiles.
+
+Each NumPy call costs about a microsecond however short the arrays are, so
+stores with only a few bodies (like the shipped levels) keep looping over
+the bodies themselves, which is faster until there are a few dozen.
+
+A batched store can also move only some of its bodies a tick, or jump
+them on by many ticks at once, which is what an UpdateLOD (lod.py) does
+with the enemies far from the camera.
+"""
+
+import math
+
+import numpy
+
+#Fewest bodies a store moves with array operations
+BATCH_MIN_BODIES = 48
+
+
+def _overlaps(body1, body2):
+    """True if the two hit boxes overlap, same as simulation.check_for_collision"""
+    return (body1.center_x + body1.hit_box[0] < body2.center_x + body2.hit_box[2]
+            and body2.center_x + body2.hit_box[0] < body1.center_x + body1.hit_box[2]
+            and body1.center_y + body1.hit_box[1] < body2.center_y + body2.hit_box[3]
+            and body2.center_y + body2.hit_box[1] < body1.center_y + body1.hit_box[3])
+
+
+def _ticks_to_turn(position, velocity, edge_low, edge_high, low, high):
+    """Ticks until each body turns round, inf for bodies that never will.
+
+    A body moving towards high turns the first tick its edge_high is past
+    high, and one moving towards low the first tick its edge_low is past
+    low, as in KinematicStore.update().
+    """
+    speed = numpy.abs(velocity)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        ticks = numpy.where(velocity > 0, (high - edge_high - position) / speed,
+                            (position + edge_low - low) / speed)
+        ticks = numpy.floor(ticks) + 1
+    ticks[numpy.isnan(ticks) | (velocity == 0)] = numpy.inf
+    numpy.maximum(ticks, 1, out=ticks)
+
+    # The division can round across a whole tick, so the tick found is checked as update() would
+    def past(count):
+        moved = position + numpy.where(numpy.isfinite(count), count, 0) * velocity
+        return numpy.where(velocity > 0, moved + edge_high > high, moved + edge_low < low)
+
+    ticks[(ticks > 1) & numpy.isfinite(ticks) & past(ticks - 1)] -= 1
+    ticks[numpy.isfinite(ticks) & ~past(ticks)] += 1
+    return ticks
+
+
+def _patrol(position, velocity, edge_low, edge_high, low, high, ticks):
+    """Positions and velocities of bodies after each moves on its own number of ticks.
+
+    Each body goes straight to where it next turns round rather than a tick
+    at a time.  Once a body has turned at both ends it goes round the same
+    loop, so whole loops are skipped and no body needs more than four legs.
+    """
+    position = position.copy()
+    velocity = velocity.copy()
+    remaining = numpy.asarray(ticks, dtype=numpy.float64).copy()
+    for leg in range(4):
+        if not remaining.any():
+            break
+        to_turn = _ticks_to_turn(position, velocity, edge_low, edge_high, low, high)
+        if leg == 2:
+            # The last turn was a true crossing of a boundary, so the way back is as long as the way there
+            loop = 2 * to_turn
+            looping = numpy.isfinite(loop) & (remaining > 0)
+            remaining[looping] %= loop[looping]
+        step = numpy.minimum(to_turn, remaining)
+        position += step * velocity
+        turned = (step == to_turn) & (step > 0)
+        numpy.negative(velocity, out=velocity, where=turned)
+        remaining -= step
+    return position, velocity
+
+
+def _body_ticks_to_turn(position, velocity, edge_low, edge_high, low, high):
+    """_ticks_to_turn() of one body, None if it never turns"""
+    if velocity > 0 and high == high:
+        ticks = max(math.floor((high - edge_high - position) / velocity) + 1, 1)
+        if ticks > 1 and position + (ticks - 1) * velocity + edge_high > high:
+            ticks -= 1
+        if not position + ticks * velocity + edge_high > high:
+            ticks += 1
+        return ticks
+    if velocity < 0 and low == low:
+        ticks = max(math.floor((position + edge_low - low) / -velocity) + 1, 1)
+        if ticks > 1 and position + (ticks - 1) * velocity + edge_low < low:
+            ticks -= 1
+        if not position + ticks * velocity + edge_low < low:
+            ticks += 1
+        return ticks
+    return None
+
+
+def _patrol_body(position, velocity, edge_low, edge_high, low, high, ticks):
+    """_patrol() of one body, which is quicker for a handful of bodies than the array version"""
+    for leg in range(4):
+        if ticks <= 0:
+            break
+        to_turn = _body_ticks_to_turn(position, velocity, edge_low, edge_high, low, high)
+        if to_turn is None:
+            position += ticks * velocity
+            break
+        if leg == 2:
+            ticks %= 2 * to_turn
+        step = min(to_turn, ticks)
+        position += step * velocity
+        if step == to_turn:
+            velocity = -velocity
+        ticks -= step
+    return position, velocity
+
+
+def _column(bodies, name):
+    """Float array of a Body attribute, NaN where it is None"""
+    return numpy.array([numpy.nan if getattr(body, name) is None else getattr(body, name)
+                        for body in bodies], dtype=numpy.float64)
+
+
+class KinematicStore:
+    """The kinematic state of a list of Bodies, kept in parallel arrays.
+
+    When batched, the arrays are the real state and the bodies are a mirror
+    of them refreshed by sync_bodies().  A boundary that is None in the body
+    is NaN here, which every comparison treats as "no boundary".  Stores
+    smaller than batch_min_bodies move the bodies one by one instead.
+
+    Bodies nothing else reads (like the enemies, which are only looked at
+    through the store) can be dropped with mirror=False, leaving a batched
+    store with only its arrays and bodies None.
+    """
+
+    def __init__(self, bodies, batch_min_bodies=BATCH_MIN_BODIES, mirror=True):
+        self.bodies = list(bodies)
+        self.count = len(self.bodies)
+        self.batched = self.count >= batch_min_bodies
+        self.center_x = _column(self.bodies, "center_x")
+        self.center_y = _column(self.bodies, "center_y")
+        self.change_x = _column(self.bodies, "change_x")
+        self.change_y = _column(self.bodies, "change_y")
+        self.boundary_left = _column(self.bodies, "boundary_left")
+        self.boundary_right = _column(self.bodies, "boundary_right")
+        self.boundary_top = _column(self.bodies, "boundary_top")
+        self.boundary_bottom = _column(self.bodies, "boundary_bottom")
+
+        hit_boxes = numpy.array([body.hit_box for body in self.bodies],
+                                dtype=numpy.float64).reshape(-1, 4)
+        self.hit_box_left = hit_boxes[:, 0].copy()
+        self.hit_box_bottom = hit_boxes[:, 1].copy()
+        self.hit_box_right = hit_boxes[:, 2].copy()
+        self.hit_box_top = hit_boxes[:, 3].copy()
+
+        # The game loop treats a boundary of 0 as no boundary at all
+        self.update_boundary_left = self._nonzero(self.boundary_left)
+        self.update_boundary_right = self._nonzero(self.boundary_right)
+        self.update_boundary_top = self._nonzero(self.boundary_top)
+        self.update_boundary_bottom = self._nonzero(self.boundary_bottom)
+
+        # Velocities only ever change sign, so a body that starts still on an axis stays still
+        self.moves_vertically = bool(self.change_y.any())
+
+        # Where every body started, for reset()
+        self.initial_state = (self.center_x.copy(), self.center_y.copy(),
+                              self.change_x.copy(), self.change_y.copy())
+
+        if self.batched and not mirror:
+            self.bodies = None
+
+    @staticmethod
+    def _nonzero(boundary):
+        return numpy.where(boundary == 0, numpy.nan, boundary)
+
+    def __len__(self):
+        return self.count
+
+    def patrols_cleanly(self):
+        """Mask of the bodies that can never be past both boundaries of an axis at once.
+
+        update() turns such a body round twice in a tick, so it can only be
+        stepped, never moved on by fast_forward().
+        """
+        clean = numpy.ones(self.count, dtype=bool)
+        for edge_low, edge_high, low, high in ((self.hit_box_left, self.hit_box_right,
+                                                self.update_boundary_left, self.update_boundary_right),
+                                               (self.hit_box_bottom, self.hit_box_top,
+                                                self.update_boundary_bottom, self.update_boundary_top)):
+            clean &= ~(high - edge_high < low - edge_low)
+        return clean
+
+    def sync_bodies(self, indexes=None):
+        """Copies the arrays back into the Body objects, only those at indexes if given"""
+        if self.bodies is None:
+            return
+        if indexes is not None:
+            bodies = self.bodies
+            for index, center_x, center_y, change_x, change_y in zip(indexes.tolist(),
+                                                                     self.center_x[indexes].tolist(),
+                                                                     self.center_y[indexes].tolist(),
+                                                                     self.change_x[indexes].tolist(),
+                                                                     self.change_y[indexes].tolist()):
+                body = bodies[index]
+                body.center_x = center_x
+                body.center_y = center_y
+                body.change_x = change_x
+                body.change_y = change_y
+            return
+        if not self.moves_vertically:
+            for body, center_x, change_x in zip(self.bodies, self.center_x.tolist(),
+                                                self.change_x.tolist()):
+                body.center_x = center_x
+                body.change_x = change_x
+            return
+        for body, center_x, center_y, change_x, change_y in zip(self.bodies,
+                                                                self.center_x.tolist(),
+                                                                self.center_y.tolist(),
+                                                                self.change_x.tolist(),
+                                                                self.change_y.tolist()):
+            body.center_x = center_x
+            body.center_y = center_y
+            body.change_x = change_x
+            body.change_y = change_y
+
+    def reset(self):
+        """Puts every body back where it started, moving the way it started"""
+        self.load_state(*self.initial_state)
+
+    def load_state(self, center_x, center_y, change_x, change_y):
+        """Moves the bodies to the positions and velocities in the arrays, as state() gives them"""
+        self.center_x[:] = center_x
+        self.center_y[:] = center_y
+        self.change_x[:] = change_x
+        self.change_y[:] = change_y
+        if self.bodies is None:
+            return
+        for body, values in zip(self.bodies, zip(self.center_x.tolist(), self.center_y.tolist(),
+                                                 self.change_x.tolist(), self.change_y.tolist())):
+            body.center_x, body.center_y, body.change_x, body.change_y = values
+
+    def state(self):
+        """Lists of center_x, center_y, change_x and change_y of the bodies, for syncing sprites"""
+        if self.batched:
+            return (self.center_x.tolist(), self.center_y.tolist(),
+                    self.change_x.tolist(), self.change_y.tolist())
+        return ([body.center_x for body in self.bodies], [body.center_y for body in self.bodies],
+                [body.change_x for body in self.bodies], [body.change_y for body in self.bodies])
+
+    def move_with_player(self, player):
+        """The moving platform step of the physics engine.
+
+        Moves every platform that has a velocity, stops it at its boundaries
+        (reversing it if it was heading out) and pushes the player out of
+        the way of platforms moving sideways into them, in the same order
+        arcade's PhysicsEnginePlatformer does for each platform.
+        """
+        if not self.batched:
+            self._move_bodies_with_player(player)
+            return
+        center_x = self.center_x
+        change_x = self.change_x
+
+        active = (change_x != 0) | (self.change_y != 0)
+        if not active.any():
+            return
+
+        numpy.add(center_x, change_x, out=center_x, where=active)
+
+        stop = center_x + self.hit_box_left <= self.boundary_left
+        stop &= active
+        numpy.subtract(self.boundary_left, self.hit_box_left, out=center_x, where=stop)
+        stop &= change_x < 0
+        numpy.negative(change_x, out=change_x, where=stop)
+
+        stop = center_x + self.hit_box_right >= self.boundary_right
+        stop &= active
+        numpy.subtract(self.boundary_right, self.hit_box_right, out=center_x, where=stop)
+        stop &= change_x > 0
+        numpy.negative(change_x, out=change_x, where=stop)
+
+        # Each push moves the player, so the platforms after it are checked again
+        start = 0
+        while start < self.count:
+            hits = numpy.flatnonzero(self._player_hits(player, start) & active[start:])
+            if len(hits) == 0:
+                break
+            index = start + int(hits[0])
+            if change_x[index] < 0:
+                player.right = float(center_x[index] + self.hit_box_left[index])
+            if change_x[index] > 0:
+                player.left = float(center_x[index] + self.hit_box_right[index])
+            start = index + 1
+
+        if self.moves_vertically:
+            center_y = self.center_y
+            change_y = self.change_y
+            numpy.add(center_y, change_y, out=center_y, where=active)
+
+            stop = center_y + self.hit_box_top >= self.boundary_top
+            stop &= active
+            numpy.subtract(self.boundary_top, self.hit_box_top, out=center_y, where=stop)
+            stop &= change_y > 0
+            numpy.negative(change_y, out=change_y, where=stop)
+
+            stop = center_y + self.hit_box_bottom <= self.boundary_bottom
+            stop &= active
+            numpy.subtract(self.boundary_bottom, self.hit_box_bottom, out=center_y, where=stop)
+            stop &= change_y < 0
+            numpy.negative(change_y, out=change_y, where=stop)
+
+        self.sync_bodies()
+
+    def _player_hits(self, player, start):
+        """Mask of the bodies from start on that overlap the player. Touching edges don't count."""
+        center_x = self.center_x[start:]
+        center_y = self.center_y[start:]
+        hits = player.left < center_x + self.hit_box_right[start:]
+        hits &= center_x + self.hit_box_left[start:] < player.right
+        hits &= player.bottom < center_y + self.hit_box_top[start:]
+        hits &= center_y + self.hit_box_bottom[start:] < player.top
+        return hits
+
+    def update(self, indexes=None):
+        """Moves every body by its velocity and reverses the ones past a boundary.
+
+        As in the game loop, a boundary of 0 counts as no boundary.  A body
+        past both of its boundaries is reversed twice, as it was there too.
+        A batched store can be given an index array to move only those bodies.
+        """
+        if not self.batched:
+            self._update_bodies()
+            return
+        if indexes is not None:
+            self._update_some(indexes)
+            return
+        center_x = self.center_x
+        change_x = self.change_x
+        center_x += change_x
+        past_right = center_x + self.hit_box_right > self.update_boundary_right
+        past_right &= change_x > 0
+        past_left = center_x + self.hit_box_left < self.update_boundary_left
+        past_left &= past_right | (change_x < 0)
+        past_right ^= past_left
+        numpy.negative(change_x, out=change_x, where=past_right)
+
+        if self.moves_vertically:
+            center_y = self.center_y
+            change_y = self.change_y
+            center_y += change_y
+            past_top = center_y + self.hit_box_top > self.update_boundary_top
+            past_top &= change_y > 0
+            past_bottom = center_y + self.hit_box_bottom < self.update_boundary_bottom
+            past_bottom &= past_top | (change_y < 0)
+            past_top ^= past_bottom
+            numpy.negative(change_y, out=change_y, where=past_top)
+
+        self.sync_bodies()
+
+    def _update_some(self, indexes):
+        """update() of the bodies at indexes"""
+        center_x = self.center_x[indexes] + self.change_x[indexes]
+        change_x = self.change_x[indexes]
+        past_right = center_x + self.hit_box_right[indexes] > self.update_boundary_right[indexes]
+        past_right &= change_x > 0
+        past_left = center_x + self.hit_box_left[indexes] < self.update_boundary_left[indexes]
+        past_left &= past_right | (change_x < 0)
+        past_right ^= past_left
+        numpy.negative(change_x, out=change_x, where=past_right)
+        self.center_x[indexes] = center_x
+        self.change_x[indexes] = change_x
+
+        if self.moves_vertically:
+            center_y = self.center_y[indexes] + self.change_y[indexes]
+            change_y = self.change_y[indexes]
+            past_top = center_y + self.hit_box_top[indexes] > self.update_boundary_top[indexes]
+            past_top &= change_y > 0
+            past_bottom = center_y + self.hit_box_bottom[indexes] < self.update_boundary_bottom[indexes]
+            past_bottom &= past_top | (change_y < 0)
+            past_top ^= past_bottom
+            numpy.negative(change_y, out=change_y, where=past_top)
+            self.center_y[indexes] = center_y
+            self.change_y[indexes] = change_y
+
+        self.sync_bodies(indexes)
+
+    def fast_forward(self, indexes, ticks):
+        """Moves the bodies at indexes on as if update() had been called ticks times.
+
+        ticks is a count for each body.  The bodies jump from one boundary to
+        the next instead of stepping, so this costs the same for a tick or an
+        hour, and lands where stepping would while positions and speeds are
+        multiples of a power of two, as tile maps give.  Only bodies that
+        patrols_cleanly() can be moved this way, and only in a batched store.
+        """
+        axes = [(self.center_x, self.change_x, self.hit_box_left, self.hit_box_right,
+                 self.update_boundary_left, self.update_boundary_right)]
+        if self.moves_vertically:
+            axes.append((self.center_y, self.change_y, self.hit_box_bottom, self.hit_box_top,
+                         self.update_boundary_bottom, self.update_boundary_top))
+        for center, change, edge_low, edge_high, low, high in axes:
+            if len(indexes) >= BATCH_MIN_BODIES:
+                center[indexes], change[indexes] = _patrol(center[indexes], change[indexes], edge_low[indexes],
+                                                           edge_high[indexes], low[indexes], high[indexes], ticks)
+                continue
+            for index, count in zip(indexes.tolist(), numpy.asarray(ticks).tolist()):
+                center[index], change[index] = _patrol_body(center[index], change[index], edge_low[index],
+                                                            edge_high[index], low[index], high[index], count)
+        self.sync_bodies(indexes)
+
+    def _move_bodies_with_player(self, player):
+        """move_with_player() one body at a time"""
+        for platform in self.bodies:
+            if platform.change_x != 0 or platform.change_y != 0:
+                platform.center_x += platform.change_x
+
+                if platform.boundary_left is not None \
+                        and platform.left <= platform.boundary_left:
+                    platform.left = platform.boundary_left
+                    if platform.change_x < 0:
+                        platform.change_x *= -1
+
+                if platform.boundary_right is not None \
+                        and platform.right >= platform.boundary_right:
+                    platform.right = platform.boundary_right
+                    if platform.change_x > 0:
+                        platform.change_x *= -1
+
+                if _overlaps(player, platform):
+                    if platform.change_x < 0:
+                        player.right = platform.left
+                    if platform.change_x > 0:
+                        player.left = platform.right
+
+                platform.center_y += platform.change_y
+
+                if platform.boundary_top is not None \
+                        and platform.top >= platform.boundary_top:
+                    platform.top = platform.boundary_top
+                    if platform.change_y > 0:
+                        platform.change_y *= -1
+
+                if platform.boundary_bottom is not None \
+                        and platform.bottom <= platform.boundary_bottom:
+                    platform.bottom = platform.boundary_bottom
+                    if platform.change_y < 0:
+                        platform.change_y *= -1
+
+    def _update_bodies(self):
+        """update() one body at a time"""
+        for body in self.bodies:
+            body.update()
+
+            if body.boundary_right and body.right > body.boundary_right and body.change_x > 0:
+                body.change_x *= -1
+            if body.boundary_left and body.left < body.boundary_left and body.change_x < 0:
+                body.change_x *= -1
+            if body.boundary_top and body.top > body.boundary_top and body.change_y > 0:
+                body.change_y *= -1
+            if body.boundary_bottom and body.bottom < body.boundary_bottom and body.change_y < 0:
+                body.change_y *= -1
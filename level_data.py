@@ -0,0 +1,255 @@
+"""
+Level data read from the tmx maps
+
+LevelData holds what the game needs from a map with no arcade objects: the
+tile table, every tile layer as a flat array of gids and every object layer
+as a list of MapObjects.  It can come from a tmx file (read_level) or from a
+compiled level file (levelpack).
+"""
+
+import os
+from array import array
+from collections import namedtuple
+
+import numpy
+import pytiled_parser
+from PIL import Image
+
+from atlas import asset_atlas
+from constants import *
+
+FLIPPED_HORIZONTALLY_FLAG = 0x80000000
+FLIPPED_VERTICALLY_FLAG = 0x40000000
+FLIPPED_DIAGONALLY_FLAG = 0x20000000
+FLIP_FLAGS = FLIPPED_HORIZONTALLY_FLAG | FLIPPED_VERTICALLY_FLAG | FLIPPED_DIAGONALLY_FLAG
+
+# A tile as it is drawn for one gid. width, height and hit_box are after flipping,
+# frames is a tuple of (source, duration in ms) for animated tiles.
+TileInfo = namedtuple("TileInfo", ["source", "width", "height", "hit_box",
+                                   "flipped_horizontally", "flipped_vertically",
+                                   "flipped_diagonally", "frames"])
+
+# A tile placed in an object layer, in Tiled's coordinates
+MapObject = namedtuple("MapObject", ["gid", "x", "y", "width", "height", "properties"])
+
+_hit_box_cache = {}
+
+
+def image_hit_box(source, flipped_horizontally=False, flipped_vertically=False, flipped_diagonally=False):
+    """Returns the (left, bottom, right, top) hit box of an image relative to its centre.
+
+    This is the bounding box of the non transparent pixels, which is what
+    arcade's "Simple" hit box algorithm wraps.  None if the image is empty.
+    Images in an up to date asset atlas take the box it worked out.
+    """
+    key = (source, flipped_horizontally, flipped_vertically, flipped_diagonally)
+    if key not in _hit_box_cache:
+        atlas = asset_atlas(build=False)
+        if atlas is not None and source in atlas:
+            _hit_box_cache[key] = atlas.hit_box(*key)
+        else:
+            image = Image.open(source).convert("RGBA")
+            # Same order as arcade.load_texture
+            if flipped_diagonally:
+                image = image.transpose(Image.TRANSPOSE)
+            if flipped_horizontally:
+                image = image.transpose(Image.FLIP_LEFT_RIGHT)
+            if flipped_vertically:
+                image = image.transpose(Image.FLIP_TOP_BOTTOM)
+            width, height = image.size
+            box = image.split()[-1].getbbox()
+            if box is None:
+                _hit_box_cache[key] = None
+            else:
+                x1, y1, x2, y2 = box
+                _hit_box_cache[key] = (x1 - width / 2, height / 2 - y2,
+                                       x2 - width / 2, height / 2 - y1)
+    return _hit_box_cache[key]
+
+
+_scaled_hit_box_cache = {}
+
+
+def scale_hit_box(hit_box, scale):
+    """Scales a (left, bottom, right, top) hit box. Equal hit boxes come back as the same tuple."""
+    if hit_box is None:
+        return None
+    key = (hit_box, scale)
+    scaled = _scaled_hit_box_cache.get(key)
+    if scaled is None:
+        scaled = _scaled_hit_box_cache.setdefault(key, tuple(value * scale for value in hit_box))
+    return scaled
+
+
+def _tile_hit_box(tile, source, width, height, flips):
+    """Hit box for a tile, taken from its collision shape in Tiled if it has one.
+
+    As in arcade, a collision shape is used as drawn in Tiled and is not flipped.
+    """
+    if tile.objectgroup:
+        shape = tile.objectgroup[0]
+        if getattr(shape, "points", None):
+            xs = [point[0] + shape.location[0] for point in shape.points]
+            ys = [point[1] + shape.location[1] for point in shape.points]
+            x1, y1, x2, y2 = min(xs), min(ys), max(xs), max(ys)
+        elif shape.size is not None:
+            x1, y1 = shape.location[0], shape.location[1]
+            x2, y2 = x1 + shape.size[0], y1 + shape.size[1]
+        else:
+            return image_hit_box(source, *flips)
+        return (x1 - width / 2, height / 2 - y2, x2 - width / 2, height / 2 - y1)
+    return image_hit_box(source, *flips)
+
+
+def _get_tile_by_gid(my_map, gid):
+    """Finds the pytiled_parser tile for a gid, the same way arcade.tilemap does"""
+    gid &= ~FLIP_FLAGS
+    for first_gid, tileset in my_map.tile_sets.items():
+        if gid < first_gid:
+            continue
+        tile = tileset.tiles.get(gid - first_gid)
+        if tile is not None:
+            return tile, tileset
+    return None, None
+
+
+class LevelData:
+    """Everything the game needs from a map, with no arcade objects.
+
+    layers maps a tile layer name to a flat, row major sequence of gids
+    (row 0 is the top of the map, as in Tiled).  It may be a list, an array
+    or a memoryview into a compiled level file.
+    """
+
+    def __init__(self, map_name, width, height, tile_width, tile_height, tiles, layers, objects):
+        self.map_name = map_name
+        self.width = width
+        self.height = height
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.tiles = tiles
+        self.layers = layers
+        self.objects = objects
+
+    @property
+    def end_of_map(self):
+        return self.width * GRID_PIXEL_SIZE
+
+    @property
+    def top_of_map(self):
+        return self.height * GRID_PIXEL_SIZE
+
+    def tile_cells(self, layer_name, area=None):
+        """Yields (column, row, gid) for every tile in a tile layer, top row first.
+
+        Rows count up from the bottom of the map, as world y does.  area is
+        (left column, bottom row, right column, top row) with the right and
+        top excluded, to only look at part of the map.
+        """
+        gids = self.layers.get(layer_name)
+        if gids is None:
+            return
+        gids = numpy.asarray(gids)
+        width = self.width
+        if area is None:
+            left, bottom, right, top = 0, 0, width, self.height
+        else:
+            left, bottom, right, top = (max(area[0], 0), max(area[1], 0),
+                                        min(area[2], width), min(area[3], self.height))
+            if left >= right or bottom >= top:
+                return
+            gids = gids.reshape(self.height, width)[self.height - top:self.height - bottom, left:right]
+            width = right - left
+        flat_gids = gids.ravel()
+        for index, gid in zip(numpy.flatnonzero(flat_gids).tolist(), flat_gids[flat_gids != 0].tolist()):
+            row_index, column_index = divmod(index, width)
+            yield left + column_index, top - row_index - 1, gid
+
+    def tile_position(self, column, row, tile, scaling=TILE_SCALING):
+        """The centre of a tile placed in a cell, as (center_x, center_y)"""
+        return (column * self.tile_width * scaling + tile.width * scaling / 2,
+                row * self.tile_height * scaling + tile.height * scaling / 2)
+
+    def tile_positions(self, layer_name, scaling=TILE_SCALING, area=None):
+        """Yields (gid, tile, center_x, center_y) for every tile in a tile layer, or the part of it in area"""
+        tiles = self.tiles
+        for column, row, gid in self.tile_cells(layer_name, area):
+            tile = tiles.get(gid)
+            if tile is None:
+                continue
+            center_x, center_y = self.tile_position(column, row, tile, scaling)
+            yield gid, tile, center_x, center_y
+
+    def object_positions(self, layer_name, scaling=TILE_SCALING):
+        """Yields (map_object, tile, center_x, center_y) for every tile object in an object layer"""
+        for map_object in self.objects.get(layer_name, ()):
+            tile = self.tiles.get(map_object.gid)
+            if tile is None:
+                continue
+            x = map_object.x * scaling
+            y = (self.height * self.tile_height - map_object.y) * scaling
+            yield (map_object, tile,
+                   x + map_object.width * scaling / 2,
+                   y + map_object.height * scaling / 2)
+
+
+def read_level(map_name):
+    """Parses a tmx file into LevelData"""
+    my_map = pytiled_parser.parse_tile_map(map_name)
+    map_directory = os.path.dirname(map_name)
+
+    layers = {}
+    objects = {}
+    gids = set()
+    for layer in my_map.layers:
+        if isinstance(layer, pytiled_parser.objects.TileLayer):
+            layers[layer.name] = array("I", (gid for row in layer.layer_data for gid in row))
+            gids.update(layers[layer.name])
+        elif isinstance(layer, pytiled_parser.objects.ObjectLayer):
+            objects[layer.name] = []
+            for tiled_object in layer.tiled_objects:
+                if tiled_object.gid is None:
+                    continue
+                objects[layer.name].append(MapObject(tiled_object.gid,
+                                                     tiled_object.location.x,
+                                                     tiled_object.location.y,
+                                                     tiled_object.size.width,
+                                                     tiled_object.size.height,
+                                                     dict(tiled_object.properties or {})))
+                gids.add(tiled_object.gid)
+
+    tiles = {}
+    for gid in gids:
+        if gid == 0:
+            continue
+        tile, tileset = _get_tile_by_gid(my_map, gid)
+        if tile is None or tile.image is None:
+            continue
+        flips = (bool(gid & FLIPPED_HORIZONTALLY_FLAG),
+                 bool(gid & FLIPPED_VERTICALLY_FLAG),
+                 bool(gid & FLIPPED_DIAGONALLY_FLAG))
+        source = os.path.normpath(os.path.join(map_directory, tile.image.source))
+        if tile.image.size is not None:
+            width, height = tile.image.size.width, tile.image.size.height
+        else:
+            width, height = Image.open(source).size
+        if flips[2]:
+            width, height = height, width
+
+        frames = ()
+        if tile.animation:
+            frame_list = []
+            for frame in tile.animation:
+                frame_tile = tileset.tiles.get(frame.tile_id)
+                if frame_tile is not None and frame_tile.image is not None:
+                    frame_source = os.path.normpath(os.path.join(map_directory, frame_tile.image.source))
+                    frame_list.append((frame_source, frame.duration))
+            frames = tuple(frame_list)
+
+        tiles[gid] = TileInfo(source, width, height,
+                              _tile_hit_box(tile, source, width, height, flips),
+                              flips[0], flips[1], flips[2], frames)
+
+    return LevelData(map_name, my_map.map_size.width, my_map.map_size.height,
+                     my_map.tile_size.width, my_map.tile_size.height,
+                     tiles, layers, objects)
@@ -0,0 +1,417 @@
+"""
+Compiled binary level files
+
+The tmx maps are compiled once into a compact little endian file that is
+memory mapped when a level starts, instead of parsing the XML every time.
+
+Layout, every section starting on a 4 byte boundary:
+
+    header          HEADER struct
+    strings         u32 count, then u16 length + utf-8 bytes for each
+    tile table      TILE struct for each tile
+    frame table     FRAME struct for each animation frame
+    tile layers     u32 name, then width * height u32 gids for each layer
+    object layers   u32 name, u32 count, then OBJECT struct for each object
+
+Run this file to compile the maps ahead of time.  load_level compiles on
+demand and recompiles when the tmx file has changed.
+"""
+
+import argparse
+from array import array
+import glob
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+import numpy
+
+from constants import *
+from level_data import LevelData, MapObject, TileInfo, read_level
+
+MAGIC = b"PLVL"
+VERSION = 1
+
+#Folder next to the maps that holds the compiled files
+COMPILED_FOLDER = ".compiled"
+COMPILED_EXTENSION = ".lvl"
+
+HEADER = struct.Struct("<4sHHIIIIqqIIII")
+TILE = struct.Struct("<IIHH4d3BxII")
+FRAME = struct.Struct("<II")
+LAYER = struct.Struct("<I")
+OBJECT_LAYER = struct.Struct("<II")
+OBJECT = struct.Struct("<II4di6dii")
+OBJECT_DTYPE = numpy.dtype([("gid", "<u4"), ("present", "<u4"),
+                            ("x", "<f8"), ("y", "<f8"), ("width", "<f8"), ("height", "<f8"),
+                            ("Points", "<i4"), ("change_x", "<f8"), ("change_y", "<f8"),
+                            ("boundary_left", "<f8"), ("boundary_right", "<f8"),
+                            ("boundary_top", "<f8"), ("boundary_bottom", "<f8"),
+                            ("mob_type", "<i4"), ("extra", "<i4")])
+
+NO_STRING = -1
+
+# Bits of the OBJECT present field, one per property with its own column
+_OBJECT_FIELDS = ("Points", "change_x", "change_y",
+                  "boundary_left", "boundary_right", "boundary_top", "boundary_bottom",
+                  "mob_type")
+
+
+class LevelFormatError(Exception):
+    """Raised when a compiled level file can't be read"""
+
+
+def compiled_path(map_name):
+    """Where the compiled file for a tmx map is kept"""
+    folder, file_name = os.path.split(map_name)
+    base_name = os.path.splitext(file_name)[0]
+    return os.path.join(folder, COMPILED_FOLDER, base_name + COMPILED_EXTENSION)
+
+
+def _align(buffer):
+    buffer.extend(b"\0" * (-len(buffer) % 4))
+
+
+def write_level(level_data, path, source_mtime_ns=0, source_size=0):
+    """Writes LevelData to a compiled level file"""
+    strings = []
+    string_index = {}
+
+    def intern(text):
+        if text is None:
+            return NO_STRING
+        if text not in string_index:
+            string_index[text] = len(strings)
+            strings.append(text)
+        return string_index[text]
+
+    # Build the tables first so every string is known before writing
+    tile_rows = []
+    frame_rows = []
+    for gid, tile in sorted(level_data.tiles.items()):
+        hit_box = tile.hit_box if tile.hit_box is not None else (math.nan,) * 4
+        tile_rows.append((gid, intern(tile.source), tile.width, tile.height) + tuple(hit_box) +
+                         (tile.flipped_horizontally, tile.flipped_vertically, tile.flipped_diagonally,
+                          len(frame_rows), len(tile.frames)))
+        for source, duration in tile.frames:
+            frame_rows.append((intern(source), duration))
+
+    layer_rows = [(intern(name), gids) for name, gids in level_data.layers.items()]
+
+    object_layer_rows = []
+    for name, map_objects in level_data.objects.items():
+        rows = []
+        for map_object in map_objects:
+            properties = dict(map_object.properties)
+            present = 0
+            values = []
+            for bit, field in enumerate(_OBJECT_FIELDS):
+                if field in properties:
+                    present |= 1 << bit
+                value = properties.pop(field, None)
+                if field == "mob_type":
+                    values.append(intern(value))
+                elif field == "Points":
+                    values.append(int(value or 0))
+                else:
+                    values.append(float(value or 0))
+            extra = intern(json.dumps(properties, sort_keys=True)) if properties else NO_STRING
+            rows.append((map_object.gid, present,
+                         map_object.x, map_object.y, map_object.width, map_object.height)
+                        + tuple(values) + (extra,))
+        object_layer_rows.append((intern(name), rows))
+
+    buffer = bytearray(HEADER.pack(MAGIC, VERSION, 0,
+                                   level_data.width, level_data.height,
+                                   level_data.tile_width, level_data.tile_height,
+                                   source_mtime_ns, source_size,
+                                   len(tile_rows), len(frame_rows),
+                                   len(layer_rows), len(object_layer_rows)))
+    _align(buffer)
+
+    buffer.extend(struct.pack("<I", len(strings)))
+    for text in strings:
+        encoded = text.encode("utf-8")
+        buffer.extend(struct.pack("<H", len(encoded)))
+        buffer.extend(encoded)
+    _align(buffer)
+
+    for row in tile_rows:
+        buffer.extend(TILE.pack(*row))
+    for row in frame_rows:
+        buffer.extend(FRAME.pack(*row))
+
+    cell_count = level_data.width * level_data.height
+    for name, gids in layer_rows:
+        buffer.extend(LAYER.pack(name))
+        if len(gids) != cell_count:
+            raise ValueError("Layer has {} cells, expected {}".format(len(gids), cell_count))
+        packed = array("I", gids)
+        if sys.byteorder != "little":
+            packed.byteswap()
+        buffer.extend(packed.tobytes())
+
+    for name, rows in object_layer_rows:
+        buffer.extend(OBJECT_LAYER.pack(name, len(rows)))
+        for row in rows:
+            buffer.extend(OBJECT.pack(*row))
+
+    # Write to a temporary file first so a reader never maps half a file
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    # The prefetch thread and the main thread can compile the same level at once, so each gets a file of its own
+    with tempfile.NamedTemporaryFile(dir=folder or ".", prefix=os.path.basename(path) + ".", suffix=".tmp",
+                                     delete=False) as level_file:
+        try:
+            level_file.write(buffer)
+        except BaseException:
+            level_file.close()
+            os.remove(level_file.name)
+            raise
+    os.replace(level_file.name, path)
+
+
+def compile_level(map_name, path=None):
+    """Compiles a tmx map, returning the path of the compiled file"""
+    if path is None:
+        path = compiled_path(map_name)
+    stat = os.stat(map_name)
+    write_level(read_level(map_name), path, stat.st_mtime_ns, stat.st_size)
+    return path
+
+
+def _gid_view(buffer, offset, count):
+    """A u32 view of count gids in the mapped file, without copying when possible"""
+    view = memoryview(buffer)[offset:offset + count * 4]
+    if sys.byteorder == "little":
+        return view.cast("I")
+    # The file is little endian, so big endian machines need a swapped copy
+    gids = array("I", view.tobytes())
+    gids.byteswap()
+    return gids
+
+
+class ObjectTable:
+    """Read only sequence of MapObjects backed by an OBJECT struct table.
+
+    Nothing is decoded until an object is asked for, and column() gives
+    numpy views of whole columns for code that works on every object at once.
+    """
+
+    def __init__(self, buffer, offset, count, strings):
+        self.records = numpy.frombuffer(buffer, dtype=OBJECT_DTYPE, count=count, offset=offset)
+        self.strings = strings
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self._map_object(OBJECT.unpack(self.records[index].tobytes()))
+
+    def __iter__(self):
+        for row in OBJECT.iter_unpack(self.records.tobytes()):
+            yield self._map_object(row)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def column(self, name):
+        """numpy view of one column, named as in OBJECT_DTYPE"""
+        return self.records[name]
+
+    def _map_object(self, row):
+        gid, present, x, y, width, height = row[:6]
+        extra = row[-1]
+        properties = json.loads(self.strings[extra]) if extra != NO_STRING else {}
+        for bit, field in enumerate(_OBJECT_FIELDS):
+            if present & (1 << bit):
+                value = row[6 + bit]
+                properties[field] = self.strings[value] if field == "mob_type" else value
+        return MapObject(gid, x, y, width, height, properties)
+
+
+def read_compiled(path, map_name=None):
+    """Memory maps a compiled level file and returns (LevelData, source mtime, source size)"""
+    with open(path, "rb") as level_file:
+        try:
+            buffer = mmap.mmap(level_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise LevelFormatError("{} is empty".format(path))
+    return parse_compiled(buffer, path, map_name)
+
+
+def parse_compiled(buffer, path, map_name=None):
+    """Reads a compiled level held in a buffer and returns (LevelData, source mtime, source size).
+
+    The layers and objects are views into buffer, which must stay alive and
+    unchanged while the LevelData is used.  path only names it in errors.
+    """
+    if len(buffer) < HEADER.size:
+        raise LevelFormatError("{} is too short".format(path))
+    (magic, version, _, width, height, tile_width, tile_height, source_mtime_ns, source_size,
+     tile_count, frame_count, layer_count, object_layer_count) = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise LevelFormatError("{} is not a compiled level".format(path))
+    if version != VERSION:
+        raise LevelFormatError("{} is version {}, expected {}".format(path, version, VERSION))
+
+    try:
+        offset = HEADER.size + (-HEADER.size % 4)
+        string_count, = struct.unpack_from("<I", buffer, offset)
+        offset += 4
+        strings = []
+        for _ in range(string_count):
+            length, = struct.unpack_from("<H", buffer, offset)
+            offset += 2
+            strings.append(bytes(buffer[offset:offset + length]).decode("utf-8"))
+            offset += length
+        offset += -offset % 4
+
+        tile_rows = list(TILE.iter_unpack(buffer[offset:offset + tile_count * TILE.size]))
+        offset += tile_count * TILE.size
+        frame_rows = list(FRAME.iter_unpack(buffer[offset:offset + frame_count * FRAME.size]))
+        offset += frame_count * FRAME.size
+
+        tiles = {}
+        for (gid, source, tile_width_px, tile_height_px, left, bottom, right, top,
+             flipped_horizontally, flipped_vertically, flipped_diagonally,
+             first_frame, frame_total) in tile_rows:
+            hit_box = None if math.isnan(left) else (left, bottom, right, top)
+            frames = tuple((strings[frame_source], duration)
+                           for frame_source, duration in frame_rows[first_frame:first_frame + frame_total])
+            tiles[gid] = TileInfo(strings[source], tile_width_px, tile_height_px, hit_box,
+                                  bool(flipped_horizontally), bool(flipped_vertically),
+                                  bool(flipped_diagonally), frames)
+
+        cell_count = width * height
+        layers = {}
+        for _ in range(layer_count):
+            name, = LAYER.unpack_from(buffer, offset)
+            offset += LAYER.size
+            layers[strings[name]] = _gid_view(buffer, offset, cell_count)
+            offset += cell_count * 4
+
+        objects = {}
+        for _ in range(object_layer_count):
+            name, count = OBJECT_LAYER.unpack_from(buffer, offset)
+            offset += OBJECT_LAYER.size
+            objects[strings[name]] = ObjectTable(buffer, offset, count, strings)
+            offset += count * OBJECT.size
+        if offset > len(buffer):
+            raise LevelFormatError("{} is truncated".format(path))
+    except (struct.error, IndexError, UnicodeDecodeError) as error:
+        raise LevelFormatError("{} is corrupt: {}".format(path, error))
+
+    level_data = LevelData(map_name or path, width, height, tile_width, tile_height,
+                           tiles, layers, objects)
+    # Keeps the buffer alive for as long as the layer views are in use
+    level_data.buffer = buffer
+    return level_data, source_mtime_ns, source_size
+
+
+_level_cache = {}
+# Levels are loaded from the prefetch thread and the main thread
+_level_lock = threading.Lock()
+
+
+def load_map(map_name):
+    """Loads a map through its compiled file, recompiling it if the tmx has changed.
+
+    Loaded levels are kept in memory and reused until the tmx changes.
+    """
+    with _level_lock:
+        return _load_map(map_name)
+
+
+def _load_map(map_name):
+    try:
+        stat = os.stat(map_name)
+    except FileNotFoundError:
+        stat = None
+
+    cached = _level_cache.get(map_name)
+    if cached is not None and (stat is None or cached[1:] == (stat.st_mtime_ns, stat.st_size)):
+        return cached[0]
+
+    path = compiled_path(map_name)
+    level_data = None
+    try:
+        level_data, source_mtime_ns, source_size = read_compiled(path, map_name)
+        if stat is not None and (source_mtime_ns, source_size) != (stat.st_mtime_ns, stat.st_size):
+            level_data = None
+    except (OSError, LevelFormatError):
+        if stat is None:
+            raise
+
+    if level_data is None:
+        compile_level(map_name, path)
+        level_data, source_mtime_ns, source_size = read_compiled(path, map_name)
+
+    _level_cache[map_name] = (level_data, source_mtime_ns, source_size)
+    return level_data
+
+
+def compiled_bytes(map_name):
+    """The contents of a map's compiled file, compiling it first if it is missing or out of date"""
+    load_map(map_name)
+    with open(compiled_path(map_name), "rb") as level_file:
+        return level_file.read()
+
+
+def cache_level(map_name, buffer):
+    """Makes load_map use a compiled level already in memory, such as a shared memory block.
+
+    Returns its LevelData.  It is used until the tmx file changes.
+    """
+    level_data, source_mtime_ns, source_size = parse_compiled(buffer, map_name, map_name)
+    with _level_lock:
+        _level_cache[map_name] = (level_data, source_mtime_ns, source_size)
+    return level_data
+
+
+def forget_levels():
+    """Drops every loaded level, so they are read again the next time they are loaded"""
+    with _level_lock:
+        _level_cache.clear()
+
+
+def load_level(level, map_name=MAP_NAME):
+    """Loads the LevelData for a level number.
+
+    map_name is formatted with the level number, so a name with no {} loads
+    the same map for every level.
+    """
+    return load_map(map_name.format(level))
+
+
+def main():
+    """Compiles tmx maps to level files"""
+    parser = argparse.ArgumentParser(description="Compile tmx maps into binary level files.")
+    parser.add_argument("maps", nargs="*", help="tmx files to compile, defaults to every level")
+    args = parser.parse_args()
+
+    map_names = args.maps or sorted(glob.glob(MAP_NAME.format("*")))
+    for map_name in map_names:
+        start_time = time.perf_counter()
+        path = compile_level(map_name)
+        compile_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        read_compiled(path, map_name)
+        load_time = time.perf_counter() - start_time
+
+        print("{} -> {} ({} bytes, compiled in {:.1f} ms, loads in {:.2f} ms)".format(
+            map_name, path, os.path.getsize(path), compile_time * 1000, load_time * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Level of detail for moving the enemies
+
+Stepping every enemy every tick costs the same whether it is on screen or
+a few thousand pixels away.  An UpdateLOD sorts the enemies of a level by
+how far the stretch they patrol is from the viewport:
+
+- active, on screen or within LOD_ACTIVE_MARGIN of it: moved every tick;
+- near, within LOD_NEAR_DISTANCE: moved every LOD_NEAR_INTERVAL ticks, by
+  all the ticks they missed at once, a different tick for each enemy;
+- asleep, the rest: not moved at all until they come near or into view.
+
+An enemy that wakes up is moved on by every tick it slept through in one
+go with KinematicStore.fast_forward(), so it is where it would have been
+had it been stepped all along.  The tiers only go by the patrols, which
+never move, so they are sorted again only once the camera has moved a
+quarter of LOD_ACTIVE_MARGIN, which the margin leaves room for.  The player is always on screen, so only the
+active enemies are checked for hitting the player.
+
+Enemies without a boundary, or whose patrol is too short to pass a
+boundary cleanly, are always active.  So are all of them in stores too
+small to be batched, where stepping each one beats sorting them.
+"""
+
+import numpy
+
+from constants import *
+from kinematics import _overlaps
+
+TIER_ACTIVE = 0
+TIER_NEAR = 1
+TIER_ASLEEP = 2
+
+
+class UpdateLOD:
+    """Moves the bodies of a KinematicStore at a rate set by their distance from the viewport"""
+
+    def __init__(self, store, active_margin=LOD_ACTIVE_MARGIN, near_distance=LOD_NEAR_DISTANCE,
+                 near_interval=LOD_NEAR_INTERVAL):
+        self.store = store
+        self.enabled = store.batched
+        self.active_margin = active_margin
+        self.near_distance = near_distance
+        self.near_interval = near_interval
+        count = len(store)
+
+        #Ticks run, and the tick each body was last moved to
+        self.ticks = 0
+        self.moved_at = numpy.zeros(count)
+
+        self.always_active = ~store.patrols_cleanly()
+        self.always_active |= numpy.isnan(store.update_boundary_left) | numpy.isnan(store.update_boundary_right)
+        self.regroup_distance = active_margin / 4
+        self.view = None
+        self.tier = numpy.full(count, TIER_ACTIVE, dtype=numpy.int8)
+        self.active = numpy.arange(count)
+        self.near = [numpy.zeros(0, dtype=numpy.intp) for _ in range(near_interval)]
+
+    def __len__(self):
+        return len(self.store)
+
+    def regroup(self, view_left, view_bottom, width=SCREEN_WIDTH, height=SCREEN_HEIGHT):
+        """Sorts the bodies into tiers for a viewport"""
+        self.view = (view_left, view_bottom)
+        store = self.store
+        #The box each body can reach, a patrol or the whole map if it has no boundary
+        if store.moves_vertically:
+            reach_bottom = numpy.nan_to_num(store.update_boundary_bottom, nan=-numpy.inf)
+            reach_top = numpy.nan_to_num(store.update_boundary_top, nan=numpy.inf)
+        else:
+            reach_bottom = store.center_y + store.hit_box_bottom
+            reach_top = store.center_y + store.hit_box_top
+        distance = numpy.maximum.reduce([view_left - store.update_boundary_right,
+                                         store.update_boundary_left - (view_left + width),
+                                         view_bottom - reach_top,
+                                         reach_bottom - (view_bottom + height)])
+        tier = numpy.where(distance <= self.active_margin, TIER_ACTIVE,
+                           numpy.where(distance <= self.near_distance, TIER_NEAR, TIER_ASLEEP))
+        tier[self.always_active] = TIER_ACTIVE
+        self.tier = tier.astype(numpy.int8)
+        self.active = numpy.flatnonzero(tier == TIER_ACTIVE)
+        #Near bodies are moved on different ticks, so the work is spread out
+        near = numpy.flatnonzero(tier == TIER_NEAR)
+        phase = near % self.near_interval
+        self.near = [near[phase == tick] for tick in range(self.near_interval)]
+
+    def update(self, view_left, view_bottom):
+        """Moves the bodies due this tick, catching up the ones that missed ticks"""
+        if not self.enabled:
+            self.store.update()
+            return
+        self.ticks += 1
+        view = self.view
+        if (view is None or abs(view_left - view[0]) >= self.regroup_distance
+                or abs(view_bottom - view[1]) >= self.regroup_distance):
+            self.regroup(view_left, view_bottom)
+        due = self.active
+        near = self.near[self.ticks % self.near_interval]
+        if len(near):
+            due = numpy.concatenate((due, near))
+        if not len(due):
+            return
+
+        owed = self.ticks - self.moved_at[due]
+        stepped = owed == 1
+        if stepped.all():
+            self.store.update(due)
+        else:
+            # A tick behind is stepped, so what is on screen moves exactly as update() moves it
+            self.store.update(due[stepped])
+            self.store.fast_forward(due[~stepped], owed[~stepped])
+        self.moved_at[due] = self.ticks
+
+    def catch_up(self):
+        """Moves every body on to the current tick, as before looking at all of them"""
+        if not self.enabled:
+            return
+        behind = numpy.flatnonzero(self.moved_at < self.ticks)
+        if len(behind):
+            self.store.fast_forward(behind, self.ticks - self.moved_at[behind])
+            self.moved_at[behind] = self.ticks
+
+    def hits(self, body):
+        """True if an active body overlaps body. Touching edges don't count."""
+        if not self.enabled:
+            return any(_overlaps(body, other) for other in self.store.bodies)
+        store = self.store
+        active = self.active
+        center_x = store.center_x[active]
+        center_y = store.center_y[active]
+        hits = body.left < center_x + store.hit_box_right[active]
+        hits &= center_x + store.hit_box_left[active] < body.right
+        hits &= body.bottom < center_y + store.hit_box_top[active]
+        hits &= center_y + store.hit_box_bottom[active] < body.top
+        return bool(hits.any())
+
+    def reset(self):
+        """Starts counting ticks again, for bodies put back where they started"""
+        self.load_state(0, numpy.zeros(len(self.store)))
+
+    def load_state(self, ticks, moved_at):
+        """Sets the tick counts, as state() gives them"""
+        self.ticks = int(ticks)
+        self.moved_at[:] = moved_at
+        self.view = None
+
+    def state(self):
+        """The tick count and the list of the tick each body was last moved to"""
+        return self.ticks, self.moved_at.tolist()
+
+    def metrics(self):
+        """How many bodies are in each tier"""
+        counts = numpy.bincount(self.tier, minlength=3) if len(self.tier) else [0, 0, 0]
+        return {
+            "active": int(counts[TIER_ACTIVE]),
+            "near": int(counts[TIER_NEAR]),
+            "asleep": int(counts[TIER_ASLEEP]),
+            "enabled": self.enabled,
+        }
@@ -0,0 +1,375 @@
+"""
+Synthetic tmx maps for benchmarking
+
+generate_map writes a map of any size up to MAX_MAP_WIDTH x MAX_MAP_HEIGHT
+tiles, with the layers setup() expects and a chosen number of coins,
+enemies and moving platforms.  The tilesets are copied from a shipped map
+and every tile is picked from the ones that map uses on the same layer, so
+the art, hit boxes and animations are the real ones.  The same spec and
+seed always give the same map.
+
+Run this file to write a map, then load it with load_map or pass its path
+as the map_name of prepare_level or MyGame.
+"""
+
+import argparse
+import os
+import random
+import xml.etree.ElementTree as ElementTree
+from collections import Counter, namedtuple
+
+from constants import *
+from level_data import FLIP_FLAGS
+from levelpack import load_map
+
+MAX_MAP_WIDTH = 2000
+MAX_MAP_HEIGHT = 500
+MIN_MAP_WIDTH = 40
+MIN_MAP_HEIGHT = 24
+
+#Folder next to the maps that synthetic maps are written to
+SYNTHETIC_FOLDER = ".synthetic"
+
+#Level 2 has something on every layer, so its tiles are the ones reused
+TEMPLATE_MAP = MAP_NAME.format(2)
+
+#Flat ground the player starts on, in tiles
+START_COLUMNS = 20
+START_GROUND = 4
+#Highest the ground goes, in tiles
+MAX_GROUND = 12
+
+# What to put in a synthetic map. None counts scale with the map width.
+MapSpec = namedtuple("MapSpec", ["width", "height", "coins", "enemies", "moving_platforms", "seed"])
+MapSpec.__new__.__defaults__ = (None, None, None, 0)
+
+# The gids a synthetic map is drawn with, picked from the template map
+TemplateTiles = namedtuple("TemplateTiles", ["ground_top", "ground_fill", "background", "foreground",
+                                             "ladder", "hazard", "coin", "moving_platform", "mobs",
+                                             "object_sizes", "coin_properties"])
+
+
+def map_spec(width, height, coins=None, enemies=None, moving_platforms=None, seed=0):
+    """A MapSpec with the counts left as None filled in from the width"""
+    if not MIN_MAP_WIDTH <= width <= MAX_MAP_WIDTH or not MIN_MAP_HEIGHT <= height <= MAX_MAP_HEIGHT:
+        raise ValueError("Synthetic maps are {}x{} to {}x{} tiles, not {}x{}".format(
+            MIN_MAP_WIDTH, MIN_MAP_HEIGHT, MAX_MAP_WIDTH, MAX_MAP_HEIGHT, width, height))
+    return MapSpec(width, height,
+                   width // 5 if coins is None else coins,
+                   width // 15 if enemies is None else enemies,
+                   width // 30 if moving_platforms is None else moving_platforms,
+                   seed)
+
+
+def synthetic_map_name(spec, folder=None):
+    """Where the map for a MapSpec is written"""
+    if folder is None:
+        folder = os.path.join(os.path.dirname(MAP_NAME), SYNTHETIC_FOLDER)
+    return os.path.join(folder, "synthetic_{}x{}_c{}_e{}_p{}_s{}.tmx".format(*spec))
+
+
+def _most_common(counter):
+    """The most common gid of a Counter, None if it is empty"""
+    for gid, count in counter.most_common(1):
+        return gid
+    return None
+
+
+def template_tiles(level_data):
+    """Picks the gids a synthetic map is drawn with from the ones a map uses"""
+    width = level_data.width
+
+    def layer_counts(layer_name):
+        gids = level_data.layers.get(layer_name, ())
+        return Counter(gid for gid in gids if gid and not gid & FLIP_FLAGS and gid in level_data.tiles)
+
+    # The top of the ground is the platform tile most often with nothing above it
+    platforms = level_data.layers.get(PLATFORMS_LAYER_NAME, ())
+    tops = Counter()
+    fills = Counter()
+    for index, gid in enumerate(platforms):
+        if not gid or gid & FLIP_FLAGS or gid not in level_data.tiles:
+            continue
+        if index >= width and platforms[index - width]:
+            fills[gid] += 1
+        else:
+            tops[gid] += 1
+
+    def object_counts(layer_name):
+        return Counter(map_object.gid for map_object in level_data.objects.get(layer_name, ())
+                       if map_object.gid in level_data.tiles)
+
+    mobs = {}
+    object_sizes = {}
+    coin_properties = {}
+    for layer_name in (COINS_LAYER_NAME, MOVING_PLATFORMS_LAYER_NAME, MOVING_ENEMIES_LAYER_NAME):
+        for map_object in level_data.objects.get(layer_name, ()):
+            object_sizes.setdefault(map_object.gid, (map_object.width, map_object.height))
+            if layer_name == MOVING_ENEMIES_LAYER_NAME:
+                mobs.setdefault(map_object.properties["mob_type"], map_object.gid)
+    coin = _most_common(object_counts(COINS_LAYER_NAME))
+    for map_object in level_data.objects.get(COINS_LAYER_NAME, ()):
+        if map_object.gid == coin:
+            coin_properties = dict(map_object.properties)
+            break
+
+    return TemplateTiles(_most_common(tops), _most_common(fills) or _most_common(tops),
+                         _most_common(layer_counts(BACKGROUND_LAYER_NAME)),
+                         _most_common(layer_counts(FOREGROUND_LAYER_NAME)),
+                         _most_common(layer_counts(LADDERS_LAYER_NAME)),
+                         _most_common(layer_counts(DONT_TOUCH_LAYER_NAME)),
+                         coin, _most_common(object_counts(MOVING_PLATFORMS_LAYER_NAME)),
+                         mobs, object_sizes, coin_properties)
+
+
+def _tileset_xml(template, folder):
+    """The tilesets of the template map, with their image paths made relative to folder"""
+    template_folder = os.path.dirname(template)
+    tilesets = []
+    for tileset in ElementTree.parse(template).getroot().iter("tileset"):
+        for element in [tileset] + list(tileset.iter("image")):
+            source = element.get("source")
+            if source is not None:
+                path = os.path.normpath(os.path.join(template_folder, source))
+                element.set("source", os.path.relpath(path, folder).replace(os.sep, "/"))
+        tilesets.append(ElementTree.tostring(tileset, encoding="unicode").rstrip())
+    return tilesets
+
+
+class _MapBuilder:
+    """The tile layers and objects of a map being generated. y counts rows up from the bottom."""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.layers = {name: [0] * (width * height)
+                       for name in (BACKGROUND_LAYER_NAME, FOREGROUND_LAYER_NAME, PLATFORMS_LAYER_NAME,
+                                    LADDERS_LAYER_NAME, DONT_TOUCH_LAYER_NAME)}
+        self.objects = {MOVING_PLATFORMS_LAYER_NAME: [], MOVING_ENEMIES_LAYER_NAME: [], COINS_LAYER_NAME: []}
+
+    def set_tile(self, layer_name, column, y, gid):
+        if 0 <= column < self.width and 0 <= y < self.height:
+            self.layers[layer_name][(self.height - 1 - y) * self.width + column] = gid
+
+    def add_object(self, layer_name, gid, size, column, y, properties):
+        """Adds a tile object whose bottom left corner is at the bottom left of a cell"""
+        self.objects[layer_name].append((gid, column * GRID_PIXEL_SIZE, (self.height - y) * GRID_PIXEL_SIZE,
+                                         size, properties))
+
+
+def _ground(spec, rng):
+    """Ground height of every column in tiles, 0 for a pit, and the flat stretches as (start, end, height)"""
+    ground = []
+    stretches = []
+    height = START_GROUND
+    max_ground = min(MAX_GROUND, spec.height // 2)
+    while len(ground) < spec.width:
+        start = len(ground)
+        if start == 0:
+            length = START_COLUMNS
+        elif rng.random() < 0.15:
+            ground.extend([0] * rng.choice((2, 4)))
+            continue
+        else:
+            length = rng.randint(8, 30)
+            height = max(2, min(max_ground, height + rng.randint(-2, 2)))
+        length = min(length, spec.width - start)
+        ground.extend([height] * length)
+        if start:
+            stretches.append((start, start + length, height))
+    # Enemies need somewhere to walk, even on a map that came out all pits
+    return ground[:spec.width], stretches or [(0, START_COLUMNS, START_GROUND)]
+
+
+def build_map(spec, tiles):
+    """Lays out the tiles and objects of a MapSpec"""
+    rng = random.Random(spec.seed)
+    builder = _MapBuilder(spec.width, spec.height)
+    ground, stretches = _ground(spec, rng)
+    surfaces = []
+
+    for column, height in enumerate(ground):
+        if height == 0:
+            # Pits have water at the bottom, one tile of it every two columns
+            if column % 2 == 0:
+                builder.set_tile(DONT_TOUCH_LAYER_NAME, column, 0, tiles.hazard)
+            continue
+        builder.set_tile(PLATFORMS_LAYER_NAME, column, height - 1, tiles.ground_top)
+        builder.set_tile(PLATFORMS_LAYER_NAME, column, height - 2, tiles.ground_fill)
+        for y in range(height - 2):
+            builder.set_tile(BACKGROUND_LAYER_NAME, column, y, tiles.background)
+        surfaces.append((column, height))
+
+    # Floating platforms, most within jumping reach of the ground and some anywhere above it
+    for _ in range(spec.width // 8):
+        length = rng.randint(3, 7)
+        column = rng.randint(START_COLUMNS, spec.width - length)
+        base = max(ground[column:column + length])
+        if rng.random() < 0.75:
+            y = base + rng.randint(3, 6)
+        else:
+            y = base + rng.randint(3, max(3, spec.height - 4 - base))
+        if y >= spec.height - 3:
+            continue
+        for platform_column in range(column, column + length):
+            builder.set_tile(PLATFORMS_LAYER_NAME, platform_column, y, tiles.ground_top)
+            surfaces.append((platform_column, y + 1))
+        # Low platforms over solid ground get a ladder up to them from their left
+        ladder_column = column - 1
+        if y - base <= 6 and ground[ladder_column] and rng.random() < 0.3:
+            for ladder_y in range(ground[ladder_column], y + 1):
+                builder.set_tile(LADDERS_LAYER_NAME, ladder_column, ladder_y, tiles.ladder)
+
+    # Torches along the ground
+    if tiles.foreground is not None:
+        for _ in range(spec.width // 25):
+            column = rng.randrange(spec.width)
+            if ground[column]:
+                builder.set_tile(FOREGROUND_LAYER_NAME, column, ground[column], tiles.foreground)
+
+    occupied = set()
+    for _ in range(spec.coins):
+        for _ in range(10):
+            column, y = rng.choice(surfaces)
+            y += rng.randint(0, 2)
+            if (column, y) not in occupied and y < spec.height:
+                break
+        occupied.add((column, y))
+        builder.add_object(COINS_LAYER_NAME, tiles.coin, tiles.object_sizes[tiles.coin],
+                           column, y, dict(tiles.coin_properties))
+
+    mob_types = sorted(tiles.mobs)
+    for index in range(spec.enemies):
+        start, end, height = stretches[rng.randrange(len(stretches))]
+        mob_type = mob_types[index % len(mob_types)]
+        gid = tiles.mobs[mob_type]
+        size = tiles.object_sizes[gid]
+        column = rng.randint(start, max(start, end - 1 - int(size[0] // GRID_PIXEL_SIZE)))
+        builder.add_object(MOVING_ENEMIES_LAYER_NAME, gid, size, column, height, {
+            "boundary_left": float(start * GRID_PIXEL_SIZE),
+            "boundary_right": float(end * GRID_PIXEL_SIZE),
+            "change_x": rng.choice((-1, 1)) * rng.randint(2, 5),
+            "mob_type": mob_type,
+        })
+
+    size = tiles.object_sizes[tiles.moving_platform]
+    for index in range(spec.moving_platforms):
+        column = rng.randint(START_COLUMNS, spec.width - 8)
+        y = min(ground[column] + rng.randint(3, 6), spec.height - 3)
+        left = column * GRID_PIXEL_SIZE
+        bottom = y * GRID_PIXEL_SIZE
+        travel = rng.randint(3, 8) * GRID_PIXEL_SIZE
+        # One in four moves up and down, the rest side to side
+        if index % 4 == 3:
+            properties = {"boundary_bottom": float(bottom - GRID_PIXEL_SIZE),
+                          "boundary_top": float(bottom + size[1] + travel),
+                          "change_y": float(rng.randint(1, 3))}
+        else:
+            properties = {"boundary_left": float(left - travel),
+                          "boundary_right": float(left + size[0] + travel),
+                          "change_x": float(rng.randint(1, 3))}
+        builder.add_object(MOVING_PLATFORMS_LAYER_NAME, tiles.moving_platform, size, column, y, properties)
+
+    return builder
+
+
+def _property_xml(name, value):
+    if isinstance(value, bool):
+        return '    <property name="{}" type="bool" value="{}"/>'.format(name, str(value).lower())
+    if isinstance(value, int):
+        return '    <property name="{}" type="int" value="{}"/>'.format(name, value)
+    if isinstance(value, float):
+        return '    <property name="{}" type="float" value="{:g}"/>'.format(name, value)
+    return '    <property name="{}" value="{}"/>'.format(name, value)
+
+
+def map_xml(builder, tilesets):
+    """The tmx file for a built map, laid out the way Tiled writes it"""
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>']
+    object_count = sum(len(objects) for objects in builder.objects.values())
+    lines.append('<map version="1.4" tiledversion="1.4.2" orientation="orthogonal" renderorder="left-up" '
+                 'width="{}" height="{}" tilewidth="{}" tileheight="{}" infinite="0" '
+                 'nextlayerid="9" nextobjectid="{}">'.format(builder.width, builder.height,
+                                                              SPRITE_PIXEL_SIZE, SPRITE_PIXEL_SIZE,
+                                                              object_count + 1))
+    lines.extend(" " + tileset for tileset in tilesets)
+
+    layer_order = (BACKGROUND_LAYER_NAME, FOREGROUND_LAYER_NAME, PLATFORMS_LAYER_NAME,
+                   MOVING_PLATFORMS_LAYER_NAME, MOVING_ENEMIES_LAYER_NAME,
+                   LADDERS_LAYER_NAME, DONT_TOUCH_LAYER_NAME, COINS_LAYER_NAME)
+    object_id = 1
+    for layer_id, layer_name in enumerate(layer_order, 1):
+        if layer_name in builder.layers:
+            gids = builder.layers[layer_name]
+            width = builder.width
+            lines.append(' <layer id="{}" name="{}" width="{}" height="{}">'.format(
+                layer_id, _escape(layer_name), width, builder.height))
+            lines.append('  <data encoding="csv">')
+            rows = [",".join(map(str, gids[start:start + width])) for start in range(0, len(gids), width)]
+            lines.append(",\n".join(rows))
+            lines.append('</data>')
+            lines.append(' </layer>')
+            continue
+
+        lines.append(' <objectgroup id="{}" name="{}">'.format(layer_id, _escape(layer_name)))
+        for gid, x, y, (width, height), properties in builder.objects[layer_name]:
+            lines.append('  <object id="{}" gid="{}" x="{}" y="{}" width="{:g}" height="{:g}">'.format(
+                object_id, gid, x, y, width, height))
+            lines.append('   <properties>')
+            lines.extend(_property_xml(name, value) for name, value in sorted(properties.items()))
+            lines.append('   </properties>')
+            lines.append('  </object>')
+            object_id += 1
+        lines.append(' </objectgroup>')
+    lines.append('</map>')
+    return "\n".join(lines) + "\n"
+
+
+def _escape(text):
+    return text.replace("&", "&amp;").replace("'", "&apos;").replace('"', "&quot;")
+
+
+def generate_map(spec, map_name=None, template=TEMPLATE_MAP):
+    """Writes the tmx file for a MapSpec, unless it is there already. Returns its path."""
+    if map_name is None:
+        map_name = synthetic_map_name(spec)
+    if os.path.exists(map_name):
+        return map_name
+
+    folder = os.path.dirname(map_name) or "."
+    os.makedirs(folder, exist_ok=True)
+    builder = build_map(spec, template_tiles(load_map(template)))
+    text = map_xml(builder, _tileset_xml(template, folder))
+
+    temp_path = "{}.tmp{}".format(map_name, os.getpid())
+    with open(temp_path, "w", encoding="utf-8") as map_file:
+        map_file.write(text)
+    os.replace(temp_path, map_name)
+    return map_name
+
+
+def main():
+    """Writes a synthetic map"""
+    parser = argparse.ArgumentParser(description="Generate a synthetic tmx map for benchmarking.")
+    parser.add_argument("--width", type=int, default=MAX_MAP_WIDTH, help="map width in tiles")
+    parser.add_argument("--height", type=int, default=MAX_MAP_HEIGHT, help="map height in tiles")
+    parser.add_argument("--coins", type=int, help="number of coins, defaults to one per 5 columns")
+    parser.add_argument("--enemies", type=int, help="number of enemies, defaults to one per 15 columns")
+    parser.add_argument("--moving-platforms", type=int,
+                        help="number of moving platforms, defaults to one per 30 columns")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the layout")
+    parser.add_argument("--output", help="tmx file to write, defaults to one in maps/{}/".format(SYNTHETIC_FOLDER))
+    args = parser.parse_args()
+
+    spec = map_spec(args.width, args.height, args.coins, args.enemies, args.moving_platforms, args.seed)
+    map_name = generate_map(spec, args.output)
+    level_data = load_map(map_name)
+    print("{}: {}x{} tiles, {} platform tiles, {} coins, {} enemies, {} moving platforms".format(
+        map_name, level_data.width, level_data.height,
+        sum(1 for gid in level_data.layers[PLATFORMS_LAYER_NAME] if gid),
+        len(level_data.objects[COINS_LAYER_NAME]), len(level_data.objects[MOVING_ENEMIES_LAYER_NAME]),
+        len(level_data.objects[MOVING_PLATFORMS_LAYER_NAME])))
+
+
+if __name__ == "__main__":
+    main()
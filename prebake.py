@@ -0,0 +1,263 @@
+"""
+Pre-baked images of the static Background and Foreground layers
+
+These layers never change once a level is loaded, so instead of drawing
+thousands of tile sprites they are composited with Pillow into one image per
+RENDER_CHUNK_TILES x RENDER_CHUNK_TILES chunk.  The images are cached in
+maps/.baked/ under a hash of the tmx file and the tile images of its
+tilesets, so editing either bakes them again.  The hash is only worked
+out again when the size or modification time of one of those files
+changes.  Animated tiles are left out and stay as sprites.
+
+Run this file to bake the maps ahead of time.  baked_chunks bakes on
+demand the first time a level is loaded.
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from PIL import Image
+
+from constants import *
+from levelpack import load_map
+
+VERSION = 1
+
+#Folder next to the maps that holds the baked chunk images
+BAKED_FOLDER = ".baked"
+MANIFEST_NAME = "chunks.json"
+HASH_CACHE_SUFFIX = ".hash.json"
+
+#Layers that are baked into chunk images
+BAKED_LAYER_NAMES = (BACKGROUND_LAYER_NAME, FOREGROUND_LAYER_NAME)
+
+CHUNK_PIXEL_SIZE = RENDER_CHUNK_TILES * GRID_PIXEL_SIZE
+
+_bake_locks = {}
+_bake_locks_lock = threading.Lock()
+
+
+def bake_hash(level_data, layer_names=BAKED_LAYER_NAMES):
+    """Hash of everything a bake depends on: the tmx file and the tile images of its tilesets.
+
+    The hash is kept next to the bakes with the size and modification time
+    of each of those files, and only worked out again when one has changed.
+    """
+    key = "{} {} {} {}".format(VERSION, CHUNK_PIXEL_SIZE, TILE_SCALING, ",".join(layer_names))
+    paths = [level_data.map_name] + sorted({tile.source for tile in level_data.tiles.values()})
+    stats = {path: _file_stat(path) for path in paths}
+    cache_path = _hash_cache_path(level_data.map_name)
+    try:
+        with open(cache_path) as cache_file:
+            cache = json.load(cache_file)
+        if cache.get("key") == key and cache.get("stats") == stats:
+            return cache["hash"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    digest = hashlib.sha256()
+    digest.update(key.encode("utf-8"))
+    for path in paths:
+        digest.update(path.encode("utf-8"))
+        with open(path, "rb") as source_file:
+            digest.update(hashlib.sha256(source_file.read()).digest())
+    digest = digest.hexdigest()
+
+    # Written to a temporary file and swapped in, so a reader never sees half of it
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(cache_path), suffix=".tmp",
+                                         delete=False) as cache_file:
+            json.dump({"key": key, "stats": stats, "hash": digest}, cache_file)
+        os.replace(cache_file.name, cache_path)
+    except OSError:
+        pass
+    return digest
+
+
+def _file_stat(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _hash_cache_path(map_name):
+    """Where the bake hash of a map is kept with the stats of the files it was worked out from"""
+    folder, file_name = os.path.split(map_name)
+    return os.path.join(folder, BAKED_FOLDER, os.path.splitext(file_name)[0] + HASH_CACHE_SUFFIX)
+
+
+def baked_folder(map_name, digest):
+    """Where the chunk images of a map are kept for one bake hash"""
+    folder, file_name = os.path.split(map_name)
+    base_name = os.path.splitext(file_name)[0]
+    return os.path.join(folder, BAKED_FOLDER, "{}-{}".format(base_name, digest[:16]))
+
+
+def _tile_image(tile, image_cache):
+    """The image of a tile as it is drawn, flipped the way arcade.load_texture does"""
+    key = (tile.source, tile.flipped_horizontally, tile.flipped_vertically, tile.flipped_diagonally)
+    image = image_cache.get(key)
+    if image is None:
+        image = Image.open(tile.source).convert("RGBA")
+        if tile.flipped_diagonally:
+            image = image.transpose(Image.TRANSPOSE)
+        if tile.flipped_horizontally:
+            image = image.transpose(Image.FLIP_LEFT_RIGHT)
+        if tile.flipped_vertically:
+            image = image.transpose(Image.FLIP_TOP_BOTTOM)
+        if TILE_SCALING != 1:
+            image = image.resize((round(image.width * TILE_SCALING), round(image.height * TILE_SCALING)))
+        image_cache[key] = image
+    return image
+
+
+def bake_layer(level_data, layer_name, folder, image_cache=None):
+    """Composites the still tiles of a layer into chunk images.
+
+    Tiles are pasted in the order arcade would draw their sprites, and a
+    tile that crosses a chunk edge is pasted into every chunk it touches.
+    Returns a list of [chunk_x, chunk_y, file name] for the chunks written.
+    """
+    if image_cache is None:
+        image_cache = {}
+    chunk_size = CHUNK_PIXEL_SIZE
+    chunks = {}
+    for gid, tile, center_x, center_y in level_data.tile_positions(layer_name, TILE_SCALING):
+        if tile.frames:
+            continue
+        image = _tile_image(tile, image_cache)
+        left = center_x - image.width / 2
+        top = center_y + image.height / 2
+        for chunk_x in range(int(left // chunk_size),
+                             int(math.ceil((left + image.width) / chunk_size))):
+            for chunk_y in range(int((top - image.height) // chunk_size),
+                                 int(math.ceil(top / chunk_size))):
+                chunk = chunks.get((chunk_x, chunk_y))
+                if chunk is None:
+                    chunk = Image.new("RGBA", (chunk_size, chunk_size))
+                    chunks[(chunk_x, chunk_y)] = chunk
+                # Chunk images are y down, the world is y up
+                chunk.alpha_composite(image, *_paste_offset(left - chunk_x * chunk_size,
+                                                           (chunk_y + 1) * chunk_size - top,
+                                                           chunk_size, image))
+
+    written = []
+    slug = layer_name.lower().replace(" ", "_").replace("'", "")
+    for (chunk_x, chunk_y), chunk in sorted(chunks.items()):
+        file_name = "{}_{}_{}.png".format(slug, chunk_x, chunk_y)
+        chunk.save(os.path.join(folder, file_name))
+        written.append([chunk_x, chunk_y, file_name])
+    return written
+
+
+def _paste_offset(x, y, chunk_size, image):
+    """Destination and source box for alpha_composite, which needs the destination inside the chunk"""
+    x, y = int(round(x)), int(round(y))
+    source_left, source_top = max(-x, 0), max(-y, 0)
+    return (max(x, 0), max(y, 0)), (source_left, source_top,
+                                    min(image.width, chunk_size - x), min(image.height, chunk_size - y))
+
+
+def bake_level(level_data, layer_names=BAKED_LAYER_NAMES):
+    """Bakes the static layers of a level, reusing an earlier bake with the same hash.
+
+    Returns (folder, manifest), where manifest maps a layer name to its list
+    of [chunk_x, chunk_y, file name].
+    """
+    digest = bake_hash(level_data, layer_names)
+    folder = baked_folder(level_data.map_name, digest)
+    layers = _read_manifest(folder, digest)
+    if layers is not None:
+        return folder, layers
+
+    # The prefetch thread and the main thread can both load a level, so only one of them bakes it
+    with _bake_lock(level_data.map_name):
+        layers = _read_manifest(folder, digest)
+        if layers is not None:
+            return folder, layers
+
+        # Bake into a temporary folder of its own and swap it in, so a bake cut short is never used
+        os.makedirs(os.path.dirname(folder), exist_ok=True)
+        temp_folder = tempfile.mkdtemp(prefix=os.path.basename(folder) + ".tmp", dir=os.path.dirname(folder))
+        try:
+            image_cache = {}
+            layers = {layer_name: bake_layer(level_data, layer_name, temp_folder, image_cache)
+                      for layer_name in layer_names}
+            with open(os.path.join(temp_folder, MANIFEST_NAME), "w") as manifest_file:
+                json.dump({"hash": digest, "chunk_size": CHUNK_PIXEL_SIZE, "layers": layers}, manifest_file)
+
+            shutil.rmtree(folder, ignore_errors=True)
+            try:
+                os.replace(temp_folder, folder)
+            except OSError:
+                # Another process baked the same hash first
+                pass
+        finally:
+            shutil.rmtree(temp_folder, ignore_errors=True)
+        _remove_stale_bakes(level_data.map_name, folder)
+    return folder, layers
+
+
+def _read_manifest(folder, digest):
+    """The layers of a finished bake in folder, or None if there isn't one for digest"""
+    try:
+        with open(os.path.join(folder, MANIFEST_NAME)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+    return manifest["layers"] if manifest.get("hash") == digest else None
+
+
+def _bake_lock(map_name):
+    """The lock held while a map is baked"""
+    with _bake_locks_lock:
+        return _bake_locks.setdefault(os.path.normpath(map_name), threading.Lock())
+
+
+def _remove_stale_bakes(map_name, keep):
+    """Deletes the bakes of a map made from older versions of it"""
+    for path in glob.glob(baked_folder(map_name, "*")):
+        if os.path.normpath(path) != os.path.normpath(keep) and ".tmp" not in path:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def baked_chunks(level_data, layer_name):
+    """Yields (image path, center_x, center_y) for every baked chunk of a layer"""
+    folder, layers = bake_level(level_data)
+    for chunk_x, chunk_y, file_name in layers.get(layer_name, ()):
+        yield (os.path.join(folder, file_name),
+               (chunk_x + 0.5) * CHUNK_PIXEL_SIZE,
+               (chunk_y + 0.5) * CHUNK_PIXEL_SIZE)
+
+
+def main():
+    """Bakes the static layers of tmx maps"""
+    parser = argparse.ArgumentParser(description="Bake the Background and Foreground layers into chunk images.")
+    parser.add_argument("maps", nargs="*", help="tmx files to bake, defaults to every level")
+    args = parser.parse_args()
+
+    map_names = args.maps or sorted(glob.glob(MAP_NAME.format("*")))
+    for map_name in map_names:
+        level_data = load_map(map_name)
+        start_time = time.perf_counter()
+        folder, layers = bake_level(level_data)
+        bake_time = time.perf_counter() - start_time
+
+        for layer_name in BAKED_LAYER_NAMES:
+            tiles = sum(1 for _, tile, _, _ in level_data.tile_positions(layer_name, TILE_SCALING)
+                        if not tile.frames)
+            print("{} {}: {} tiles -> {} chunks".format(map_name, layer_name, tiles,
+                                                        len(layers.get(layer_name, ()))))
+        print("{} -> {} ({:.1f} ms)".format(map_name, folder, bake_time * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Background prefetch of the next level
+
+While a level is played, a worker thread prepares the one after it, so the
+switch at the end of the map only has to swap in work that is already done.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from constants import *
+
+#How many swap latencies are kept for the metrics
+SWAP_HISTORY = 100
+
+
+class LevelPrefetcher:
+    """Prepares levels on a worker thread and hands them over when asked.
+
+    prepare is called on the worker with a level number and returns whatever
+    the caller needs to switch to that level.  take() returns the prepared
+    level and starts preparing the next one.  If the prefetch is still
+    running take() waits for it, and if it never started or failed the level
+    is prepared on the calling thread, so take() always returns a level.
+    """
+
+    def __init__(self, prepare, last_level=TOTAL_LEVELS):
+        self.prepare = prepare
+        self.last_level = last_level
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="level-prefetch")
+        self._futures = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.failures = 0
+        self.swap_times = deque(maxlen=SWAP_HISTORY)
+
+    def prefetch(self, level):
+        """Starts preparing a level in the background, if it isn't already"""
+        if level > self.last_level:
+            return
+        with self._lock:
+            if level not in self._futures:
+                self._futures[level] = self.executor.submit(self.prepare, level)
+
+    def run(self, function, *args):
+        """Runs other work on the worker thread, after the levels already queued. Returns its future."""
+        return self.executor.submit(function, *args)
+
+    def ready(self, level):
+        """True if a prefetched level is prepared and waiting"""
+        with self._lock:
+            future = self._futures.get(level)
+        return future is not None and future.done() and future.exception() is None
+
+    def take(self, level):
+        """Returns the prepared level and starts prefetching the next one"""
+        start_time = time.perf_counter()
+        with self._lock:
+            future = self._futures.pop(level, None)
+
+        prepared = None
+        if future is not None:
+            if future.done():
+                self.hits += 1
+            else:
+                # Part of the work is done, so waiting beats starting again
+                self.misses += 1
+                self.waits += 1
+            try:
+                prepared = future.result()
+            except Exception:
+                self.failures += 1
+                prepared = None
+        else:
+            self.misses += 1
+
+        if prepared is None:
+            prepared = self.prepare(level)
+
+        self.swap_times.append(time.perf_counter() - start_time)
+        self.prefetch(level + 1)
+        return prepared
+
+    def cancel(self):
+        """Drops every prefetch that hasn't been taken"""
+        with self._lock:
+            futures = list(self._futures.values())
+            self._futures.clear()
+        for future in futures:
+            future.cancel()
+
+    def shutdown(self):
+        """Stops the worker thread"""
+        self.cancel()
+        self.executor.shutdown(wait=False)
+
+    def metrics(self):
+        """Prefetch hit/miss counts and swap latency in milliseconds"""
+        swap_times = [swap_time * 1000 for swap_time in self.swap_times]
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "waits": self.waits,
+            "failures": self.failures,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "last_swap_ms": swap_times[-1] if swap_times else 0.0,
+            "mean_swap_ms": sum(swap_times) / len(swap_times) if swap_times else 0.0,
+            "max_swap_ms": max(swap_times) if swap_times else 0.0,
+        }
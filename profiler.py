@@ -0,0 +1,196 @@
+"""
+Per phase frame timings
+
+A FrameProfiler times the named phases of each frame (physics, moving
+platforms, coins, drawing each layer...) into a ring buffer of the last
+PROFILE_FRAMES frames, so a slow frame can be pinned on the phase that
+caused it.  Phases are timed as laps: each lap() records the time since
+the previous one, so timing a phase is a single clock read.
+
+A disabled profiler returns from every call straight away and allocates
+nothing, so the game and the simulation keep one around all the time.
+"""
+
+import csv
+import json
+import os
+import time
+
+import numpy
+
+#Frames kept in the ring buffer
+PROFILE_FRAMES = 600
+
+#Most phases a profiler can tell apart
+MAX_PHASES = 48
+
+#Upper edges of the histogram bins in milliseconds, the last bin holds everything slower
+HISTOGRAM_EDGES_MS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.7, 33.3)
+
+PERCENTILES = (50, 90, 99)
+
+#Frames between refreshes of the overlay text, so it stays readable
+OVERLAY_REFRESH_FRAMES = 30
+
+
+class FrameProfiler:
+    """Times the phases of each frame into a ring buffer.
+
+    A frame is timed as sections ("update", "draw") made of phases:
+
+        profiler.start("update")
+        ...
+        profiler.lap("update.physics")
+        ...
+        profiler.lap("update.coins")
+        profiler.stop("update")
+        ...
+        profiler.end_frame()
+
+    A phase timed more than once in a frame adds up.
+    """
+
+    def __init__(self, capacity=PROFILE_FRAMES, enabled=False):
+        self.capacity = capacity
+        self.enabled = enabled
+        self.phases = []
+        self.columns = {}
+        self.samples = None
+        self.frame_count = 0
+        self.current = [0.0] * MAX_PHASES
+        self.last_time = 0.0
+        self.section_starts = {}
+        self.overlay = []
+        self.overlay_frame = None
+
+    def __len__(self):
+        """Number of frames in the ring buffer"""
+        return min(self.frame_count, self.capacity)
+
+    def _column(self, phase):
+        column = self.columns.get(phase)
+        if column is None:
+            if len(self.phases) == MAX_PHASES:
+                raise ValueError("A FrameProfiler can't time more than {} phases".format(MAX_PHASES))
+            column = len(self.phases)
+            self.columns[phase] = column
+            self.phases.append(phase)
+        return column
+
+    def start(self, section):
+        """Starts timing a section, and the first lap in it"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.section_starts[section] = now
+        self.last_time = now
+
+    def lap(self, phase):
+        """Adds the time since the last lap or start to a phase"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.current[self._column(phase)] += now - self.last_time
+        self.last_time = now
+
+    def stop(self, section):
+        """Adds the time since start(section) to the section"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        start_time = self.section_starts.pop(section, None)
+        if start_time is not None:
+            self.current[self._column(section)] += now - start_time
+        self.last_time = now
+
+    def end_frame(self):
+        """Stores the timings of the frame in the ring buffer and starts the next one"""
+        if not self.enabled:
+            return
+        if self.samples is None:
+            self.samples = numpy.zeros((self.capacity, MAX_PHASES))
+        self.samples[self.frame_count % self.capacity] = self.current
+        self.current = [0.0] * MAX_PHASES
+        self.frame_count += 1
+
+    def clear(self):
+        """Forgets every frame recorded so far"""
+        self.frame_count = 0
+        self.current = [0.0] * MAX_PHASES
+        self.section_starts.clear()
+        self.overlay = []
+        self.overlay_frame = None
+
+    def frames_ms(self):
+        """The ring buffer in milliseconds, oldest frame first, one column per phase"""
+        count = len(self)
+        if count == 0:
+            return numpy.zeros((0, len(self.phases)))
+        rows = numpy.arange(self.frame_count - count, self.frame_count) % self.capacity
+        return self.samples[rows, :len(self.phases)] * 1000
+
+    def summary(self):
+        """Percentiles, mean, max and histogram of every phase, in milliseconds.
+
+        A frame a phase didn't run in counts as 0 ms for it, so the numbers
+        are what the phase costs per frame.
+        """
+        frames = self.frames_ms()
+        phases = {}
+        if len(frames) == 0:
+            return phases
+        bins = numpy.array((0.0,) + HISTOGRAM_EDGES_MS + (numpy.inf,))
+        percentiles = numpy.percentile(frames, PERCENTILES, axis=0)
+        for column, phase in enumerate(self.phases):
+            times = frames[:, column]
+            counts, _ = numpy.histogram(times, bins)
+            result = {"p{}_ms".format(percentile): float(percentiles[index, column])
+                      for index, percentile in enumerate(PERCENTILES)}
+            result["mean_ms"] = float(times.mean())
+            result["max_ms"] = float(times.max())
+            result["histogram"] = counts.tolist()
+            phases[phase] = result
+        return phases
+
+    def report(self):
+        """The summary as a dict ready to be written as JSON"""
+        return {
+            "frames": len(self),
+            "frames_recorded": self.frame_count,
+            "capacity": self.capacity,
+            "histogram_edges_ms": list(HISTOGRAM_EDGES_MS),
+            "phases": self.summary(),
+        }
+
+    def overlay_lines(self):
+        """Lines of text summing up each phase, refreshed every OVERLAY_REFRESH_FRAMES frames"""
+        if (self.overlay_frame is None
+                or self.frame_count - self.overlay_frame >= OVERLAY_REFRESH_FRAMES):
+            self.overlay_frame = self.frame_count
+            self.overlay = ["{:<24} p50 {:6.3f}  p99 {:6.3f}  max {:6.3f} ms".format(
+                                phase, result["p50_ms"], result["p99_ms"], result["max_ms"])
+                            for phase, result in self.summary().items()]
+        return self.overlay
+
+    def write_json(self, path):
+        """Writes the summary to a JSON file"""
+        _make_folder(path)
+        with open(path, "w") as json_file:
+            json.dump(self.report(), json_file, indent=2)
+            json_file.write("\n")
+
+    def write_csv(self, path):
+        """Writes every frame in the ring buffer to a CSV file, one column per phase in milliseconds"""
+        _make_folder(path)
+        first_frame = self.frame_count - len(self)
+        with open(path, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["frame"] + self.phases)
+            for index, row in enumerate(self.frames_ms().tolist()):
+                writer.writerow([first_frame + index] + ["{:.4f}".format(value) for value in row])
+
+
+def _make_folder(path):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
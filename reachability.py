@@ -0,0 +1,470 @@
+"""
+Offline reachability and solvability check of level maps
+
+Searches the places the player can get to from the start of a map and
+reports whether the end of it can be reached, the quickest way there, and
+the coins no route passes.  The places are where the player stands (on a
+platform or holding still on a ladder) and the ways between them are
+short moves: a step, a climb, a jump or a run off a ledge.
+
+Every move is played tick by tick by the game's own rules: a Probe is a
+Simulation holding nothing but the player, so the keys go through
+Simulation.set_inputs and process_keychange and the player is moved by the
+physics engine, ramping up small steps as it does.  The search starts each
+move from the exact position the player was left at, so the quickest route
+found is the one the game plays.  It is checked by playing its keys through
+a Simulation of the whole level, which has to end at the end of the map.
+
+Moving platforms are taken as floors along their whole path, that the
+player can land on from above whenever they like, as they could wait for
+the platform to come.  Platforms that move up and down can also be ridden
+between any two heights.  Enemies standing still are deadly, the others
+are left out.  A route using a moving platform can't be played without
+waiting for it, so it isn't replayed.
+
+Run this file on a set of maps to check them in parallel:
+
+    python reachability.py maps/*.tmx maps/.synthetic/*.tmx --workers 8
+"""
+
+import argparse
+import heapq
+import json
+import math
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from collectibles import CollectibleGrid
+from collision_grid import CollisionGrid
+from constants import *
+from kinematics import KinematicStore
+from levelpack import load_map
+from simulation import (Body, BodyList, ENGINE_GRID, EVENT_DEATH, EVENT_GAME_OVER, EVENT_LEVEL, GridPhysicsEnginePlatformer,
+                        Inputs, PlayerBody, Simulation, enemy_bodies, object_bodies, prepare_level, tile_bodies)
+
+#Size in pixels of the cells places are told apart by, the player's feet go by the height
+PLACE_WIDTH = GRID_PIXEL_SIZE
+PLACE_HEIGHT = 4
+
+#Most ticks a move may take before it is given up on, as a fall that never lands
+MAX_MOVE_TICKS = 240
+
+#Ticks a move that keeps its direction held may run before it has to be in the air
+AIR_DEADLINE_TICKS = 10
+
+#How far feet may be below the top of a moving platform's path and still stand on it
+LEDGE_TOLERANCE = 0.01
+
+#How far a replayed route may stray from the positions the search found
+REPLAY_TOLERANCE = 0.01
+
+#A move: the keys held at each tick.  up and down are held for the ticks in
+#[0, up_ticks) and [0, down_ticks), the direction for [move_start, move_end).
+#A held move keeps its direction until the player has been in the air and
+#landed again.  Other moves end once the keys are let go and the player stands.
+Move = namedtuple("Move", ["name", "up_ticks", "down_ticks", "direction", "move_start", "move_end", "held"])
+
+_STEP_TICKS = int(math.ceil(GRID_PIXEL_SIZE / PLAYER_MOVEMENT_SPEED))
+_RISE_TICKS = int(PLAYER_JUMP_SPEED // GRAVITY)
+
+MOVES = (
+    Move("step left", 0, 0, -1, 0, _STEP_TICKS, False),
+    Move("step right", 0, 0, 1, 0, _STEP_TICKS, False),
+    Move("climb up", _STEP_TICKS, 0, 0, 0, 0, False),
+    Move("climb down", 0, _STEP_TICKS, 0, 0, 0, False),
+    Move("jump", 1, 0, 0, 0, 0, True),
+    Move("jump left", 1, 0, -1, 0, MAX_MOVE_TICKS, True),
+    Move("jump right", 1, 0, 1, 0, MAX_MOVE_TICKS, True),
+    Move("jump up then left", 1, 0, -1, _RISE_TICKS // 2, MAX_MOVE_TICKS, True),
+    Move("jump up then right", 1, 0, 1, _RISE_TICKS // 2, MAX_MOVE_TICKS, True),
+    Move("hop left", 1, 0, -1, 0, _RISE_TICKS // 3, False),
+    Move("hop right", 1, 0, 1, 0, _RISE_TICKS // 3, False),
+    Move("run off left", 0, 0, -1, 0, MAX_MOVE_TICKS, True),
+    Move("run off right", 0, 0, 1, 0, MAX_MOVE_TICKS, True),
+)
+
+#What the player does when the level starts, fall to the ground
+SPAWN_MOVE = Move("spawn", 0, 0, 0, 0, 0, False)
+
+MOVES_BY_NAME = {move.name: move for move in MOVES + (SPAWN_MOVE,)}
+
+#Names of the moves made by riding a lift
+RIDE_UP = "ride up"
+RIDE_DOWN = "ride down"
+
+#Place of the end of the map
+GOAL = "goal"
+
+#A platform moving up and down: its left and right, the heights of its top it can be ridden between, and its speed
+Lift = namedtuple("Lift", ["left", "right", "tops", "speed"])
+
+#The way a move went: ticks it took, end (a (center_x, center_y), GOAL or None), coins passed,
+#and whether it stood on the path of a moving platform
+Outcome = namedtuple("Outcome", ["ticks", "end", "coins", "used_ledge"])
+
+#route is a (move, (center_x, center_y), ticks) for each move on the quickest way to the end of the map,
+#starting with the spawn.  replayed is True if a Simulation played it to the end of the map, False if
+#it didn't (replay_note says where it went wrong) and None if the route uses moving platforms.
+Report = namedtuple("Report", ["map_name", "completable", "route", "route_ticks", "coins",
+                               "unreachable_coins", "places", "edges", "replayed", "replay_note", "seconds"])
+
+
+def move_inputs(move, tick):
+    """The keys a move holds at a tick"""
+    moving = move.move_start <= tick < move.move_end
+    return Inputs(up=tick < move.up_ticks, down=tick < move.down_ticks,
+                  left=moving and move.direction < 0, right=moving and move.direction > 0)
+
+
+class Floors:
+    """The platforms of a map with the paths of its moving platforms as one way floors.
+
+    Stands in for the BodyList of platforms given to the physics engine.  A
+    ledge only counts for a player whose feet were at or above its top when
+    feet was last set, so it can be jumped through from below.
+    """
+
+    def __init__(self, walls, ledges):
+        self.walls = walls
+        self.ledges = ledges
+        self.moving = []
+        self.feet = 0.0
+        self.used_ledge = False
+
+    def check_for_collision(self, body):
+        """Returns the platforms and the ledges under the feet that overlap body"""
+        hit_list = self.walls.check_for_collision(body)
+        if not self.ledges:
+            return hit_list
+        ledges = [ledge for ledge in self.ledges.check_for_collision(body)
+                  if ledge.top <= self.feet + LEDGE_TOLERANCE]
+        if ledges:
+            self.used_ledge = True
+            hit_list.extend(ledges)
+        return hit_list
+
+    def collides(self, body):
+        """True if a platform or a ledge under the feet overlaps body"""
+        return len(self.check_for_collision(body)) > 0
+
+
+class Probe(Simulation):
+    """A Simulation of the player alone on the static layers of a map, to play moves with"""
+
+    def __init__(self, graph):
+        super().__init__()
+        self.graph = graph
+        self.floors = Floors(graph.walls, graph.ledges)
+        self.player_sprite = PlayerBody()
+        self.physics_engine = GridPhysicsEnginePlatformer(self.player_sprite, self.floors, GRAVITY,
+                                                          ladders=graph.ladders,
+                                                          moving_platforms=KinematicStore([]))
+
+    def tick(self, inputs):
+        """The player's part of Simulation.step and Simulation.update"""
+        player = self.player_sprite
+        self.floors.feet = player.bottom
+        self.set_inputs(inputs)
+        self.physics_engine.update()
+        self.floors.feet = player.bottom
+        self.process_keychange()
+
+    def standing(self):
+        """True if the player holds still on a platform or a ladder"""
+        if self.player_sprite.change_y != 0:
+            return False
+        return self.physics_engine.is_on_ladder() or self.physics_engine.can_jump()
+
+    def play(self, start, move):
+        """Plays a move from a (center_x, center_y) and returns its Outcome.
+
+        The end is where the player ends up standing, GOAL if the move
+        reaches the end of the map, or None if the player dies, falls off
+        the map or never stops.
+        """
+        graph = self.graph
+        player = self.player_sprite
+        player.center_x, player.center_y = start
+        player.change_x = 0
+        player.change_y = 0
+        self.inputs = Inputs()
+        self.jump_needs_reset = False
+        self.floors.used_ledge = False
+        keys_let_go = max(move.down_ticks, 0 if move.held else move.move_end)
+        airborne = False
+        end = None
+        for tick in range(MAX_MOVE_TICKS):
+            self.tick(move_inputs(move, tick))
+            graph.coin_list.collect(player)
+            if player.center_x >= graph.end_of_map:
+                end = GOAL
+                break
+            if player.top < 0 or graph.hazards.collides(player) or graph.enemies.collides(player):
+                break
+            standing = self.standing()
+            airborne = airborne or not standing
+            #Up has to be let go before the move ends, so the next one starts as from rest
+            if standing and tick >= move.up_ticks and tick + 1 >= keys_let_go and (not move.held or airborne):
+                end = (player.center_x, player.center_y)
+                break
+            if move.held and not airborne and tick + 1 >= AIR_DEADLINE_TICKS:
+                break
+        return Outcome(tick + 1, end, graph.coin_list.reset(), self.floors.used_ledge)
+
+
+class MapGraph:
+    """The places the player can get to on one map, and the moves between them.
+
+    positions holds the (center_x, center_y) the player stands at for each
+    place, keyed by place_key.  previous[key] is the (key, move, ticks) it
+    was got to by on the quickest way from the start, and edges counts the
+    moves found that end somewhere.
+    """
+
+    def __init__(self, level_data):
+        self.level_data = level_data
+        self.end_of_map = level_data.end_of_map
+        self.walls = self.tile_layer_list(PLATFORMS_LAYER_NAME)
+        self.ladders = self.tile_layer_list(LADDERS_LAYER_NAME)
+        self.hazards = self.tile_layer_list(DONT_TOUCH_LAYER_NAME)
+        self.enemies = BodyList(use_spatial_hash=True)
+        self.enemies.extend(enemy for enemy in enemy_bodies(level_data)
+                            if not enemy.change_x and not enemy.change_y)
+
+        #Moving platforms, as one way floors along their path
+        self.lifts = []
+        self.ledges = BodyList(use_spatial_hash=True)
+        for platform in object_bodies(level_data, MOVING_PLATFORMS_LAYER_NAME):
+            self.ledges.extend(self.platform_ledges(platform))
+
+        self.coins = list(object_bodies(level_data, COINS_LAYER_NAME))
+        self.coin_list = CollectibleGrid.for_level(level_data, self.coins, TILE_SCALING)
+        self.collected = set()
+
+        self.probe = Probe(self)
+        self.positions = {}
+        self.previous = {}
+        self.ticks = {}
+        self.start = None
+        self.edges = 0
+        self.used_ledges = set()
+
+    def tile_layer_list(self, layer_name):
+        """The bodies of a tile layer in a CollisionGrid, as the grid engine has them"""
+        body_list = CollisionGrid.for_level(self.level_data, TILE_SCALING)
+        body_list.extend(tile_bodies(self.level_data, layer_name))
+        return body_list
+
+    def platform_ledges(self, platform):
+        """Bodies of a moving platform at every place it can be, as wide as its whole path"""
+        left = platform.left
+        right = platform.right
+        if platform.change_x:
+            if platform.boundary_left is not None:
+                left = min(left, platform.boundary_left)
+            if platform.boundary_right is not None:
+                right = max(right, platform.boundary_right)
+        tops = [platform.top]
+        if platform.change_y and platform.boundary_bottom is not None and platform.boundary_top is not None:
+            lowest = platform.boundary_bottom + platform.height
+            count = int(math.ceil((platform.boundary_top - lowest) / GRID_PIXEL_SIZE))
+            tops = [lowest + index * GRID_PIXEL_SIZE for index in range(count)]
+            tops.append(platform.boundary_top)
+            self.lifts.append(Lift(left, right, tops, abs(platform.change_y)))
+        center_x = (left + right) / 2
+        hit_box = (left - center_x, -platform.height, right - center_x, 0)
+        return [Body(center_x, top, hit_box) for top in tops]
+
+    def place_key(self, position):
+        """Places are told apart by the PLACE_WIDTH by PLACE_HEIGHT cell the player's feet are in"""
+        if position == GOAL:
+            return GOAL
+        center_x, center_y = position
+        return (int(center_x // PLACE_WIDTH), int((center_y + self.probe.player_sprite.hit_box[1]) // PLACE_HEIGHT))
+
+    def rides(self, position):
+        """(move, end, ticks) for riding each lift under a position a tile up or down"""
+        center_x, center_y = position
+        feet = center_y + self.probe.player_sprite.hit_box[1]
+        player = Body(center_x, center_y, self.probe.player_sprite.hit_box)
+        for lift in self.lifts:
+            if not lift.left < center_x < lift.right:
+                continue
+            for height, top in enumerate(lift.tops):
+                if abs(feet - top) > LEDGE_TOLERANCE:
+                    continue
+                for name, other in ((RIDE_DOWN, height - 1), (RIDE_UP, height + 1)):
+                    if 0 <= other < len(lift.tops):
+                        player.center_y = center_y + lift.tops[other] - top
+                        if not self.walls.collides(player):
+                            ticks = int(math.ceil(abs(lift.tops[other] - top) / lift.speed))
+                            yield name, (center_x, player.center_y), ticks
+
+    def build(self):
+        """Finds the places the player can get to, quickest first, with every move from each"""
+        start = (float(PLAYER_START_X), float(PLAYER_START_Y))
+        spawn = self.probe.play(start, SPAWN_MOVE)
+        self.collected |= set(spawn.coins)
+        if spawn.end is None:
+            return self
+        self.start = start
+        queue = []
+        self.reach(queue, spawn.end, spawn.ticks, None, SPAWN_MOVE.name, spawn.ticks, spawn.used_ledge)
+
+        while queue:
+            ticks, _, key = heapq.heappop(queue)
+            if key == GOAL or ticks > self.ticks[key]:
+                continue
+            position = self.positions[key]
+            for move in MOVES:
+                outcome = self.probe.play(position, move)
+                self.collected.update(outcome.coins)
+                if outcome.end is not None:
+                    self.reach(queue, outcome.end, ticks + outcome.ticks, key, move.name, outcome.ticks,
+                               outcome.used_ledge)
+            for name, end, ride_ticks in self.rides(position):
+                self.reach(queue, end, ticks + ride_ticks, key, name, ride_ticks, True)
+        return self
+
+    def reach(self, queue, position, ticks, from_key, move, move_ticks, used_ledge):
+        """Records getting to a position, if it is the quickest way there so far"""
+        self.edges += 1
+        key = self.place_key(position)
+        if ticks >= self.ticks.get(key, ticks + 1):
+            return
+        self.ticks[key] = ticks
+        self.positions[key] = position
+        self.previous[key] = (from_key, move, move_ticks)
+        if used_ledge:
+            self.used_ledges.add(key)
+        else:
+            self.used_ledges.discard(key)
+        heapq.heappush(queue, (ticks, self.edges, key))
+
+    def shortest_route(self):
+        """(route, ticks, used_ledge) of the quickest way from the start to the end of the map.
+
+        The route is a (move, (center_x, center_y), ticks) for each move and
+        used_ledge tells if any of them used a moving platform.  All three
+        are None if there is no way.
+        """
+        if GOAL not in self.previous:
+            return None, None, None
+        route = []
+        used_ledge = False
+        key = GOAL
+        while key is not None:
+            from_key, move, move_ticks = self.previous[key]
+            used_ledge = used_ledge or key in self.used_ledges
+            route.append((move, self.positions[from_key] if from_key is not None else self.start, move_ticks))
+            key = from_key
+        return route[::-1], self.ticks[GOAL], used_ledge
+
+
+def replay_route(map_name, route):
+    """Plays a route's keys through a Simulation of the map. Returns (True, None) or (False, what went wrong).
+
+    The player has to be where the route says at the start of every move
+    and get to the end of the map with the last one.
+    """
+    simulation = Simulation(lambda level: prepare_level(level, ENGINE_GRID, map_name, False))
+    simulation.setup(TOTAL_LEVELS)
+    player = simulation.player_sprite
+    for index, (name, (center_x, center_y), ticks) in enumerate(route):
+        if abs(player.center_x - center_x) > REPLAY_TOLERANCE or abs(player.center_y - center_y) > REPLAY_TOLERANCE:
+            return False, "move {} ({}) starts at ({:.2f}, {:.2f}), not ({:.2f}, {:.2f})".format(
+                index, name, player.center_x, player.center_y, center_x, center_y)
+        move = MOVES_BY_NAME[name]
+        for tick in range(ticks):
+            kinds = [event.kind for event in simulation.step(move_inputs(move, tick))]
+            if EVENT_DEATH in kinds:
+                return False, "the player dies during move {} ({})".format(index, name)
+            if EVENT_GAME_OVER in kinds or EVENT_LEVEL in kinds:
+                if index == len(route) - 1 and tick == ticks - 1:
+                    return True, None
+                return False, "the end of the map is reached early, in move {} ({})".format(index, name)
+    return False, "the route ends at ({:.2f}, {:.2f}), not at the end of the map".format(
+        player.center_x, player.center_y)
+
+
+def analyze_map(map_name):
+    """Checks one map and returns its Report"""
+    start_time = time.perf_counter()
+    graph = MapGraph(load_map(map_name)).build()
+    route, route_ticks, used_ledge = graph.shortest_route()
+    replayed = replay_note = None
+    if route is None:
+        pass
+    elif used_ledge:
+        replay_note = "the route uses moving platforms"
+    else:
+        replayed, replay_note = replay_route(map_name, route)
+    return Report(map_name, route is not None, route, route_ticks, len(graph.coins),
+                  [(index, (coin.center_x, coin.center_y)) for index, coin in enumerate(graph.coins)
+                   if index not in graph.collected],
+                  len(graph.positions), graph.edges, replayed, replay_note,
+                  time.perf_counter() - start_time)
+
+
+def analyze_maps(map_names, workers=None):
+    """Checks maps on a pool of worker processes, one per core by default. Returns their Reports in order."""
+    map_names = list(map_names)
+    if workers == 1 or len(map_names) <= 1:
+        return [analyze_map(map_name) for map_name in map_names]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(analyze_map, map_names))
+
+
+def format_report(report, show_route=False):
+    """Lines of text describing a Report"""
+    lines = []
+    if report.completable:
+        result = "completable in {} ticks ({} moves)".format(report.route_ticks, len(report.route))
+    else:
+        result = "NOT completable"
+    lines.append("{}: {}, {}/{} coins reachable, {} places {} edges, {:.2f} s".format(
+        report.map_name, result, report.coins - len(report.unreachable_coins), report.coins,
+        report.places, report.edges, report.seconds))
+    if report.replayed:
+        lines.append("  route replayed through Simulation to the end of the map")
+    elif report.replayed is False:
+        lines.append("  route NOT replayed: {}".format(report.replay_note))
+    elif report.replay_note:
+        lines.append("  route not replayed, {}".format(report.replay_note))
+    for index, (center_x, center_y) in report.unreachable_coins:
+        lines.append("  unreachable coin {} at ({:.0f}, {:.0f})".format(index, center_x, center_y))
+    if show_route and report.route:
+        for move, (center_x, center_y), ticks in report.route:
+            lines.append("  {} from ({:.0f}, {:.0f}), {} ticks".format(move, center_x, center_y, ticks))
+    return lines
+
+
+def main():
+    """Checks the maps given and exits with 1 if any can't be completed or its route doesn't replay"""
+    parser = argparse.ArgumentParser(description="Check that level maps can be completed.")
+    parser.add_argument("maps", nargs="*", help="tmx maps to check, the game's levels by default")
+    parser.add_argument("--workers", type=int, help="worker processes, one per core by default")
+    parser.add_argument("--route", action="store_true", help="print the quickest route through each map")
+    parser.add_argument("--json", metavar="FILE", help="also write the reports to a JSON file")
+    args = parser.parse_args()
+
+    map_names = args.maps or [MAP_NAME.format(level) for level in range(1, TOTAL_LEVELS + 1)]
+    start_time = time.perf_counter()
+    reports = analyze_maps(map_names, args.workers)
+    for report in reports:
+        for line in format_report(report, args.route):
+            print(line)
+    print("Checked {} maps in {:.2f} s".format(len(reports), time.perf_counter() - start_time))
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump([report._asdict() for report in reports], json_file, indent=2)
+            json_file.write("\n")
+    if not all(report.completable and report.replayed is not False for report in reports):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Input recording and headless replay
+
+A replay is the sequence of key state changes of a session, each tagged
+with the tick it happened before, plus the level and collision engine it
+started with and the score, level and position it ended with.  The game
+rules are deterministic, so feeding the changes back through
+Simulation.set_inputs (and so process_keychange, which also rebuilds
+jump_needs_reset) between the same steps reproduces the session exactly.
+
+Layout, little endian:
+
+    header          HEADER struct
+    result          RESULT struct, the state the session ended in
+    changes         CHANGE struct for each key state change
+
+Run this file to replay logs as fast as the simulation goes and check that
+they still end where they were recorded to.
+"""
+
+import argparse
+import functools
+import os
+import struct
+import sys
+import time
+from collections import namedtuple
+
+from constants import *
+from simulation import Simulation, Inputs, prepare_level
+
+MAGIC = b"PRPL"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHH16sII")
+RESULT = struct.Struct("<iHBxdd")
+CHANGE = struct.Struct("<HB")
+
+#Longest gap between two changes a CHANGE can hold
+MAX_TICK_DELTA = 0xFFFF
+
+#Bits of the key state byte
+UP_BIT = 1
+DOWN_BIT = 2
+LEFT_BIT = 4
+RIGHT_BIT = 8
+
+# Where a session ended, compared after a replay
+ReplayResult = namedtuple("ReplayResult", ["score", "level", "game_over", "center_x", "center_y"])
+
+# A recorded session. changes is a list of (tick, key state byte).
+Replay = namedtuple("Replay", ["start_level", "engine", "ticks", "changes", "result"])
+
+
+class ReplayFormatError(Exception):
+    """Raised when a replay file can't be read"""
+
+
+def input_bits(inputs):
+    """Packs Inputs into a key state byte"""
+    return ((UP_BIT if inputs.up else 0) | (DOWN_BIT if inputs.down else 0)
+            | (LEFT_BIT if inputs.left else 0) | (RIGHT_BIT if inputs.right else 0))
+
+
+def bits_inputs(bits):
+    """Unpacks a key state byte into Inputs"""
+    return Inputs(bool(bits & UP_BIT), bool(bits & DOWN_BIT),
+                  bool(bits & LEFT_BIT), bool(bits & RIGHT_BIT))
+
+
+def simulation_result(simulation):
+    """The ReplayResult of a simulation as it is now"""
+    player = simulation.player_sprite
+    return ReplayResult(simulation.score, simulation.level, simulation.game_over,
+                        player.center_x, player.center_y)
+
+
+class InputRecorder:
+    """Records the key state changes applied to a Simulation.
+
+    Create it right after the simulation is set up and call record() with
+    every Inputs passed to set_inputs, in the same order.
+    """
+
+    def __init__(self, simulation):
+        self.simulation = simulation
+        self.start_level = simulation.level
+        self.engine = simulation.prepared_level.engine
+        self.start_tick = simulation.ticks
+        self.changes = []
+
+    def record(self, inputs):
+        """Records a key state applied before the next step"""
+        self.changes.append((self.simulation.ticks - self.start_tick, input_bits(inputs)))
+
+    def replay(self):
+        """The Replay of everything recorded so far"""
+        return Replay(self.start_level, self.engine, self.simulation.ticks - self.start_tick,
+                      list(self.changes), simulation_result(self.simulation))
+
+    def save(self, path):
+        """Writes what has been recorded so far to a replay file"""
+        write_replay(self.replay(), path)
+
+
+def write_replay(replay, path):
+    """Writes a Replay to a file"""
+    changes = bytearray()
+    last_tick = 0
+    last_bits = 0
+    for tick, bits in replay.changes:
+        # Gaps too long for one CHANGE are bridged by repeating the last state, which does nothing
+        while tick - last_tick > MAX_TICK_DELTA:
+            changes += CHANGE.pack(MAX_TICK_DELTA, last_bits)
+            last_tick += MAX_TICK_DELTA
+        changes += CHANGE.pack(tick - last_tick, bits)
+        last_tick = tick
+        last_bits = bits
+
+    result = replay.result
+    data = (HEADER.pack(MAGIC, VERSION, replay.start_level, replay.engine.encode("utf-8"),
+                        replay.ticks, len(changes) // CHANGE.size)
+            + RESULT.pack(result.score, result.level, result.game_over,
+                          result.center_x, result.center_y)
+            + bytes(changes))
+
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    temp_path = "{}.tmp{}".format(path, os.getpid())
+    with open(temp_path, "wb") as replay_file:
+        replay_file.write(data)
+    os.replace(temp_path, path)
+
+
+def read_replay(path):
+    """Reads a replay file into a Replay"""
+    with open(path, "rb") as replay_file:
+        data = replay_file.read()
+    if len(data) < HEADER.size + RESULT.size:
+        raise ReplayFormatError("{} is too short to be a replay".format(path))
+
+    magic, version, start_level, engine, ticks, change_count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ReplayFormatError("{} is not a replay".format(path))
+    if version != VERSION:
+        raise ReplayFormatError("{} is replay version {}, expected {}".format(path, version, VERSION))
+    if len(data) != HEADER.size + RESULT.size + change_count * CHANGE.size:
+        raise ReplayFormatError("{} is truncated".format(path))
+
+    score, level, game_over, center_x, center_y = RESULT.unpack_from(data, HEADER.size)
+    changes = []
+    tick = 0
+    for tick_delta, bits in CHANGE.iter_unpack(data[HEADER.size + RESULT.size:]):
+        tick += tick_delta
+        changes.append((tick, bits))
+
+    return Replay(start_level, engine.rstrip(b"\0").decode("utf-8"), ticks, changes,
+                  ReplayResult(score, level, bool(game_over), center_x, center_y))
+
+
+def run_replay(replay, engine=None):
+    """Runs a Replay through a fresh Simulation with no rendering.
+
+    Returns (result, simulation).  engine overrides the collision engine
+    the replay was recorded with.
+    """
+    simulation = Simulation(level_loader=functools.partial(prepare_level, engine=engine or replay.engine))
+    simulation.setup(replay.start_level)
+
+    changes = replay.changes
+    change_count = len(changes)
+    next_change = 0
+    for tick in range(replay.ticks):
+        while next_change < change_count and changes[next_change][0] == tick:
+            simulation.set_inputs(bits_inputs(changes[next_change][1]))
+            next_change += 1
+        simulation.step()
+
+    return simulation_result(simulation), simulation
+
+
+def compare_results(expected, actual):
+    """Returns a list of the differences between two ReplayResults"""
+    return ["{}: expected {}, got {}".format(field, expected_value, actual_value)
+            for field, expected_value, actual_value in zip(ReplayResult._fields, expected, actual)
+            if expected_value != actual_value]
+
+
+def main():
+    """Replays recorded sessions and checks where they end"""
+    parser = argparse.ArgumentParser(description="Replay recorded sessions without a window.")
+    parser.add_argument("replays", nargs="+", help="replay files to run")
+    parser.add_argument("--engine", help="collision engine to replay with instead of the recorded one")
+    args = parser.parse_args()
+
+    failures = 0
+    for path in args.replays:
+        replay = read_replay(path)
+        start_time = time.perf_counter()
+        result, simulation = run_replay(replay, args.engine)
+        replay_time = time.perf_counter() - start_time
+
+        differences = compare_results(replay.result, result)
+        print("{}: {} ticks in {:.2f} s ({:.0f} ticks per second), level {} score {} {}".format(
+            path, replay.ticks, replay_time, replay.ticks / replay_time if replay_time else 0,
+            result.level, result.score, "FAILED" if differences else "ok"))
+        for difference in differences:
+            print("    " + difference)
+        if differences:
+            failures += 1
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Fixed timestep for the game loop
+
+The game rules move things a set distance per tick (PLAYER_MOVEMENT_SPEED,
+GRAVITY, the enemies' change_x), so the simulation has to tick at a set
+rate whatever rate the window draws at.  A FixedStepScheduler adds up the
+real time of each frame and tells the game how many ticks are due.  After
+a stall it runs at most max_steps ticks and lets the rest of the time go,
+so a slow frame doesn't snowball into slower ones.  What is left over,
+less than a tick, is how far the drawing is between the last two ticks.
+"""
+
+from constants import *
+
+
+class FixedStepScheduler:
+    """Turns the frame times of the window into whole simulation ticks"""
+
+    def __init__(self, step_rate=SIMULATION_RATE, max_steps=MAX_CATCH_UP_STEPS):
+        self.step_time = 1 / step_rate
+        self.max_steps = max_steps
+        self.accumulator = 0.0
+        self.steps = 0
+        self.frames = 0
+        self.dropped_steps = 0
+        self.dropped_time = 0.0
+
+    def advance(self, delta_time):
+        """Adds a frame's time and returns how many ticks to run for it"""
+        self.frames += 1
+        self.accumulator += max(delta_time, 0.0)
+        steps = int(self.accumulator / self.step_time)
+        if steps > self.max_steps:
+            # Catching up on all of a stall would make the next frame late too
+            dropped = steps - self.max_steps
+            self.dropped_steps += dropped
+            self.dropped_time += dropped * self.step_time
+            steps = self.max_steps
+            self.accumulator -= dropped * self.step_time
+        self.accumulator = max(self.accumulator - steps * self.step_time, 0.0)
+        self.steps += steps
+        return steps
+
+    @property
+    def alpha(self):
+        """How far between the last two ticks the frame is drawn, from 0 to 1"""
+        return min(self.accumulator / self.step_time, 1.0)
+
+    def reset(self):
+        """Starts counting again from no time owed, as after a level loads"""
+        self.accumulator = 0.0
+
+    def metrics(self):
+        """Ticks run and dropped, and the ticks per frame"""
+        return {
+            "steps": self.steps,
+            "frames": self.frames,
+            "steps_per_frame": self.steps / self.frames if self.frames else 0.0,
+            "dropped_steps": self.dropped_steps,
+            "dropped_ms": self.dropped_time * 1000,
+        }
@@ -0,0 +1,903 @@
+"""
+Headless simulation of the platformer
+
+Runs the same rules as the game window (physics, moving platforms, enemies,
+coins, death, respawn, scrolling and level advance) without a window or an
+OpenGL context, so it can be stepped from scripts and CI machines.
+"""
+
+import argparse
+import functools
+import math
+import random
+import time
+from collections import namedtuple
+
+from collectibles import CollectibleGrid
+from collision_grid import CollisionGrid
+from constants import *
+from kinematics import KinematicStore
+from level_data import image_hit_box, scale_hit_box
+from levelpack import load_level
+from lod import UpdateLOD
+from profiler import FrameProfiler, PROFILE_FRAMES
+from streaming import StreamingTileGrid
+
+#Size of a spatial hash cell, same as arcade's default
+SPATIAL_HASH_CELL_SIZE = 128
+
+#Number of game frames a death animation frame is shown for
+DEATH_FRAME_TICKS = 7
+DEATH_FRAME_COUNT = 7
+
+# Input state for one tick
+Inputs = namedtuple("Inputs", ["up", "down", "left", "right"])
+Inputs.__new__.__defaults__ = (False, False, False, False)
+
+# Something that happened during a tick, kind is one of the EVENT_ names
+Event = namedtuple("Event", ["kind", "index", "value"])
+Event.__new__.__defaults__ = (None, None)
+
+EVENT_COIN = "coin"
+EVENT_DEATH = "death"
+EVENT_RESPAWN = "respawn"
+EVENT_LEVEL = "level"
+EVENT_GAME_OVER = "game_over"
+
+#Collision engines a level can be prepared for
+ENGINE_SPATIAL_HASH = "spatial_hash"
+ENGINE_GRID = "grid"
+
+#Properties of a body that has none, shared rather than an empty dict each, so never written to
+NO_PROPERTIES = {}
+
+
+class Body:
+    """Axis aligned box with the parts of arcade.Sprite that the game rules use.
+
+    hit_box is (left, bottom, right, top) relative to the centre, so left,
+    right, top and bottom match the hit box based values arcade reports.
+    A level has a body for every tile, so bodies have slots instead of a
+    dict and share their properties and hit box with the map.
+    """
+
+    __slots__ = ("center_x", "center_y", "hit_box", "change_x", "change_y", "boundary_left", "boundary_right",
+                 "boundary_top", "boundary_bottom", "properties", "gid", "index")
+
+    def __init__(self, center_x=0, center_y=0, hit_box=(-16, -16, 16, 16)):
+        self.center_x = center_x
+        self.center_y = center_y
+        self.hit_box = hit_box
+        self.change_x = 0
+        self.change_y = 0
+        self.boundary_left = None
+        self.boundary_right = None
+        self.boundary_top = None
+        self.boundary_bottom = None
+        self.properties = NO_PROPERTIES
+        self.gid = 0
+        self.index = 0
+
+    @property
+    def left(self):
+        return self.center_x + self.hit_box[0]
+
+    @left.setter
+    def left(self, value):
+        self.center_x = value - self.hit_box[0]
+
+    @property
+    def bottom(self):
+        return self.center_y + self.hit_box[1]
+
+    @bottom.setter
+    def bottom(self, value):
+        self.center_y = value - self.hit_box[1]
+
+    @property
+    def right(self):
+        return self.center_x + self.hit_box[2]
+
+    @right.setter
+    def right(self, value):
+        self.center_x = value - self.hit_box[2]
+
+    @property
+    def top(self):
+        return self.center_y + self.hit_box[3]
+
+    @top.setter
+    def top(self, value):
+        self.center_y = value - self.hit_box[3]
+
+    @property
+    def width(self):
+        return self.hit_box[2] - self.hit_box[0]
+
+    @property
+    def height(self):
+        return self.hit_box[3] - self.hit_box[1]
+
+    def update(self):
+        """Moves the body by its velocity, like arcade.Sprite.update"""
+        self.center_x += self.change_x
+        self.center_y += self.change_y
+
+
+class PlayerBody(Body):
+    """The player, with the state the game rules read from PlayerCharacter"""
+
+    __slots__ = ("character_face_direction", "jumping", "climbing", "is_on_ladder", "can_jump", "dead",
+                 "respawned", "frames", "cur_death_texture")
+
+    def __init__(self, center_x=PLAYER_START_X, center_y=PLAYER_START_Y):
+        super().__init__(center_x, center_y, player_hit_box())
+        self.character_face_direction = RIGHT_FACING
+        self.jumping = False
+        self.climbing = False
+        self.is_on_ladder = False
+        self.can_jump = False
+        self.dead = False
+        self.respawned = False
+        self.frames = 0
+        self.cur_death_texture = 0
+
+    def update_state(self):
+        """Advances the facing direction and death timer, as PlayerCharacter.update_animation did"""
+        self.frames += 1
+
+        if self.change_x < 0 and self.character_face_direction == RIGHT_FACING and not self.dead:
+            self.character_face_direction = LEFT_FACING
+        elif self.change_x > 0 and self.character_face_direction == LEFT_FACING and not self.dead:
+            self.character_face_direction = RIGHT_FACING
+
+        if self.dead and self.frames % DEATH_FRAME_TICKS == 0:
+            self.cur_death_texture += 1
+            if self.cur_death_texture >= DEATH_FRAME_COUNT:
+                self.cur_death_texture = 0
+                self.respawned = True
+
+
+class EnemyBody(Body):
+    """An enemy, which is also what kind of mob it is"""
+
+    __slots__ = ("mob_type",)
+
+    def __init__(self, center_x=0, center_y=0, hit_box=(-16, -16, 16, 16), mob_type=None):
+        super().__init__(center_x, center_y, hit_box)
+        self.mob_type = mob_type
+
+
+def tile_bodies(level_data, layer_name, scaling=TILE_SCALING):
+    """Yields a static Body for every tile in a tile layer"""
+    for gid, tile, center_x, center_y in level_data.tile_positions(layer_name, scaling):
+        if tile.hit_box is None:
+            continue
+        body = Body(center_x, center_y, scale_hit_box(tile.hit_box, scaling))
+        body.gid = gid
+        yield body
+
+
+def object_bodies(level_data, layer_name, scaling=TILE_SCALING):
+    """Yields a Body for every tile object in an object layer, with its Tiled properties"""
+    for map_object, tile, center_x, center_y in level_data.object_positions(layer_name, scaling):
+        if tile.hit_box is None:
+            continue
+        body = Body(center_x, center_y, scale_hit_box(tile.hit_box, scaling))
+        body.gid = map_object.gid
+        properties = map_object.properties
+        body.properties = properties
+        body.change_x = float(properties.get("change_x", 0))
+        body.change_y = float(properties.get("change_y", 0))
+        for name in ("boundary_left", "boundary_right", "boundary_top", "boundary_bottom"):
+            if name in properties:
+                setattr(body, name, float(properties[name]))
+        yield body
+
+
+def player_hit_box():
+    """Hit box of the player, taken from the first idle frame"""
+    return scale_hit_box(image_hit_box("{}idle0.png".format(PLAYER_ASSET_PATH)), CHARACTER_SCALING)
+
+
+def mob_hit_box(mob_type):
+    """Hit box of an enemy, taken from its first idle frame"""
+    return image_hit_box("{}idle0.png".format(MOB_ASSET_PATH.format(mob_type)))
+
+
+def enemy_bodies(level_data, scaling=TILE_SCALING):
+    """Yields an EnemyBody for every mob in the enemies layer, with its mob type's hit box"""
+    for index, mob in enumerate(object_bodies(level_data, MOVING_ENEMIES_LAYER_NAME, scaling)):
+        mob_type = mob.properties['mob_type']
+        enemy = EnemyBody(mob.center_x, mob.center_y, mob_hit_box(mob_type), mob_type)
+        enemy.index = index
+        enemy.boundary_left = mob.boundary_left
+        enemy.boundary_right = mob.boundary_right
+        enemy.change_x = mob.change_x
+        yield enemy
+
+
+def check_for_collision(body1, body2):
+    """True if the two hit boxes overlap. Touching edges do not count, as in arcade."""
+    return (body1.center_x + body1.hit_box[0] < body2.center_x + body2.hit_box[2]
+            and body2.center_x + body2.hit_box[0] < body1.center_x + body1.hit_box[2]
+            and body1.center_y + body1.hit_box[1] < body2.center_y + body2.hit_box[3]
+            and body2.center_y + body2.hit_box[1] < body1.center_y + body1.hit_box[3])
+
+
+class BodyList:
+    """Collection of bodies, the headless stand-in for arcade.SpriteList.
+
+    Static bodies can be put in a spatial hash.  Bodies appended with
+    moving=True are always checked one by one, since they change cells.
+    """
+
+    def __init__(self, use_spatial_hash=False, cell_size=SPATIAL_HASH_CELL_SIZE):
+        self.bodies = []
+        self.moving = []
+        self.cell_size = cell_size
+        self.spatial_hash = {} if use_spatial_hash else None
+
+    def __len__(self):
+        return len(self.bodies)
+
+    def __iter__(self):
+        return iter(self.bodies)
+
+    def __getitem__(self, index):
+        return self.bodies[index]
+
+    def _cells(self, body):
+        cell_size = self.cell_size
+        min_x = int(body.left // cell_size)
+        max_x = int(body.right // cell_size)
+        min_y = int(body.bottom // cell_size)
+        max_y = int(body.top // cell_size)
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                yield x, y
+
+    def append(self, body, moving=False):
+        self.bodies.append(body)
+        if moving or self.spatial_hash is None:
+            self.moving.append(body)
+        else:
+            for cell in self._cells(body):
+                self.spatial_hash.setdefault(cell, []).append(body)
+
+    def extend(self, bodies, moving=False):
+        for body in bodies:
+            self.append(body, moving)
+
+    def remove(self, body):
+        self.bodies.remove(body)
+        if body in self.moving:
+            self.moving.remove(body)
+        elif self.spatial_hash is not None:
+            for cell in self._cells(body):
+                self.spatial_hash[cell].remove(body)
+
+    def check_for_collision(self, body):
+        """Returns the bodies in this list that overlap body"""
+        hit_list = [other for other in self.moving
+                    if other is not body and check_for_collision(body, other)]
+        if self.spatial_hash:
+            seen = set()
+            for cell in self._cells(body):
+                for other in self.spatial_hash.get(cell, ()):
+                    if other is body or id(other) in seen:
+                        continue
+                    seen.add(id(other))
+                    if check_for_collision(body, other):
+                        hit_list.append(other)
+        return hit_list
+
+    def collides(self, body):
+        """True if any body in this list overlaps body"""
+        return len(self.check_for_collision(body)) > 0
+
+
+def _circular_check(player, walls):
+    """Nudges the player out of a wall it starts the tick inside, as arcade does"""
+    original_x = player.center_x
+    original_y = player.center_y
+
+    vary = 1
+    while True:
+        try_list = [[original_x, original_y + vary],
+                    [original_x, original_y - vary],
+                    [original_x + vary, original_y],
+                    [original_x - vary, original_y],
+                    [original_x + vary, original_y + vary],
+                    [original_x + vary, original_y - vary],
+                    [original_x - vary, original_y + vary],
+                    [original_x - vary, original_y - vary]]
+
+        for x, y in try_list:
+            player.center_x = x
+            player.center_y = y
+            if len(walls.check_for_collision(player)) == 0:
+                return
+        vary *= 2
+
+
+def _move_body(moving_body, walls, ramp_up):
+    """Moves a body by its velocity and resolves wall hits.
+
+    Port of arcade.physics_engines._move_sprite working on hit box rectangles.
+    """
+    if len(walls.check_for_collision(moving_body)) > 0:
+        _circular_check(moving_body, walls)
+
+    original_x = moving_body.center_x
+    original_y = moving_body.center_y
+
+    # Move in the y direction
+    moving_body.center_y += moving_body.change_y
+
+    hit_list_x = walls.check_for_collision(moving_body)
+    complete_hit_list = hit_list_x
+
+    # If we hit a wall, move so the edges are at the same point
+    if len(hit_list_x) > 0:
+        if moving_body.change_y > 0:
+            while len(walls.check_for_collision(moving_body)) > 0:
+                moving_body.center_y -= 1
+        elif moving_body.change_y < 0:
+            for item in hit_list_x:
+                while check_for_collision(moving_body, item):
+                    moving_body.center_y += 0.25
+
+                if item.change_x != 0:
+                    moving_body.center_x += item.change_x
+
+        moving_body.change_y = min(0.0, hit_list_x[0].change_y)
+
+    moving_body.center_y = round(moving_body.center_y, 2)
+
+    # Move in the x direction
+    if moving_body.change_x:
+        # Keep track of our current y, used in ramping up
+        almost_original_y = moving_body.center_y
+
+        direction = math.copysign(1, moving_body.change_x)
+        cur_x_change = abs(moving_body.change_x)
+        upper_bound = cur_x_change
+        lower_bound = 0
+        cur_y_change = 0
+
+        exit_loop = False
+        while not exit_loop:
+
+            moving_body.center_x = original_x + cur_x_change * direction
+            collision_check = walls.check_for_collision(moving_body)
+
+            for body in collision_check:
+                if body not in complete_hit_list:
+                    complete_hit_list.append(body)
+
+            if len(collision_check) > 0:
+                # We did collide. Can we ramp up and not collide?
+                if ramp_up:
+                    cur_y_change = cur_x_change
+                    moving_body.center_y = original_y + cur_y_change
+
+                    collision_check = walls.check_for_collision(moving_body)
+                    if len(collision_check) > 0:
+                        cur_y_change -= cur_x_change
+                    else:
+                        while len(collision_check) == 0 and cur_y_change > 0:
+                            cur_y_change -= 1
+                            moving_body.center_y = almost_original_y + cur_y_change
+                            collision_check = walls.check_for_collision(moving_body)
+                        cur_y_change += 1
+                        collision_check = []
+
+                if len(collision_check) > 0:
+                    upper_bound = cur_x_change - 1
+                    if upper_bound - lower_bound <= 1:
+                        cur_x_change = lower_bound
+                        exit_loop = True
+                    else:
+                        cur_x_change = (upper_bound + lower_bound) / 2
+                else:
+                    exit_loop = True
+
+            else:
+                # No collision. Keep this new position and exit
+                lower_bound = cur_x_change
+                if upper_bound - lower_bound <= 1:
+                    exit_loop = True
+                else:
+                    cur_x_change = (upper_bound + lower_bound) / 2
+
+        moving_body.center_x = original_x + cur_x_change * direction
+        moving_body.center_y = almost_original_y + cur_y_change
+
+    return complete_hit_list
+
+
+class PhysicsEnginePlatformer:
+    """Headless version of arcade.PhysicsEnginePlatformer working on BodyLists.
+
+    The moving bodies in platforms are moved by moving_platforms, a
+    KinematicStore of them, made here if it isn't given.
+    """
+
+    def __init__(self, player_body, platforms, gravity_constant=0.5, ladders=None, moving_platforms=None):
+        self.player_sprite = player_body
+        self.platforms = platforms
+        self.gravity_constant = gravity_constant
+        self.ladders = ladders
+        if moving_platforms is None:
+            moving_platforms = KinematicStore(platforms.moving)
+        self.moving_platforms = moving_platforms
+
+    def is_on_ladder(self):
+        """Returns True if the player is touching a ladder"""
+        if self.ladders:
+            if len(self.ladders.check_for_collision(self.player_sprite)) > 0:
+                return True
+        return False
+
+    def can_jump(self, y_distance=5):
+        """Returns True if there is a platform just below the player"""
+        self.player_sprite.center_y -= y_distance
+        hit_list = self.platforms.check_for_collision(self.player_sprite)
+        self.player_sprite.center_y += y_distance
+        return len(hit_list) > 0
+
+    def update(self):
+        """Moves the player and the moving platforms and resolves collisions"""
+        if not self.is_on_ladder():
+            self.player_sprite.change_y -= self.gravity_constant
+
+        complete_hit_list = _move_body(self.player_sprite, self.platforms, ramp_up=True)
+
+        self.moving_platforms.move_with_player(self.player_sprite)
+
+        return complete_hit_list
+
+
+class GridPhysicsEnginePlatformer(PhysicsEnginePlatformer):
+    """PhysicsEnginePlatformer for levels whose static layers are CollisionGrids.
+
+    The rules are the same, only the ladder and jump checks stop at the
+    first cell they find something in.
+    """
+
+    def is_on_ladder(self):
+        """Returns True if the player is touching a ladder"""
+        if self.ladders:
+            return self.ladders.collides(self.player_sprite)
+        return False
+
+    def can_jump(self, y_distance=5):
+        """Returns True if there is a platform just below the player"""
+        self.player_sprite.center_y -= y_distance
+        hit = self.platforms.collides(self.player_sprite)
+        self.player_sprite.center_y += y_distance
+        return hit
+
+
+PHYSICS_ENGINES = {
+    ENGINE_SPATIAL_HASH: PhysicsEnginePlatformer,
+    ENGINE_GRID: GridPhysicsEnginePlatformer,
+}
+
+
+class PreparedLevel:
+    """The bodies of a level, built before the simulation switches to it.
+
+    Nothing in here is shared with the level being played, so it can be
+    built on another thread while that level runs.
+
+    engine is ENGINE_SPATIAL_HASH or ENGINE_GRID and picks how the static
+    Platforms, Ladders and Don't Touch layers are stored for collisions.
+    map_name is the map file pattern the level is loaded from.  With
+    streaming those layers are StreamingTileGrids that build their bodies a
+    chunk at a time as the player gets near them.
+
+    The tiles never change once built.  What playing the level changes (the
+    player, the coins picked up, the moving platforms and enemies) can be
+    put back with reset(), so a level can be played again without being
+    built again.
+    """
+
+    def __init__(self, level, engine=PHYSICS_ENGINE, map_name=MAP_NAME, streaming=MAP_STREAMING):
+        if engine not in PHYSICS_ENGINES:
+            raise ValueError("Unknown physics engine {!r}".format(engine))
+        self.level = level
+        self.engine = engine
+        self.streaming = streaming
+        level_data = load_level(level, map_name)
+        self.level_data = level_data
+
+        self.player_sprite = PlayerBody()
+
+        #Platforms, with the moving platforms checked separately
+        self.wall_list = self.tile_layer_list(level_data, PLATFORMS_LAYER_NAME)
+        self.moving_platform_list = list(object_bodies(level_data, MOVING_PLATFORMS_LAYER_NAME))
+        for index, platform in enumerate(self.moving_platform_list):
+            platform.index = index
+        self.wall_list.extend(self.moving_platform_list, moving=True)
+        self.moving_platforms = KinematicStore(self.moving_platform_list)
+
+        #Coins, indexed by the grid cells they are in
+        coins = list(object_bodies(level_data, COINS_LAYER_NAME))
+        for index, coin in enumerate(coins):
+            coin.index = index
+        self.coin_list = CollectibleGrid.for_level(level_data, coins, TILE_SCALING)
+
+        #Ladders
+        self.ladder_list = self.tile_layer_list(level_data, LADDERS_LAYER_NAME)
+
+        #Don't Touch, the enemies are checked by their UpdateLOD
+        self.dont_touch_list = self.tile_layer_list(level_data, DONT_TOUCH_LAYER_NAME)
+        enemies = list(enemy_bodies(level_data))
+        self.enemy_mob_types = [enemy.mob_type for enemy in enemies]
+        #Nothing reads the enemies but their store, so a batched store keeps only its arrays
+        self.enemies = KinematicStore(enemies, mirror=False)
+        self.enemy_list = self.enemies.bodies or []
+        self.enemy_lod = UpdateLOD(self.enemies)
+
+    def reset(self):
+        """Puts the level back as it was prepared. Returns the indexes of the coins put back.
+
+        Only the coins that were picked up are touched, so this takes as long
+        as the player took to change them, however big the level is.
+        """
+        self.player_sprite = PlayerBody()
+        self.moving_platforms.reset()
+        self.enemies.reset()
+        self.enemy_lod.reset()
+        return self.coin_list.reset()
+
+    def static_list(self, level_data):
+        """An empty collection for a tile layer, of the kind the engine uses"""
+        if self.engine == ENGINE_GRID:
+            return CollisionGrid.for_level(level_data, TILE_SCALING)
+        return BodyList(use_spatial_hash=True)
+
+    def tile_layer_list(self, level_data, layer_name):
+        """The bodies of a tile layer, streamed or all built now"""
+        if self.streaming:
+            return StreamingTileGrid.for_level(level_data, layer_name, TILE_SCALING, Body)
+        body_list = self.static_list(level_data)
+        body_list.extend(tile_bodies(level_data, layer_name))
+        return body_list
+
+
+def prepare_level(level, engine=PHYSICS_ENGINE, map_name=MAP_NAME, streaming=MAP_STREAMING):
+    """Builds a PreparedLevel, the default level loader of a Simulation"""
+    return PreparedLevel(level, engine, map_name, streaming)
+
+
+class Simulation:
+    """The game rules, stepped one tick at a time with no window.
+
+    MyGame drives one of these from on_update and draws its state.  Scripts
+    can do the same with step(), which takes the keys held during the tick
+    and returns the list of Events that happened.
+
+    level_loader is called with a level number and returns its PreparedLevel,
+    so levels can come from a LevelPrefetcher instead of being built on the spot.
+    profiler is a FrameProfiler that each phase of a tick is timed into.
+    """
+
+    def __init__(self, level_loader=prepare_level, profiler=None):
+        self.level_loader = level_loader
+        self.profiler = profiler if profiler is not None else FrameProfiler()
+        self.level = 1
+        self.prepared_level = None
+        self.level_data = None
+        self.player_sprite = None
+        self.wall_list = None
+        self.moving_platform_list = None
+        self.coin_list = None
+        self.ladder_list = None
+        self.dont_touch_list = None
+        self.enemy_list = None
+        self.moving_platforms = None
+        self.enemies = None
+        self.enemy_lod = None
+        self.physics_engine = None
+        self.view_bottom = 0
+        self.view_left = 0
+        self.viewport_changed = False
+        self.score = 0
+        self.end_of_map = 0
+        self.top_of_map = 0
+        self.game_over = False
+        self.inputs = Inputs()
+        self.jump_needs_reset = False
+        self.events = []
+        self.ticks = 0
+        self.tick_time = 0.0
+
+    def setup(self, level):
+        """Set up the simulation for a level"""
+        self.install_level(self.level_loader(level))
+
+    def install_level(self, prepared_level):
+        """Switches the simulation to a level built by prepare_level"""
+        self.prepared_level = prepared_level
+        self.level = prepared_level.level
+        self.level_data = prepared_level.level_data
+
+        self.player_sprite = prepared_level.player_sprite
+        self.wall_list = prepared_level.wall_list
+        self.moving_platform_list = prepared_level.moving_platform_list
+        self.coin_list = prepared_level.coin_list
+        self.ladder_list = prepared_level.ladder_list
+        self.dont_touch_list = prepared_level.dont_touch_list
+        self.enemy_list = prepared_level.enemy_list
+        self.moving_platforms = prepared_level.moving_platforms
+        self.enemies = prepared_level.enemies
+        self.enemy_lod = prepared_level.enemy_lod
+
+        self.view_bottom = 0
+        self.view_left = 0
+        self.score = 0
+        self.game_over = False
+
+        self.end_of_map = self.level_data.end_of_map
+        self.top_of_map = self.level_data.top_of_map
+
+        #Initialises the physics engine the level was prepared for
+        physics_engine_class = PHYSICS_ENGINES[prepared_level.engine]
+        self.physics_engine = physics_engine_class(self.player_sprite,
+                                                   self.wall_list, GRAVITY,
+                                                   ladders=self.ladder_list,
+                                                   moving_platforms=self.moving_platforms)
+
+    def restart_level(self, prepared_level=None):
+        """Plays a level played before again from the start, the current one by default.
+
+        Returns the indexes of the coins put back.
+        """
+        if prepared_level is None:
+            prepared_level = self.prepared_level
+        restored = prepared_level.reset()
+        self.install_level(prepared_level)
+        self.inputs = Inputs()
+        self.jump_needs_reset = False
+        self.viewport_changed = True
+        return restored
+
+    def set_inputs(self, inputs):
+        """Applies the keys held for the next tick, like the key press/release handlers"""
+        if inputs == self.inputs:
+            return
+        if self.inputs.up and not inputs.up:
+            self.jump_needs_reset = False
+        self.inputs = inputs
+        self.process_keychange()
+
+    def process_keychange(self):
+        """Sets the player velocity from the keys held"""
+        inputs = self.inputs
+        player = self.player_sprite
+        physics_engine = self.physics_engine
+
+        # Process up/down
+        if inputs.up and not inputs.down and not player.dead:
+            if physics_engine.is_on_ladder():
+                player.change_y = PLAYER_MOVEMENT_SPEED
+            elif physics_engine.can_jump() and not self.jump_needs_reset:
+                player.change_y = PLAYER_JUMP_SPEED
+                self.jump_needs_reset = True
+
+        elif inputs.down and not inputs.up:
+            if physics_engine.is_on_ladder():
+                player.change_y = -PLAYER_MOVEMENT_SPEED
+
+        # Process up/down when on a ladder and no movement
+        if physics_engine.is_on_ladder():
+            if not inputs.up and not inputs.down:
+                player.change_y = 0
+            elif inputs.up and inputs.down:
+                player.change_y = 0
+
+        # Process left/right
+        if inputs.right and not inputs.left:
+            player.change_x = PLAYER_MOVEMENT_SPEED
+        elif inputs.left and not inputs.right and player.left > 0:
+            player.change_x = -PLAYER_MOVEMENT_SPEED
+        else:
+            player.change_x = 0
+
+    def step(self, inputs=None):
+        """Runs one tick with the given Inputs (or the previous ones) and returns its Events"""
+        start_time = time.perf_counter()
+        self.events = []
+        if not self.game_over:
+            if inputs is not None:
+                self.set_inputs(inputs)
+            self.update()
+        self.ticks += 1
+        self.tick_time += time.perf_counter() - start_time
+        return self.events
+
+    @property
+    def ticks_per_second(self):
+        """Average number of ticks simulated per second of wall time"""
+        if self.tick_time == 0:
+            return 0.0
+        return self.ticks / self.tick_time
+
+    def update(self):
+        """One tick of the game rules"""
+        player = self.player_sprite
+        profiler = self.profiler
+        self.viewport_changed = False
+        profiler.lap("update.input")
+
+        self.physics_engine.update()
+        if self.physics_engine.can_jump():
+            player.can_jump = False
+        else:
+            player.can_jump = True
+
+        if self.physics_engine.is_on_ladder() and not self.physics_engine.can_jump():
+            player.is_on_ladder = True
+        else:
+            player.is_on_ladder = False
+        self.process_keychange()
+        profiler.lap("update.physics")
+
+        # Moves the platforms again and reverses them at their boundaries
+        self.moving_platforms.update()
+        profiler.lap("update.platforms")
+
+        #Moves the enemies and reverses them at their boundaries, the ones far off screen less often
+        self.enemy_lod.update(self.view_left, self.view_bottom)
+        profiler.lap("update.enemies")
+
+        player.update_state()
+
+        # See if we hit any coins, each pickup is a score event
+        coin_list = self.coin_list
+        for index in coin_list.collect(player):
+            points = coin_list.points[index]
+            self.score += points
+            self.events.append(Event(EVENT_COIN, index, points))
+        profiler.lap("update.coins")
+
+        # Track if we need to change the viewport
+        changed = False
+
+        # See if the played collided with an enemy/water
+        if not player.dead and (self.dont_touch_list.collides(player) or self.enemy_lod.hits(player)):
+            player.dead = True
+            self.events.append(Event(EVENT_DEATH))
+        #Makes the player movement speed 0 if they are dead.
+        if player.dead:
+            player.change_x = 0
+            player.change_y = 0
+
+        #Respawns the player at the start of the level
+        if player.respawned:
+            player.center_x = PLAYER_START_X
+            player.center_y = PLAYER_START_Y
+            player.respawned = False
+            player.dead = False
+            self.view_left = 0
+            self.view_bottom = 0
+            changed = True
+            self.events.append(Event(EVENT_RESPAWN))
+        profiler.lap("update.death")
+
+        # Scroll left
+        left_boundary = self.view_left + LEFT_VIEWPORT_MARGIN
+        if player.left < left_boundary and self.view_left > 15:
+            self.view_left -= left_boundary - player.left
+            changed = True
+        #Scroll right
+        right_boundary = self.view_left + SCREEN_WIDTH - RIGHT_VIEWPORT_MARGIN
+        if player.right > right_boundary and self.view_left < self.end_of_map - SCREEN_WIDTH:
+            self.view_left += player.right - right_boundary
+            changed = True
+        # Scroll up
+        top_boundary = self.view_bottom + SCREEN_HEIGHT - TOP_VIEWPORT_MARGIN
+        if player.top > top_boundary and self.view_bottom < self.top_of_map - SCREEN_HEIGHT:
+            self.view_bottom += player.top - top_boundary
+            changed = True
+        # Scroll down
+        bottom_boundary = self.view_bottom + BOTTOM_VIEWPORT_MARGIN
+        if player.bottom < bottom_boundary and self.view_bottom > 20:
+            self.view_bottom -= bottom_boundary - player.bottom
+            changed = True
+
+        profiler.lap("update.scrolling")
+
+        # See if the user got to the end of the level
+        if player.center_x >= self.end_of_map:
+            # Set the camera to the start
+            self.view_left = 0
+            self.view_bottom = 0
+            changed = True
+
+            if self.level < TOTAL_LEVELS:
+                # Load the next level
+                self.setup(self.level + 1)
+                self.events.append(Event(EVENT_LEVEL, self.level))
+            else:
+                self.level += 1
+                self.game_over = True
+                self.events.append(Event(EVENT_GAME_OVER))
+            profiler.lap("update.level_load")
+
+        if changed:
+            self.view_bottom = int(self.view_bottom)
+            self.view_left = int(self.view_left)
+            self.viewport_changed = True
+
+
+def random_inputs(rng):
+    """Random key state, weighted towards running right"""
+    return Inputs(up=rng.random() < 0.3,
+                  down=rng.random() < 0.05,
+                  left=rng.random() < 0.15,
+                  right=rng.random() < 0.7)
+
+
+def main():
+    """Runs a headless playthrough and reports the tick rate"""
+    parser = argparse.ArgumentParser(description="Run the platformer without a window.")
+    parser.add_argument("--level", type=int, default=1, help="level to start on")
+    parser.add_argument("--ticks", type=int, default=3600, help="number of ticks to simulate")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the random inputs")
+    parser.add_argument("--hold", type=int, default=10, help="ticks to hold each random input for")
+    parser.add_argument("--prefetch", action="store_true", help="prepare the next level on a worker thread")
+    parser.add_argument("--engine", choices=sorted(PHYSICS_ENGINES), default=PHYSICS_ENGINE,
+                        help="how the static layers are checked for collisions")
+    parser.add_argument("--profile", action="store_true", help="report how long each phase of a tick takes")
+    parser.add_argument("--streaming", action="store_true",
+                        help="build the tile layers a chunk at a time near the player")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    level_loader = functools.partial(prepare_level, engine=args.engine, streaming=args.streaming)
+    prefetcher = None
+    if args.prefetch:
+        from prefetch import LevelPrefetcher
+        prefetcher = LevelPrefetcher(level_loader)
+        simulation = Simulation(level_loader=prefetcher.take)
+    else:
+        simulation = Simulation(level_loader=level_loader)
+    profiler = simulation.profiler
+    profiler.capacity = max(args.ticks, PROFILE_FRAMES)
+    profiler.enabled = args.profile
+    simulation.setup(args.level)
+
+    inputs = Inputs()
+    for tick in range(args.ticks):
+        if tick % args.hold == 0:
+            inputs = random_inputs(rng)
+        profiler.start("update")
+        simulation.step(inputs)
+        profiler.stop("update")
+        profiler.end_frame()
+        if simulation.game_over:
+            break
+
+    player = simulation.player_sprite
+    print("Ticks: {}".format(simulation.ticks))
+    print("Ticks per second: {:.0f}".format(simulation.ticks_per_second))
+    print("Level: {} Score: {} Position: ({:.2f}, {:.2f})".format(simulation.level, simulation.score,
+                                                                 player.center_x, player.center_y))
+    if prefetcher is not None:
+        prefetcher.shutdown()
+        metrics = prefetcher.metrics()
+        print("Prefetch hits: {} misses: {} waits: {} failures: {}".format(
+            metrics["hits"], metrics["misses"], metrics["waits"], metrics["failures"]))
+        print("Level swap: last {:.2f} ms mean {:.2f} ms max {:.2f} ms".format(
+            metrics["last_swap_ms"], metrics["mean_swap_ms"], metrics["max_swap_ms"]))
+    if args.profile:
+        for line in profiler.overlay_lines():
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
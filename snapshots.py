@@ -0,0 +1,302 @@
+"""
+Snapshots of the simulation, for rewinding and quicksaves
+
+Everything that changes while a level is played (the score, the camera,
+the keys held, the player, the moving platforms, the enemies, the tick each
+enemy was last moved to and the coins picked up) is gathered into one
+float64 vector laid out by a StateLayout.
+The coins are kept as how many have been picked up, as the CollectibleGrid
+remembers the order it handed them out in.
+
+A RewindBuffer keeps an undo record for each tick: the entries of the
+vector that changed and what they were before.  Only the player and the
+things that move change from one tick to the next, so a record is a few
+hundred bytes.  The records go round a ring of fixed size, the oldest being
+written over, so rewinding takes the simulation back from where it is
+until the ring runs out.
+
+A quicksave is the whole vector and a bit per coin, written to a file.
+"""
+
+import operator
+import os
+import struct
+from collections import deque
+
+import numpy
+
+from constants import *
+from replay import input_bits, bits_inputs
+
+MAGIC = b"PSAV"
+VERSION = 2
+
+# magic, version, level, engine, vector length, coin count
+SAVE_HEADER = struct.Struct("<4sHH16sII")
+
+#Bytes before the entries of an undo record: how many entries it has
+RECORD_HEADER = struct.Struct("<I")
+
+SCALAR_FIELDS = ("score", "game_over", "view_left", "view_bottom", "jump_needs_reset", "inputs",
+                 "coins_picked")
+PLAYER_FIELDS = ("center_x", "center_y", "change_x", "change_y", "character_face_direction",
+                 "jumping", "climbing", "is_on_ladder", "can_jump", "dead", "respawned",
+                 "frames", "cur_death_texture")
+#What each player field is turned back into from a float
+PLAYER_TYPES = (float, float, float, float, int, bool, bool, bool, bool, bool, bool, int, int)
+
+_player_fields = operator.attrgetter(*PLAYER_FIELDS)
+
+
+class SaveFormatError(Exception):
+    """Raised when a quicksave can't be read or doesn't fit the level"""
+
+
+class StateLayout:
+    """Where each part of the state of a level goes in a snapshot vector"""
+
+    def __init__(self, platform_count, enemy_count):
+        self.platform_count = platform_count
+        self.enemy_count = enemy_count
+        self.player_start = len(SCALAR_FIELDS)
+        self.platforms_start = self.player_start + len(PLAYER_FIELDS)
+        self.enemies_start = self.platforms_start + 4 * self.platform_count
+        self.lod_start = self.enemies_start + 4 * self.enemy_count
+        self.size = self.lod_start + 1 + self.enemy_count
+
+    @classmethod
+    def for_simulation(cls, simulation):
+        """The layout of the level a simulation, or a PreparedLevel, is playing"""
+        return cls(len(simulation.moving_platforms), len(simulation.enemies))
+
+    def fits(self, simulation):
+        """True if the simulation is playing a level with this layout"""
+        return (len(simulation.moving_platforms) == self.platform_count
+                and len(simulation.enemies) == self.enemy_count)
+
+    def empty(self):
+        return numpy.zeros(self.size, dtype=numpy.float64)
+
+    def capture(self, simulation, out):
+        """Writes the state of the simulation into the vector out"""
+        # One list converted at once costs less than filling the vector a part at a time
+        values = [simulation.score, simulation.game_over, simulation.view_left, simulation.view_bottom,
+                  simulation.jump_needs_reset, input_bits(simulation.inputs),
+                  len(simulation.coin_list.picked_up)]
+        values.extend(_player_fields(simulation.player_sprite))
+        for store in (simulation.moving_platforms, simulation.enemies):
+            if len(store):
+                for column in store.state():
+                    values.extend(column)
+        # Enemies far off screen are behind, so when they were moved is part of where they are
+        ticks, moved_at = simulation.enemy_lod.state()
+        values.append(ticks)
+        values.extend(moved_at)
+        out[:] = values
+
+    def restore(self, simulation, state):
+        """Puts the simulation in the state of a vector. Returns the indexes of the coins put back.
+
+        The coins picked up after the state was captured are put back, so
+        only states from earlier in the same playing of the level can be
+        restored this way.
+        """
+        (score, game_over, view_left, view_bottom, jump_needs_reset,
+         inputs, coins_picked) = state[:self.player_start].tolist()
+        simulation.score = int(score)
+        simulation.game_over = bool(game_over)
+        simulation.view_left = view_left
+        simulation.view_bottom = view_bottom
+        simulation.jump_needs_reset = bool(jump_needs_reset)
+        simulation.inputs = bits_inputs(int(inputs))
+        simulation.viewport_changed = True
+
+        player = simulation.player_sprite
+        values = state[self.player_start:self.platforms_start].tolist()
+        for name, kind, value in zip(PLAYER_FIELDS, PLAYER_TYPES, values):
+            setattr(player, name, kind(value))
+
+        self._restore_store(simulation.moving_platforms, state, self.platforms_start)
+        self._restore_store(simulation.enemies, state, self.enemies_start)
+        simulation.enemy_lod.load_state(state[self.lod_start], state[self.lod_start + 1:self.size])
+        return simulation.coin_list.unpick(int(coins_picked))
+
+    @staticmethod
+    def _restore_store(store, state, start):
+        count = len(store)
+        if count:
+            store.load_state(*state[start:start + 4 * count].reshape(4, count))
+
+
+class RewindBuffer:
+    """Undo records of the last ticks of a level, in a ring of capacity bytes.
+
+    Call capture() after every tick.  The first capture of a level, or after
+    clear(), only takes the state to compare the next ones with.
+    """
+
+    def __init__(self, capacity=REWIND_BUFFER_BYTES):
+        self.buffer = bytearray(capacity)
+        self.records = deque()
+        self.head = 0
+        self.layout = None
+        self.prepared_level = None
+        self.state = None
+        self.scratch = None
+
+    def __len__(self):
+        """Number of ticks that can be rewound"""
+        return len(self.records)
+
+    def clear(self):
+        """Forgets every record, as after a restart the past can't be gone back to"""
+        self.records.clear()
+        self.head = 0
+        self.prepared_level = None
+
+    def capture(self, simulation):
+        """Records what changed in the simulation since the last capture"""
+        if simulation.prepared_level is not self.prepared_level or not self.layout.fits(simulation):
+            self.clear()
+            self.prepared_level = simulation.prepared_level
+            self.layout = StateLayout.for_simulation(simulation)
+            self.state = self.layout.empty()
+            self.scratch = self.layout.empty()
+            self.layout.capture(simulation, self.state)
+            return
+
+        state = self.scratch
+        self.layout.capture(simulation, state)
+        changed = numpy.flatnonzero(state != self.state)
+        self._write(changed, self.state[changed])
+        self.scratch = self.state
+        self.state = state
+
+    def _write(self, indexes, values):
+        count = len(indexes)
+        size = RECORD_HEADER.size + 12 * count
+        buffer = self.buffer
+        records = self.records
+        if size > len(buffer):
+            self.clear()
+            return
+        if self.head + size > len(buffer):
+            # The end of the ring is too short, so the records left there go and this one starts over
+            while records and records[0] >= self.head:
+                records.popleft()
+            self.head = 0
+        end = self.head + size
+        while records and self.head <= records[0] < end:
+            records.popleft()
+
+        offset = self.head
+        RECORD_HEADER.pack_into(buffer, offset, count)
+        offset += RECORD_HEADER.size
+        buffer[offset:offset + 8 * count] = values.tobytes()
+        offset += 8 * count
+        buffer[offset:end] = indexes.astype(numpy.int32).tobytes()
+        records.append(self.head)
+        self.head = end
+
+    def rewind(self, simulation, ticks=1):
+        """Takes the simulation back up to ticks ticks.
+
+        Returns (ticks gone back, indexes of the coins put back).
+        """
+        if self.prepared_level is not simulation.prepared_level or not self.records:
+            return 0, []
+        state = self.state
+        buffer = self.buffer
+        back = 0
+        while back < ticks and self.records:
+            offset = self.records.pop()
+            count, = RECORD_HEADER.unpack_from(buffer, offset)
+            values_start = offset + RECORD_HEADER.size
+            indexes_start = values_start + 8 * count
+            state[numpy.frombuffer(buffer, numpy.int32, count, indexes_start)] = \
+                numpy.frombuffer(buffer, numpy.float64, count, values_start)
+            self.head = offset
+            back += 1
+        return back, self.layout.restore(simulation, state)
+
+    def nbytes(self):
+        """Bytes of the ring in use"""
+        if not self.records:
+            return 0
+        oldest = self.records[0]
+        if oldest < self.head:
+            return self.head - oldest
+        return len(self.buffer) - oldest + self.head
+
+
+def write_save(simulation, path):
+    """Writes the state of a simulation to a quicksave file"""
+    layout = StateLayout.for_simulation(simulation)
+    state = layout.empty()
+    layout.capture(simulation, state)
+    collected = numpy.frombuffer(bytes(simulation.coin_list.collected), dtype=numpy.uint8)
+    data = (SAVE_HEADER.pack(MAGIC, VERSION, simulation.level,
+                             simulation.prepared_level.engine.encode("utf-8"),
+                             layout.size, len(collected))
+            + state.tobytes() + numpy.packbits(collected).tobytes())
+
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    temp_path = "{}.tmp{}".format(path, os.getpid())
+    with open(temp_path, "wb") as save_file:
+        save_file.write(data)
+    os.replace(temp_path, path)
+
+
+def read_save(path):
+    """Reads a quicksave file. Returns (level, engine, state vector, coin flags)."""
+    with open(path, "rb") as save_file:
+        data = save_file.read()
+    if len(data) < SAVE_HEADER.size:
+        raise SaveFormatError("{} is too short to be a quicksave".format(path))
+    magic, version, level, engine, size, coin_count = SAVE_HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise SaveFormatError("{} is not a quicksave".format(path))
+    if version != VERSION:
+        raise SaveFormatError("{} is quicksave version {}, expected {}".format(path, version, VERSION))
+    flag_bytes = (coin_count + 7) // 8
+    if len(data) != SAVE_HEADER.size + 8 * size + flag_bytes:
+        raise SaveFormatError("{} is truncated".format(path))
+    state = numpy.frombuffer(data, numpy.float64, size, SAVE_HEADER.size).copy()
+    flags = numpy.unpackbits(numpy.frombuffer(data, numpy.uint8, flag_bytes, SAVE_HEADER.size + 8 * size),
+                             count=coin_count)
+    return level, engine.rstrip(b"\0").decode("utf-8"), state, flags
+
+
+def load_save(simulation, path):
+    """Puts a simulation in the state of a quicksave, switching level if the save is of another one"""
+    level, _, state, flags = read_save(path)
+    if simulation.prepared_level is None or simulation.level != level:
+        # The save is checked against its level before the simulation leaves the one it is on
+        prepared_level = simulation.level_loader(level)
+        layout = _save_layout(path, level, prepared_level, state, flags)
+        simulation.install_level(prepared_level)
+    else:
+        layout = _save_layout(path, level, simulation, state, flags)
+    apply_state(simulation, layout, state, flags)
+
+
+def _save_layout(path, level, entities, state, flags):
+    """The layout of a save for a simulation or PreparedLevel, raising SaveFormatError if the save doesn't fit it"""
+    layout = StateLayout.for_simulation(entities)
+    if layout.size != len(state) or len(flags) != len(entities.coin_list.collected):
+        raise SaveFormatError("{} doesn't fit level {} as it is now".format(path, level))
+    return layout
+
+
+def apply_state(simulation, layout, state, flags):
+    """Puts a simulation in the state of a whole vector, with a 0 or 1 flag per coin for whether it was collected.
+
+    Unlike StateLayout.restore this works from any state of the level,
+    as the coins are set from their flags.
+    """
+    simulation.coin_list.load_collected(flags.tobytes())
+    # The coins are already as given, so the count of coins picked up is taken from them
+    state[SCALAR_FIELDS.index("coins_picked")] = len(simulation.coin_list.picked_up)
+    layout.restore(simulation, state)
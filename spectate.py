@@ -0,0 +1,630 @@
+"""
+Streaming a game to spectators
+
+A SpectatorServer sends the state of a running game to other processes on
+the same machine over TCP or a Unix socket, to spectate it or race a ghost
+of it.  The state is the snapshot vector of snapshots.StateLayout: the
+score, the player with everything its animation is picked from, the moving
+platforms and the enemies, along with a flag per coin.
+
+A keyframe with the whole state is sent every SPECTATOR_KEYFRAME_INTERVAL
+ticks and whenever the level changes.  The ticks in between only send the
+entries of the vector that changed and the coins that were picked up or
+put back.
+
+The game calls publish() after each tick.  The tick is encoded on the
+game's thread and the bytes handed to an asyncio loop on a thread of its
+own, which writes them to every spectator without waiting for any.  The
+loop keeps the latest state too, so a spectator that joins is sent one
+keyframe of it and is in step straight away.
+
+A spectator sends back the sequence number of each message it applies.
+One more than SPECTATOR_LAG_LIMIT ticks behind, or with more than
+SPECTATOR_BUFFER_LIMIT bytes still to send, is skipped.  Once it has
+applied everything it was sent it is sent a keyframe of the latest tick, so
+a slow spectator jumps ahead rather than falling further behind, and never
+holds up the game or the others.  Socket buffers can hold seconds of the
+stream, which is why the lag is counted in ticks rather than bytes.
+
+The stream from the server, little endian:
+
+    STREAM_HEADER                once, when a spectator connects
+    MESSAGE_HEADER + payload     for each tick
+
+and from a spectator, ACK for each message.
+
+A keyframe payload is KEYFRAME, the vector as float64 and the coin flags
+packed 8 to a byte.  A delta payload is DELTA, the new values as float64,
+their indexes as int32 and the indexes of the coins that flipped as int32.
+
+Run this file with --clients to serve a headless game to local spectators
+and report the bandwidth and latency of each, or with --connect to watch a
+game that is being served.
+"""
+
+import argparse
+import asyncio
+import functools
+import os
+import random
+import stat
+import struct
+import threading
+import time
+from collections import deque
+
+import numpy
+
+from constants import *
+from simulation import Simulation, Inputs, PHYSICS_ENGINES, prepare_level, random_inputs
+from snapshots import StateLayout, SCALAR_FIELDS, PLAYER_FIELDS, apply_state
+
+MAGIC = b"PSPC"
+VERSION = 2
+
+# magic, version, ticks per second
+STREAM_HEADER = struct.Struct("<4sHH")
+# kind, sequence number, payload bytes, perf_counter of the server when it was published
+MESSAGE_HEADER = struct.Struct("<BIId")
+# level, moving platforms, enemies, coins
+KEYFRAME = struct.Struct("<HIII")
+# entries changed, coins flipped
+DELTA = struct.Struct("<II")
+# sequence number of the last message a spectator applied
+ACK = struct.Struct("<I")
+
+KIND_KEYFRAME = 1
+KIND_DELTA = 2
+
+#Seconds given to the spectators to take what was sent to them before the server stops
+SPECTATOR_CLOSE_TIMEOUT = 1.0
+
+#How many publish times and latencies are kept for the metrics
+LATENCY_HISTORY = 1000
+
+
+class StreamError(Exception):
+    """Raised when a spectator stream can't be read"""
+
+
+def is_unix_address(address):
+    """True if an address is the path of a Unix socket rather than HOST:PORT"""
+    return "/" in address or address.endswith(".sock")
+
+
+def split_address(address):
+    """(host, port) of a HOST:PORT address, the host defaulting to localhost"""
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def keyframe_payload(level, layout, state, collected):
+    """The payload of a keyframe of a whole state vector and its coin flags"""
+    return (KEYFRAME.pack(level, layout.platform_count, layout.enemy_count, len(collected))
+            + state.tobytes() + numpy.packbits(collected).tobytes())
+
+
+def percentiles_ms(seconds):
+    """(p50, p99) of a list of times in seconds, in milliseconds"""
+    if not seconds:
+        return 0.0, 0.0
+    p50, p99 = numpy.percentile(numpy.array(seconds) * 1000, (50, 99))
+    return float(p50), float(p99)
+
+
+class StreamEncoder:
+    """Turns the ticks of a simulation into keyframe and delta messages"""
+
+    def __init__(self, keyframe_interval=SPECTATOR_KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.sequence = 0
+        self.keyframes = 0
+        self.layout = None
+        self.prepared_level = None
+        self.state = None
+        self.scratch = None
+        self.collected = None
+        self.since_keyframe = 0
+
+    def encode(self, simulation):
+        """The message for the simulation as it is now. Returns (message bytes, True if it is a keyframe)."""
+        self.sequence += 1
+        collected = numpy.frombuffer(simulation.coin_list.collected, dtype=numpy.uint8)
+        keyframe = (simulation.prepared_level is not self.prepared_level
+                    or not self.layout.fits(simulation)
+                    or len(collected) != len(self.collected)
+                    or self.since_keyframe >= self.keyframe_interval)
+        if keyframe:
+            self.layout = StateLayout.for_simulation(simulation)
+            self.prepared_level = simulation.prepared_level
+            self.state = self.layout.empty()
+            self.scratch = self.layout.empty()
+            self.layout.capture(simulation, self.state)
+            self.collected = collected.copy()
+            self.since_keyframe = 0
+            self.keyframes += 1
+            kind = KIND_KEYFRAME
+            payload = keyframe_payload(simulation.level, self.layout, self.state, collected)
+        else:
+            state = self.scratch
+            self.layout.capture(simulation, state)
+            changed = numpy.flatnonzero(state != self.state)
+            flipped = numpy.flatnonzero(collected != self.collected)
+            self.collected[flipped] = collected[flipped]
+            self.scratch = self.state
+            self.state = state
+            self.since_keyframe += 1
+            kind = KIND_DELTA
+            payload = (DELTA.pack(len(changed), len(flipped)) + state[changed].tobytes()
+                       + changed.astype(numpy.int32).tobytes() + flipped.astype(numpy.int32).tobytes())
+        header = MESSAGE_HEADER.pack(kind, self.sequence, len(payload), time.perf_counter())
+        return header + payload, keyframe
+
+
+class StreamDecoder:
+    """Rebuilds the state of a streamed game from its messages"""
+
+    def __init__(self):
+        self.level = None
+        self.layout = None
+        self.state = None
+        self.collected = None
+        self.sequence = 0
+        self.keyframes = 0
+        self.deltas = 0
+
+    @property
+    def ready(self):
+        """True once a keyframe has come, before which there is no state"""
+        return self.state is not None
+
+    def apply(self, kind, sequence, payload):
+        """Applies a message to the state"""
+        if kind == KIND_KEYFRAME:
+            level, platform_count, enemy_count, coin_count = KEYFRAME.unpack_from(payload, 0)
+            layout = StateLayout(platform_count, enemy_count)
+            flags_start = KEYFRAME.size + 8 * layout.size
+            flag_bytes = (coin_count + 7) // 8
+            if len(payload) != flags_start + flag_bytes:
+                raise StreamError("keyframe {} is {} bytes, expected {}".format(
+                    sequence, len(payload), flags_start + flag_bytes))
+            self.state = numpy.frombuffer(payload, numpy.float64, layout.size, KEYFRAME.size).copy()
+            self.collected = numpy.unpackbits(numpy.frombuffer(payload, numpy.uint8, flag_bytes, flags_start),
+                                              count=coin_count)
+            self.level = level
+            self.layout = layout
+            self.keyframes += 1
+        elif kind == KIND_DELTA:
+            # A delta is a change from the state before it, so it means nothing until a keyframe has come
+            if self.state is None:
+                return
+            changed_count, flipped_count = DELTA.unpack_from(payload, 0)
+            if len(payload) != DELTA.size + 12 * changed_count + 4 * flipped_count:
+                raise StreamError("delta {} is {} bytes, expected {}".format(
+                    sequence, len(payload), DELTA.size + 12 * changed_count + 4 * flipped_count))
+            indexes_start = DELTA.size + 8 * changed_count
+            flipped_start = indexes_start + 4 * changed_count
+            self.state[numpy.frombuffer(payload, numpy.int32, changed_count, indexes_start)] = \
+                numpy.frombuffer(payload, numpy.float64, changed_count, DELTA.size)
+            self.collected[numpy.frombuffer(payload, numpy.int32, flipped_count, flipped_start)] ^= 1
+            self.deltas += 1
+        else:
+            raise StreamError("message {} is of unknown kind {}".format(sequence, kind))
+        self.sequence = sequence
+
+    @property
+    def score(self):
+        return int(self.state[SCALAR_FIELDS.index("score")])
+
+    def player(self):
+        """Every field of the player, by name"""
+        layout = self.layout
+        return dict(zip(PLAYER_FIELDS, self.state[layout.player_start:layout.platforms_start].tolist()))
+
+    def moving_platforms(self):
+        """(center_xs, center_ys) of the moving platforms"""
+        layout = self.layout
+        columns = self.state[layout.platforms_start:layout.enemies_start].reshape(4, layout.platform_count)
+        return columns[0], columns[1]
+
+    def enemies(self):
+        """(center_xs, center_ys) of the enemies"""
+        layout = self.layout
+        columns = self.state[layout.enemies_start:layout.lod_start].reshape(4, layout.enemy_count)
+        return columns[0], columns[1]
+
+    def coins_left(self):
+        return int(len(self.collected) - self.collected.sum())
+
+    def keyframe(self, sent_time):
+        """A keyframe message of the state as it is, stamped as published at sent_time"""
+        payload = keyframe_payload(self.level, self.layout, self.state, self.collected)
+        return MESSAGE_HEADER.pack(KIND_KEYFRAME, self.sequence, len(payload), sent_time) + payload
+
+    def restore(self, simulation):
+        """Puts a simulation in the streamed state, setting up the streamed level first if it is on another.
+
+        A ghost is a Simulation kept in step this way.
+        """
+        if simulation.prepared_level is None or simulation.level != self.level:
+            simulation.setup(self.level)
+        if (not self.layout.fits(simulation)
+                or len(self.collected) != len(simulation.coin_list.collected)):
+            raise StreamError("the stream doesn't fit level {} as it is here".format(self.level))
+        apply_state(simulation, self.layout, self.state.copy(), self.collected)
+
+
+class _Spectator:
+    """A connected spectator and what has been sent to it"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.task = asyncio.current_task()
+        self.bytes_sent = 0
+        self.messages = 0
+        self.skipped = 0
+        self.catch_ups = 0
+        self.lagging = False
+        # Sequence numbers of the last message sent, and of the last one the spectator said it applied
+        self.last_sent = 0
+        self.acked = 0
+
+    def send(self, data, sequence=None):
+        self.writer.write(data)
+        self.bytes_sent += len(data)
+        if sequence is not None:
+            self.messages += 1
+            self.last_sent = sequence
+
+
+class SpectatorServer:
+    """Broadcasts a simulation to spectators from an asyncio loop on a thread of its own.
+
+    address is HOST:PORT, port 0 picking a free one, or the path of a Unix
+    socket.  Call start(), then publish() after every tick.
+    """
+
+    def __init__(self, address, keyframe_interval=SPECTATOR_KEYFRAME_INTERVAL,
+                 lag_limit=SPECTATOR_LAG_LIMIT, buffer_limit=SPECTATOR_BUFFER_LIMIT):
+        self.address = address
+        self.encoder = StreamEncoder(keyframe_interval)
+        self.lag_limit = lag_limit
+        self.buffer_limit = buffer_limit
+        self.spectators = []
+        self.connections = 0
+        # The latest state, kept on the loop's thread for the keyframes sent to spectators that join or catch up
+        self.latest = StreamDecoder()
+        self.latest_time = 0.0
+        self.publish_times = deque(maxlen=LATENCY_HISTORY)
+        self.bound_address = None
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self._started = threading.Event()
+        self._error = None
+
+    def start(self):
+        """Starts listening. Returns the server, or raises if it can't listen on its address."""
+        self.thread = threading.Thread(target=self._run, name="spectator-server", daemon=True)
+        self.thread.start()
+        self._started.wait()
+        if self._error is not None:
+            raise self._error
+        return self
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.loop = loop
+        try:
+            self.server = loop.run_until_complete(self._listen())
+        except OSError as error:
+            self._error = error
+            self._started.set()
+            loop.close()
+            return
+        self._started.set()
+        try:
+            loop.run_forever()
+        finally:
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.close()
+
+    async def _listen(self):
+        if is_unix_address(self.address):
+            # A socket file left by a server that didn't close would stop this one listening
+            if os.path.exists(self.address) and stat.S_ISSOCK(os.stat(self.address).st_mode):
+                os.unlink(self.address)
+            server = await asyncio.start_unix_server(self._connected, path=self.address)
+            self.bound_address = self.address
+        else:
+            host, port = split_address(self.address)
+            server = await asyncio.start_server(self._connected, host, port)
+            self.bound_address = "{}:{}".format(*server.sockets[0].getsockname()[:2])
+        return server
+
+    async def _connected(self, reader, writer):
+        spectator = _Spectator(writer)
+        spectator.send(STREAM_HEADER.pack(MAGIC, VERSION, SIMULATION_RATE))
+        if self.latest.ready:
+            spectator.send(self.latest.keyframe(self.latest_time), self.latest.sequence)
+            spectator.acked = self.latest.sequence
+        self.spectators.append(spectator)
+        self.connections += 1
+        acks = b""
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                # Only the last whole ack counts, the ones before it are already out of date
+                acks += data
+                end = len(acks) - len(acks) % ACK.size
+                if end:
+                    spectator.acked = ACK.unpack_from(acks, end - ACK.size)[0]
+                    acks = acks[end:]
+        except OSError:
+            pass
+        finally:
+            self.spectators.remove(spectator)
+            writer.close()
+
+    def publish(self, simulation):
+        """Sends the simulation as it is to every spectator. Only encodes on the calling thread."""
+        start_time = time.perf_counter()
+        message, keyframe = self.encoder.encode(simulation)
+        self.loop.call_soon_threadsafe(self._broadcast, message, keyframe)
+        self.publish_times.append(time.perf_counter() - start_time)
+
+    def _broadcast(self, message, keyframe):
+        kind, sequence, _, sent_time = MESSAGE_HEADER.unpack_from(message)
+        self.latest.apply(kind, sequence, message[MESSAGE_HEADER.size:])
+        self.latest_time = sent_time
+        catch_up = None
+        for spectator in self.spectators:
+            if spectator.writer.is_closing():
+                continue
+            buffered = spectator.writer.transport.get_write_buffer_size()
+            if spectator.lagging:
+                # A lagging spectator jumps to the latest tick once it has applied everything it was sent
+                if spectator.acked < spectator.last_sent or buffered:
+                    spectator.skipped += 1
+                    continue
+                if catch_up is None:
+                    catch_up = self.latest.keyframe(sent_time)
+                spectator.lagging = False
+                spectator.catch_ups += 1
+                spectator.send(catch_up, sequence)
+            elif sequence - spectator.acked > self.lag_limit or buffered > self.buffer_limit:
+                spectator.lagging = True
+                spectator.skipped += 1
+            else:
+                spectator.send(message, sequence)
+
+    async def _shutdown(self):
+        self.server.close()
+        spectators = list(self.spectators)
+        for spectator in spectators:
+            spectator.writer.close()
+        # What is still buffered is sent while the loop runs, to a spectator dropped if it takes too long
+        if spectators:
+            _, pending = await asyncio.wait([spectator.task for spectator in spectators],
+                                            timeout=SPECTATOR_CLOSE_TIMEOUT)
+            for spectator in spectators:
+                if spectator.task in pending:
+                    spectator.writer.transport.abort()
+            if pending:
+                await asyncio.wait(pending)
+        if is_unix_address(self.address) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def close(self):
+        """Disconnects every spectator and stops the server's thread"""
+        if self.thread is None or not self.thread.is_alive():
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def metrics(self):
+        """What publishing costs the game's thread, and what has been sent to the spectators"""
+        p50, p99 = percentiles_ms(list(self.publish_times))
+        spectators = list(self.spectators)
+        return {
+            "published": self.encoder.sequence,
+            "keyframes": self.encoder.keyframes,
+            "publish_p50_us": p50 * 1000,
+            "publish_p99_us": p99 * 1000,
+            "connections": self.connections,
+            "spectators": len(spectators),
+            "bytes_sent": sum(spectator.bytes_sent for spectator in spectators),
+            "skipped": sum(spectator.skipped for spectator in spectators),
+            "catch_ups": sum(spectator.catch_ups for spectator in spectators),
+        }
+
+
+async def open_stream(address):
+    """Connects to a SpectatorServer and checks its header. Returns (reader, writer).
+
+    The server counts a spectator as lagging until it writes ACK with the
+    sequence number of each message it applies.
+    """
+    if is_unix_address(address):
+        reader, writer = await asyncio.open_unix_connection(address)
+    else:
+        reader, writer = await asyncio.open_connection(*split_address(address))
+    magic, version, _ = STREAM_HEADER.unpack(await reader.readexactly(STREAM_HEADER.size))
+    if magic != MAGIC:
+        raise StreamError("{} is not a spectator stream".format(address))
+    if version != VERSION:
+        raise StreamError("{} streams version {}, expected {}".format(address, version, VERSION))
+    return reader, writer
+
+
+async def read_message(reader):
+    """Reads a message. Returns (kind, sequence, time published, payload), or None at the end of the stream."""
+    try:
+        header = await reader.readexactly(MESSAGE_HEADER.size)
+    except asyncio.IncompleteReadError as error:
+        if error.partial:
+            raise StreamError("the stream ended inside a message")
+        return None
+    kind, sequence, size, sent_time = MESSAGE_HEADER.unpack(header)
+    try:
+        payload = await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        raise StreamError("the stream ended inside message {}".format(sequence))
+    return kind, sequence, sent_time, payload
+
+
+class SpectatorClient:
+    """Follows a stream into a StreamDecoder, measuring its bandwidth and latency.
+
+    Latency is from publish() on the server to the message being applied
+    here, which is only meaningful on the same machine.  read_delay makes
+    the client sleep after each message, to act as a slow spectator.
+    """
+
+    def __init__(self, address, read_delay=0.0):
+        self.address = address
+        self.read_delay = read_delay
+        self.decoder = StreamDecoder()
+        self.bytes_received = 0
+        self.messages = 0
+        self.latencies = deque(maxlen=LATENCY_HISTORY)
+        self.start_time = None
+        self.end_time = None
+
+    async def run(self, on_message=None):
+        """Reads the stream until the server closes it. on_message(client) is called after each message."""
+        reader, writer = await open_stream(self.address)
+        self.start_time = time.perf_counter()
+        self.bytes_received = STREAM_HEADER.size
+        try:
+            while True:
+                message = await read_message(reader)
+                if message is None:
+                    break
+                kind, sequence, sent_time, payload = message
+                self.decoder.apply(kind, sequence, payload)
+                writer.write(ACK.pack(sequence))
+                now = time.perf_counter()
+                self.latencies.append(now - sent_time)
+                self.bytes_received += MESSAGE_HEADER.size + len(payload)
+                self.messages += 1
+                self.end_time = now
+                if on_message is not None:
+                    on_message(self)
+                if self.read_delay:
+                    await asyncio.sleep(self.read_delay)
+        finally:
+            writer.close()
+
+    def kbit_per_second(self):
+        if self.start_time is None or self.end_time is None or self.end_time <= self.start_time:
+            return 0.0
+        return self.bytes_received * 8 / 1000 / (self.end_time - self.start_time)
+
+
+def play(server, level, ticks, seed, hold, rate, engine):
+    """Plays random inputs through a headless game at rate ticks a second (0 for flat out), publishing each tick"""
+    rng = random.Random(seed)
+    simulation = Simulation(level_loader=functools.partial(prepare_level, engine=engine))
+    simulation.setup(level)
+    inputs = Inputs()
+    next_time = time.perf_counter()
+    for tick in range(ticks):
+        if tick % hold == 0:
+            inputs = random_inputs(rng)
+        simulation.step(inputs)
+        server.publish(simulation)
+        if simulation.game_over:
+            break
+        if rate:
+            next_time += 1 / rate
+            time.sleep(max(next_time - time.perf_counter(), 0.0))
+    return simulation
+
+
+async def serve_locally(args):
+    """Serves a headless game to local spectators and reports how each got on"""
+    server = SpectatorServer(args.address, args.keyframe_interval, args.lag_limit, args.buffer_limit).start()
+    clients = [SpectatorClient(server.bound_address, args.slow_delay if index < args.slow else 0.0)
+               for index in range(args.clients)]
+    tasks = [asyncio.ensure_future(client.run()) for client in clients]
+    # The game's thread is the one that would run on_update, the spectators read on this one
+    simulation = await asyncio.to_thread(play, server, args.level, args.ticks, args.seed, args.hold,
+                                         args.rate, args.engine)
+    await asyncio.sleep(0.5)
+    metrics = server.metrics()
+    server.close()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    print("Served {} on level {}: {} ticks, {} keyframes, score {}".format(
+        server.bound_address, simulation.level, metrics["published"], metrics["keyframes"], simulation.score))
+    print("Publish on the game's thread: p50 {:.1f} us p99 {:.1f} us".format(
+        metrics["publish_p50_us"], metrics["publish_p99_us"]))
+    print("Skipped {} messages to slow spectators, who caught up {} times".format(
+        metrics["skipped"], metrics["catch_ups"]))
+    print("{:>9} {:>10} {:>9} {:>9} {:>10} {:>11} {:>11}".format(
+        "spectator", "kB", "kbit/s", "messages", "keyframes", "p50 ms", "p99 ms"))
+    for index, client in enumerate(clients):
+        p50, p99 = percentiles_ms(list(client.latencies))
+        print("{:>9} {:>10.1f} {:>9.1f} {:>9} {:>10} {:>11.2f} {:>11.2f}{}".format(
+            index, client.bytes_received / 1000, client.kbit_per_second(), client.messages,
+            client.decoder.keyframes, p50, p99, "  slow" if index < args.slow else ""))
+
+
+async def watch(address):
+    """Prints what a served game is doing about once a second"""
+    last_report = [time.perf_counter()]
+
+    def report(client):
+        decoder = client.decoder
+        now = time.perf_counter()
+        if now - last_report[0] < 1 or not decoder.ready:
+            return
+        last_report[0] = now
+        player = decoder.player()
+        p50, _ = percentiles_ms(list(client.latencies))
+        print("tick {} level {} score {} player ({:.0f}, {:.0f}) coins left {}  {:.1f} kbit/s  {:.2f} ms".format(
+            decoder.sequence, decoder.level, decoder.score, player["center_x"], player["center_y"],
+            decoder.coins_left(), client.kbit_per_second(), p50))
+
+    await SpectatorClient(address).run(report)
+
+
+def main():
+    """Serves a game to local spectators, or watches one"""
+    parser = argparse.ArgumentParser(description="Stream the platformer to spectators.")
+    parser.add_argument("--connect", metavar="ADDRESS", help="watch the game served at HOST:PORT or a socket path")
+    parser.add_argument("--address", default="127.0.0.1:0", help="HOST:PORT or socket path to serve on")
+    parser.add_argument("--clients", type=int, default=24, help="local spectators to serve to")
+    parser.add_argument("--slow", type=int, default=2, help="how many of the spectators read slowly")
+    parser.add_argument("--slow-delay", type=float, default=0.05, help="seconds a slow spectator waits per message")
+    parser.add_argument("--keyframe-interval", type=int, default=SPECTATOR_KEYFRAME_INTERVAL,
+                        help="ticks between keyframes")
+    parser.add_argument("--lag-limit", type=int, default=SPECTATOR_LAG_LIMIT,
+                        help="ticks a spectator can fall behind before it is skipped")
+    parser.add_argument("--buffer-limit", type=int, default=SPECTATOR_BUFFER_LIMIT,
+                        help="bytes waiting for a spectator before it is skipped")
+    parser.add_argument("--level", type=int, default=2, help="level to play")
+    parser.add_argument("--ticks", type=int, default=600, help="ticks to play")
+    parser.add_argument("--rate", type=float, default=SIMULATION_RATE, help="ticks per second, 0 for flat out")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the random inputs")
+    parser.add_argument("--hold", type=int, default=10, help="ticks to hold each random input for")
+    parser.add_argument("--engine", choices=sorted(PHYSICS_ENGINES), default=PHYSICS_ENGINE,
+                        help="how the static layers are checked for collisions")
+    args = parser.parse_args()
+
+    if args.connect:
+        asyncio.run(watch(args.connect))
+    else:
+        asyncio.run(serve_locally(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Startup timings
+
+The game marks each step of starting up (imports, the window, the title
+screen, the first level being warmed, the click, the first frame of play)
+on one StartupTimer, timed from when this module was first imported.  The
+first thing game.py imports is this module, so the marks include the time
+taken to import arcade and the rest of the game.
+
+Warming runs on the prefetch thread while the title screen is shown, so
+its mark can come before or after the ones of the main thread.
+"""
+
+import threading
+import time
+
+#When this module was imported, as close to the start of the game as can be measured
+_START_TIME = time.perf_counter()
+
+
+class StartupTimer:
+    """Named marks, in seconds since start, each only kept the first time it is made"""
+
+    def __init__(self, start_time=None):
+        self.start_time = time.perf_counter() if start_time is None else start_time
+        self.marks = {}
+        self._lock = threading.Lock()
+
+    def mark(self, name):
+        """Records that a step has finished. Returns the seconds since start it first finished at."""
+        now = time.perf_counter() - self.start_time
+        with self._lock:
+            return self.marks.setdefault(name, now)
+
+    def seconds(self, name):
+        """Seconds since start of a mark, or None if it wasn't made"""
+        return self.marks.get(name)
+
+    def between(self, first, second):
+        """Seconds from one mark to another, or None if either wasn't made"""
+        if first not in self.marks or second not in self.marks:
+            return None
+        return self.marks[second] - self.marks[first]
+
+    def breakdown(self):
+        """(name, seconds since start, seconds since the mark before) for each mark, in time order"""
+        with self._lock:
+            marks = sorted(self.marks.items(), key=lambda mark: mark[1])
+        rows = []
+        previous = 0.0
+        for name, seconds in marks:
+            rows.append((name, seconds, seconds - previous))
+            previous = seconds
+        return rows
+
+    def report_lines(self):
+        """Lines of text with the breakdown in milliseconds"""
+        lines = ["Startup:"]
+        for name, seconds, step in self.breakdown():
+            lines.append("  {:<24} {:8.1f} ms  (+{:.1f})".format(name, seconds * 1000, step * 1000))
+        return lines
+
+
+#The timer of this run of the game
+startup_timer = StartupTimer(_START_TIME)
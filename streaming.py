@@ -0,0 +1,251 @@
+"""
+Streaming of big maps a chunk at a time
+
+Building every tile of a level when it starts makes load time and memory
+grow with the size of the map.  In streaming mode only the chunks near the
+player are ever built: the simulation builds the collision bodies of a
+chunk of a tile layer the first time something is checked against it, and
+the game builds the sprites of the chunks around the camera on a worker
+thread (chunk_streamer).  Both keep what they built in a ChunkCache that
+drops the least recently used chunks once over its budget, so memory stays
+flat however long the level is.
+
+Coins, enemies and moving platforms are not streamed.  Their state lives
+in the simulation for the whole level, so a chunk that is dropped and built
+again shows the coins that are left and the enemies where they are now.
+"""
+
+import math
+from collections import OrderedDict
+
+import numpy
+
+from constants import *
+from level_data import scale_hit_box
+
+
+class ChunkCache:
+    """Least recently used cache of built chunks with a size budget.
+
+    Every chunk is put in with its size, in the unit of the budget (bytes,
+    or 1 per chunk to cap how many are kept).  Chunks are only dropped by
+    trim(), so the ones in use can be kept even when over budget.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.chunks = OrderedDict()
+        self.sizes = {}
+        self.size = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def __contains__(self, key):
+        return key in self.chunks
+
+    def get(self, key):
+        """The chunk for a key, marked as just used, or None"""
+        chunk = self.chunks.get(key)
+        if chunk is not None:
+            self.chunks.move_to_end(key)
+        return chunk
+
+    def peek(self, key):
+        """The chunk for a key without marking it used, or None"""
+        return self.chunks.get(key)
+
+    def values(self):
+        return self.chunks.values()
+
+    def put(self, key, chunk, size=1):
+        if key in self.chunks:
+            self.size -= self.sizes[key]
+        self.chunks[key] = chunk
+        self.chunks.move_to_end(key)
+        self.sizes[key] = size
+        self.size += size
+
+    def trim(self, keep=()):
+        """Drops least recently used chunks until the cache fits its budget. Returns the dropped keys."""
+        dropped = []
+        if self.size <= self.budget:
+            return dropped
+        for key in list(self.chunks):
+            if self.size <= self.budget:
+                break
+            if key in keep:
+                continue
+            del self.chunks[key]
+            self.size -= self.sizes.pop(key)
+            dropped.append(key)
+        self.evictions += len(dropped)
+        return dropped
+
+
+class StreamingTileGrid:
+    """Drop in for CollisionGrid that builds the bodies of a tile layer a chunk at a time.
+
+    Each tile's Body lives in a slot for the cell it was placed in, in the
+    chunk holding that cell.  A check looks at the cells under the body
+    being checked, widened by how far the layer's biggest tiles reach out
+    of their cells, and builds any chunk it needs that isn't cached.  At
+    most max_chunks chunks are kept.  Bodies appended with moving=True are
+    checked one by one as in CollisionGrid.
+
+    body_class is what the bodies are made with, simulation.Body.
+    """
+
+    def __init__(self, level_data, layer_name, scaling, body_class, chunk_tiles=RENDER_CHUNK_TILES,
+                 max_chunks=STREAMING_GRID_CHUNKS):
+        self.level_data = level_data
+        self.layer_name = layer_name
+        self.scaling = scaling
+        self.body_class = body_class
+        self.width = level_data.width
+        self.height = level_data.height
+        self.cell_width = level_data.tile_width * scaling
+        self.cell_height = level_data.tile_height * scaling
+        self.chunk_tiles = chunk_tiles
+        self.chunks = ChunkCache(max_chunks)
+        self.chunk_builds = 0
+        self.moving = []
+
+        # Where the hit boxes of the layer's tiles reach, relative to the bottom left of their cell
+        self.static_count = 0
+        self.reach = (0.0, 0.0, self.cell_width, self.cell_height)
+        gids = level_data.layers.get(layer_name)
+        if gids is not None:
+            used, counts = numpy.unique(numpy.asarray(gids), return_counts=True)
+            reaches = []
+            for gid, count in zip(used.tolist(), counts.tolist()):
+                tile = level_data.tiles.get(gid)
+                if gid == 0 or tile is None or tile.hit_box is None:
+                    continue
+                self.static_count += count
+                hit_box = scale_hit_box(tile.hit_box, scaling)
+                half_width = tile.width * scaling / 2
+                half_height = tile.height * scaling / 2
+                reaches.append((half_width + hit_box[0], half_height + hit_box[1],
+                                half_width + hit_box[2], half_height + hit_box[3]))
+            if reaches:
+                self.reach = (min(reach[0] for reach in reaches), min(reach[1] for reach in reaches),
+                              max(reach[2] for reach in reaches), max(reach[3] for reach in reaches))
+
+    @classmethod
+    def for_level(cls, level_data, layer_name, scaling, body_class):
+        """A grid streaming one tile layer of a level"""
+        return cls(level_data, layer_name, scaling, body_class)
+
+    def __len__(self):
+        return self.static_count + len(self.moving)
+
+    def append(self, body, moving=False):
+        if not moving:
+            raise ValueError("The static bodies of a StreamingTileGrid come from its tile layer")
+        self.moving.append(body)
+
+    def extend(self, bodies, moving=False):
+        for body in bodies:
+            self.append(body, moving)
+
+    def remove(self, body):
+        self.moving.remove(body)
+
+    def _chunk(self, chunk_x, chunk_y):
+        """The cell slots of a chunk, built if it isn't cached"""
+        key = (chunk_x, chunk_y)
+        slots = self.chunks.get(key)
+        if slots is None:
+            slots = self._build_chunk(chunk_x, chunk_y)
+            self.chunks.put(key, slots)
+            self.chunks.trim(keep=(key,))
+        return slots
+
+    def _build_chunk(self, chunk_x, chunk_y):
+        """Bodies for the tiles of a chunk, one slot per cell, None where there is none"""
+        chunk_tiles = self.chunk_tiles
+        left = chunk_x * chunk_tiles
+        bottom = chunk_y * chunk_tiles
+        slots = [None] * (chunk_tiles * chunk_tiles)
+        level_data = self.level_data
+        scaling = self.scaling
+        tiles = level_data.tiles
+        body_class = self.body_class
+        for column, row, gid in level_data.tile_cells(self.layer_name,
+                                                      (left, bottom, left + chunk_tiles, bottom + chunk_tiles)):
+            tile = tiles.get(gid)
+            if tile is None or tile.hit_box is None:
+                continue
+            center_x, center_y = level_data.tile_position(column, row, tile, scaling)
+            body = body_class(center_x, center_y, scale_hit_box(tile.hit_box, scaling))
+            body.gid = gid
+            slots[(row - bottom) * chunk_tiles + column - left] = body
+        self.chunk_builds += 1
+        return slots
+
+    def _static_hits(self, body):
+        """Yields the static bodies overlapping body"""
+        left = body.center_x + body.hit_box[0]
+        bottom = body.center_y + body.hit_box[1]
+        right = body.center_x + body.hit_box[2]
+        top = body.center_y + body.hit_box[3]
+
+        # Cells whose tiles could reach the box. Touching edges don't count.
+        reach_left, reach_bottom, reach_right, reach_top = self.reach
+        cell_width = self.cell_width
+        cell_height = self.cell_height
+        min_x = max(int(math.floor((left - reach_right) / cell_width)) + 1, 0)
+        max_x = min(int(math.ceil((right - reach_left) / cell_width)) - 1, self.width - 1)
+        min_y = max(int(math.floor((bottom - reach_top) / cell_height)) + 1, 0)
+        max_y = min(int(math.ceil((top - reach_bottom) / cell_height)) - 1, self.height - 1)
+        if min_x > max_x or min_y > max_y:
+            return
+
+        chunk_tiles = self.chunk_tiles
+        for chunk_y in range(min_y // chunk_tiles, max_y // chunk_tiles + 1):
+            chunk_bottom = chunk_y * chunk_tiles
+            rows = range(max(min_y, chunk_bottom) - chunk_bottom,
+                         min(max_y, chunk_bottom + chunk_tiles - 1) - chunk_bottom + 1)
+            for chunk_x in range(min_x // chunk_tiles, max_x // chunk_tiles + 1):
+                chunk_left = chunk_x * chunk_tiles
+                first_column = max(min_x, chunk_left) - chunk_left
+                last_column = min(max_x, chunk_left + chunk_tiles - 1) - chunk_left
+                slots = self._chunk(chunk_x, chunk_y)
+                for row in rows:
+                    row_start = row * chunk_tiles
+                    for other in slots[row_start + first_column:row_start + last_column + 1]:
+                        if (other is not None and other is not body
+                                and left < other.center_x + other.hit_box[2]
+                                and other.center_x + other.hit_box[0] < right
+                                and bottom < other.center_y + other.hit_box[3]
+                                and other.center_y + other.hit_box[1] < top):
+                            yield other
+
+    def _moving_hits(self, body):
+        left = body.center_x + body.hit_box[0]
+        bottom = body.center_y + body.hit_box[1]
+        right = body.center_x + body.hit_box[2]
+        top = body.center_y + body.hit_box[3]
+        for other in self.moving:
+            if (other is not body
+                    and left < other.center_x + other.hit_box[2]
+                    and other.center_x + other.hit_box[0] < right
+                    and bottom < other.center_y + other.hit_box[3]
+                    and other.center_y + other.hit_box[1] < top):
+                yield other
+
+    def check_for_collision(self, body):
+        """Returns the bodies in this grid that overlap body, moving ones first as in BodyList"""
+        hit_list = list(self._moving_hits(body))
+        hit_list.extend(self._static_hits(body))
+        return hit_list
+
+    def collides(self, body):
+        """True if any body in this grid overlaps body. Stops at the first hit."""
+        for _ in self._moving_hits(body):
+            return True
+        for _ in self._static_hits(body):
+            return True
+        return False
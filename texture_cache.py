@@ -0,0 +1,197 @@
+"""
+Process wide texture and animation cache
+
+Textures are loaded once per path and flip and every sprite of a kind
+shares one immutable animation set.  Each entry remembers the scopes that
+asked for it, so everything a level loaded can be evicted when the level is
+left without dropping what the next level or the player still uses.
+
+Images in the asset atlas are cut from its sheets with the hit boxes it
+worked out when it was built, instead of being decoded from their files.
+"""
+
+import threading
+from collections import namedtuple
+
+import arcade
+
+from atlas import asset_atlas
+from constants import *
+
+#Scope for textures that live for the whole run
+PERSISTENT_SCOPE = "persistent"
+
+PlayerAnimations = namedtuple("PlayerAnimations",
+                              ["initial", "jump", "fall", "idle", "walk", "death", "climbing"])
+MobAnimations = namedtuple("MobAnimations", ["initial", "idle", "walk"])
+
+PLAYER_IDLE_FRAMES = 5
+PLAYER_WALK_FRAMES = 6
+PLAYER_DEATH_FRAMES = 7
+PLAYER_CLIMB_FRAMES = 2
+MOB_IDLE_FRAMES = 4
+MOB_WALK_FRAMES = 6
+
+
+def level_scope(level):
+    """Name of the cache scope for a level"""
+    return "level {}".format(level)
+
+
+class AtlasTexture(arcade.Texture):
+    """A texture cut from the asset atlas, with the hit box points worked out when the atlas was built"""
+
+    def __init__(self, name, image, hit_box_points):
+        super().__init__(name, image)
+        self._hit_box_points = hit_box_points
+
+
+def atlas_texture(atlas, path, flipped_horizontally=False, flipped_vertically=False, flipped_diagonally=False):
+    """The texture arcade.load_texture would give for an image in the atlas"""
+    flips = (flipped_horizontally, flipped_vertically, flipped_diagonally)
+    # Named as load_texture names them, as sprite lists tell textures apart by name
+    name = "{}-0-0-0-0-{}-{}-{}-Simple".format(path, *flips)
+    return AtlasTexture(name, atlas.image(path, *flips), atlas.hit_box_points(path, *flips))
+
+
+class TextureCache:
+    """Flyweight store for textures and animation sets"""
+
+    def __init__(self):
+        self._textures = {}
+        self._texture_keys = {}
+        self._animations = {}
+        self._scopes = {}
+        self.hits = 0
+        self.misses = 0
+        # Levels are prefetched on a worker thread while the main thread draws
+        self._lock = threading.RLock()
+
+    def _acquire(self, key, scope):
+        self._scopes.setdefault(key, set()).add(scope)
+
+    def texture(self, path, flipped=False, scope=PERSISTENT_SCOPE,
+                flipped_vertically=False, flipped_diagonally=False):
+        """Returns the texture for an image, loading it the first time"""
+        key = (path, flipped, flipped_vertically, flipped_diagonally)
+        with self._lock:
+            texture = self._textures.get(key)
+            if texture is None:
+                self.misses += 1
+                atlas = asset_atlas()
+                if path in atlas:
+                    texture = atlas_texture(atlas, path, flipped, flipped_vertically, flipped_diagonally)
+                else:
+                    texture = arcade.load_texture(path,
+                                                  flipped_horizontally=flipped,
+                                                  flipped_vertically=flipped_vertically,
+                                                  flipped_diagonally=flipped_diagonally,
+                                                  can_cache=False)
+                self._textures[key] = texture
+                self._texture_keys[id(texture)] = key
+            else:
+                self.hits += 1
+            self._acquire(key, scope)
+        return texture
+
+    def texture_pair(self, path, scope=PERSISTENT_SCOPE):
+        """Returns the right and left facing textures for an image"""
+        return (self.texture(path, False, scope),
+                self.texture(path, True, scope))
+
+    def tile_texture(self, tile, scope=PERSISTENT_SCOPE):
+        """Returns the texture for a level_data.TileInfo, flipped as in the map"""
+        return self.texture(tile.source, tile.flipped_horizontally, scope,
+                            tile.flipped_vertically, tile.flipped_diagonally)
+
+    def _animation_set(self, key, scope, build):
+        with self._lock:
+            animations = self._animations.get(key)
+            if animations is None:
+                animations = build()
+                self._animations[key] = animations
+            self._acquire(key, scope)
+            # The textures inside belong to the same scopes as the set
+            for frames in animations:
+                self._acquire_textures(frames, scope)
+        return animations
+
+    def _acquire_textures(self, frames, scope):
+        if isinstance(frames, tuple):
+            for frame in frames:
+                self._acquire_textures(frame, scope)
+        else:
+            self._acquire(self._texture_keys[id(frames)], scope)
+
+    def player_animations(self, scope=PERSISTENT_SCOPE):
+        """The player's animation set, shared by every PlayerCharacter"""
+        return self._animation_set(("player",), scope, lambda: self._load_player(scope))
+
+    def mob_animations(self, mob_type, scope=PERSISTENT_SCOPE):
+        """The animation set of a mob type, shared by every EnemyCharacter of that type"""
+        return self._animation_set(("mob", mob_type), scope, lambda: self._load_mob(mob_type, scope))
+
+    def _load_player(self, scope):
+        main_path = PLAYER_ASSET_PATH
+        return PlayerAnimations(
+            initial=self.texture_pair("{}idle0.png".format(main_path), scope),
+            jump=self.texture_pair("{}jump.png".format(main_path), scope),
+            fall=self.texture_pair("{}fall.png".format(main_path), scope),
+            idle=tuple(self.texture_pair("{}idle{}.png".format(main_path, i), scope)
+                       for i in range(PLAYER_IDLE_FRAMES)),
+            walk=tuple(self.texture_pair("{}run{}.png".format(main_path, i), scope)
+                       for i in range(PLAYER_WALK_FRAMES)),
+            death=tuple(self.texture_pair("{}death{}.png".format(main_path, i), scope)
+                        for i in range(PLAYER_DEATH_FRAMES)),
+            climbing=tuple(self.texture("{}climb{}.png".format(main_path, i), False, scope)
+                           for i in range(PLAYER_CLIMB_FRAMES)))
+
+    def _load_mob(self, mob_type, scope):
+        main_path = MOB_ASSET_PATH.format(mob_type)
+        return MobAnimations(
+            initial=self.texture_pair("{}idle0.png".format(main_path), scope),
+            idle=tuple(self.texture_pair("{}idle{}.png".format(main_path, i), scope)
+                       for i in range(MOB_IDLE_FRAMES)),
+            walk=tuple(self.texture_pair("{}run{}.png".format(main_path, i), scope)
+                       for i in range(MOB_WALK_FRAMES)))
+
+    def evict(self, scope):
+        """Drops everything that only the given scope was using"""
+        with self._lock:
+            for key, scopes in list(self._scopes.items()):
+                scopes.discard(scope)
+                if not scopes:
+                    del self._scopes[key]
+                    texture = self._textures.pop(key, None)
+                    if texture is not None:
+                        del self._texture_keys[id(texture)]
+                    self._animations.pop(key, None)
+
+    def evict_levels(self, *keep):
+        """Evicts every level scope except the ones given"""
+        with self._lock:
+            level_scopes = set()
+            for scopes in self._scopes.values():
+                level_scopes.update(scopes)
+            level_scopes.discard(PERSISTENT_SCOPE)
+            level_scopes.difference_update(keep)
+            for scope in level_scopes:
+                self.evict(scope)
+
+    @property
+    def texture_count(self):
+        return len(self._textures)
+
+    @property
+    def texture_bytes(self):
+        """Approximate memory held by the cached texture images"""
+        total = 0
+        for texture in self._textures.values():
+            if texture.image is not None:
+                width, height = texture.image.size
+                total += width * height * 4
+        return total
+
+
+#The cache shared by the whole process
+texture_cache = TextureCache()
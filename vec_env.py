@@ -0,0 +1,331 @@
+"""
+Many headless games stepped as one batch, for automated agents
+
+A VecEnv runs N independent Simulations with the normal game rules and
+steps them all with one call, taking an array of actions and giving back
+NumPy arrays of observations, rewards and done flags.  With the "process"
+backend the games are split across worker processes, so throughput grows
+with the number of cores.
+
+The workers don't each load the maps: the compiled level files are copied
+once into shared memory blocks that every worker reads its LevelData from.
+Actions, observations, rewards and done flags are also passed through
+shared memory, so a step only sends a short command down each pipe.
+
+A game that ends (the last level finished, or max_episode_ticks reached)
+is started again straight away, and the observation given for it is the
+first one of the new game.
+"""
+
+import argparse
+import functools
+import multiprocessing
+import os
+import time
+import traceback
+from multiprocessing import shared_memory
+
+import numpy
+
+import levelpack
+from constants import *
+from simulation import Simulation, Inputs, prepare_level, EVENT_COIN
+
+#Actions are a bit for each key held
+ACTION_UP = 1
+ACTION_DOWN = 2
+ACTION_LEFT = 4
+ACTION_RIGHT = 8
+ACTION_COUNT = 16
+ACTION_INPUTS = tuple(Inputs(bool(action & ACTION_UP), bool(action & ACTION_DOWN),
+                             bool(action & ACTION_LEFT), bool(action & ACTION_RIGHT))
+                      for action in range(ACTION_COUNT))
+
+#Columns of an observation
+OBSERVATION_FIELDS = ("center_x", "center_y", "change_x", "change_y", "is_on_ladder", "dead",
+                      "level", "coins_left", "view_left", "view_bottom", "end_of_map")
+OBSERVATION_SIZE = len(OBSERVATION_FIELDS)
+
+#Ticks a game may run before it is ended, five minutes of play
+MAX_EPISODE_TICKS = 5 * 60 * 60
+
+BACKEND_SERIAL = "serial"
+BACKEND_PROCESS = "process"
+BACKENDS = (BACKEND_SERIAL, BACKEND_PROCESS)
+
+
+def batch_nbytes(num_envs):
+    """Bytes needed for the arrays of a batch of num_envs games"""
+    return 8 * (num_envs * OBSERVATION_SIZE + 3 * num_envs)
+
+
+def batch_arrays(buffer, num_envs):
+    """(actions, observations, rewards, dones) arrays laid out in buffer"""
+    observations = numpy.ndarray((num_envs, OBSERVATION_SIZE), numpy.float64, buffer, 0)
+    offset = observations.nbytes
+    rewards = numpy.ndarray(num_envs, numpy.float64, buffer, offset)
+    offset += 8 * num_envs
+    actions = numpy.ndarray(num_envs, numpy.int64, buffer, offset)
+    offset += 8 * num_envs
+    dones = numpy.ndarray(num_envs, numpy.bool_, buffer, offset)
+    return actions, observations, rewards, dones
+
+
+class GameBatch:
+    """The games from start to stop of a batch, stepped one after another.
+
+    Reads its actions from, and writes its results to, its rows of the
+    batch arrays.
+    """
+
+    def __init__(self, arrays, start, stop, level=1, engine=PHYSICS_ENGINE, map_name=MAP_NAME,
+                 max_episode_ticks=MAX_EPISODE_TICKS):
+        actions, observations, rewards, dones = arrays
+        self.actions = actions[start:stop]
+        self.observations = observations[start:stop]
+        self.rewards = rewards[start:stop]
+        self.dones = dones[start:stop]
+        self.level = level
+        self.level_loader = functools.partial(prepare_level, engine=engine, map_name=map_name)
+        self.max_episode_ticks = max_episode_ticks
+        self.simulations = [None] * (stop - start)
+        self.episode_ticks = [0] * (stop - start)
+
+    def new_game(self, index):
+        simulation = Simulation(level_loader=self.level_loader)
+        simulation.setup(self.level)
+        self.simulations[index] = simulation
+        self.episode_ticks[index] = 0
+        self.observe(index)
+
+    def observe(self, index):
+        simulation = self.simulations[index]
+        player = simulation.player_sprite
+        self.observations[index] = (player.center_x, player.center_y, player.change_x, player.change_y,
+                                    player.is_on_ladder, player.dead, simulation.level,
+                                    len(simulation.coin_list), simulation.view_left, simulation.view_bottom,
+                                    simulation.end_of_map)
+
+    def reset(self):
+        for index in range(len(self.simulations)):
+            self.new_game(index)
+        self.rewards[:] = 0
+        self.dones[:] = False
+
+    def step(self):
+        actions = self.actions.tolist()
+        for index, simulation in enumerate(self.simulations):
+            reward = 0
+            for event in simulation.step(ACTION_INPUTS[actions[index]]):
+                if event.kind == EVENT_COIN:
+                    reward += event.value
+            self.episode_ticks[index] += 1
+            done = simulation.game_over or self.episode_ticks[index] >= self.max_episode_ticks
+            self.rewards[index] = reward
+            self.dones[index] = done
+            if done:
+                self.new_game(index)
+            else:
+                self.observe(index)
+
+
+class SharedLevels:
+    """Compiled level files copied into shared memory blocks, one per map file"""
+
+    def __init__(self, map_files):
+        self.blocks = {}
+        self.sizes = {}
+        for map_file in map_files:
+            if map_file in self.blocks:
+                continue
+            data = levelpack.compiled_bytes(map_file)
+            block = shared_memory.SharedMemory(create=True, size=len(data))
+            block.buf[:len(data)] = data
+            self.blocks[map_file] = block
+            self.sizes[map_file] = len(data)
+
+    def names(self):
+        """{map file: (block name, size)}, what a worker needs to attach"""
+        return {map_file: (block.name, self.sizes[map_file]) for map_file, block in self.blocks.items()}
+
+    def close(self):
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
+        self.sizes = {}
+
+
+def attach_levels(names):
+    """Makes load_level read the maps from shared memory. Returns the blocks, which must be kept open"""
+    blocks = []
+    for map_file, (name, size) in names.items():
+        block = shared_memory.SharedMemory(name=name)
+        blocks.append(block)
+        levelpack.cache_level(map_file, block.buf[:size])
+    return blocks
+
+
+def _worker_main(connection, level_names, arrays_name, num_envs, start, stop, settings):
+    """Runs a GameBatch in a worker process until told to close"""
+    level_blocks = attach_levels(level_names)
+    arrays_block = shared_memory.SharedMemory(name=arrays_name)
+    batch = GameBatch(batch_arrays(arrays_block.buf, num_envs), start, stop, **settings)
+    while True:
+        command = connection.recv()
+        if command == "close":
+            break
+        try:
+            if command == "step":
+                batch.step()
+            elif command == "reset":
+                batch.reset()
+            else:
+                raise ValueError("Unknown command {!r}".format(command))
+            connection.send(None)
+        except Exception:
+            connection.send(traceback.format_exc())
+    connection.close()
+
+    # Everything viewing the shared memory has to go before it can be closed
+    batch = None
+    levelpack.forget_levels()
+    for block in level_blocks + [arrays_block]:
+        block.close()
+
+
+class VecEnv:
+    """N games stepped together.
+
+        env = VecEnv(64, backend="process")
+        observations = env.reset()
+        observations, rewards, dones = env.step(actions)
+
+    actions holds one action per game, a sum of the ACTION_ bits for the keys
+    held.  Rewards are the points picked up during the step.  The arrays
+    given back are copies that later steps don't change.
+
+    workers is the number of processes of the "process" backend, one per
+    core by default.
+    """
+
+    def __init__(self, num_envs, level=1, backend=BACKEND_SERIAL, workers=None, engine=PHYSICS_ENGINE,
+                 map_name=MAP_NAME, max_episode_ticks=MAX_EPISODE_TICKS):
+        if backend not in BACKENDS:
+            raise ValueError("Unknown backend {!r}".format(backend))
+        self.num_envs = num_envs
+        self.backend = backend
+        settings = {"level": level, "engine": engine, "map_name": map_name,
+                    "max_episode_ticks": max_episode_ticks}
+        self.batches = []
+        self.workers = []
+        self.shared_levels = None
+        self.arrays_block = None
+
+        if backend == BACKEND_SERIAL:
+            self.arrays = batch_arrays(bytearray(batch_nbytes(num_envs)), num_envs)
+            self.batches.append(GameBatch(self.arrays, 0, num_envs, **settings))
+            return
+
+        workers = min(workers or os.cpu_count() or 1, num_envs)
+        self.shared_levels = SharedLevels(map_name.format(next_level)
+                                          for next_level in range(level, max(level, TOTAL_LEVELS) + 1))
+        self.arrays_block = shared_memory.SharedMemory(create=True, size=batch_nbytes(num_envs))
+        self.arrays = batch_arrays(self.arrays_block.buf, num_envs)
+        for worker in range(workers):
+            start = num_envs * worker // workers
+            stop = num_envs * (worker + 1) // workers
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_worker_main, daemon=True,
+                                              args=(worker_connection, self.shared_levels.names(),
+                                                    self.arrays_block.name, num_envs, start, stop, settings))
+            process.start()
+            worker_connection.close()
+            self.workers.append((process, connection))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self, command):
+        if self.backend == BACKEND_SERIAL:
+            getattr(self.batches[0], command)()
+            return
+        for _, connection in self.workers:
+            connection.send(command)
+        errors = [connection.recv() for _, connection in self.workers]
+        for error in errors:
+            if error is not None:
+                raise RuntimeError("A game worker failed:\n{}".format(error))
+
+    def reset(self):
+        """Starts every game again and returns their observations"""
+        self._run("reset")
+        return self.arrays[1].copy()
+
+    def step(self, actions):
+        """Steps every game one tick. Returns (observations, rewards, dones)"""
+        actions = numpy.asarray(actions)
+        if actions.shape != (self.num_envs,):
+            raise ValueError("Expected {} actions, got an array of shape {}".format(self.num_envs, actions.shape))
+        if actions.size and (actions.min() < 0 or actions.max() >= ACTION_COUNT):
+            raise ValueError("Actions must be between 0 and {}".format(ACTION_COUNT - 1))
+        _, observations, rewards, dones = self.arrays
+        self.arrays[0][:] = actions
+        self._run("step")
+        return observations.copy(), rewards.copy(), dones.copy()
+
+    def close(self):
+        """Stops the workers and frees the shared memory"""
+        for process, connection in self.workers:
+            try:
+                connection.send("close")
+            except OSError:
+                pass
+        for process, connection in self.workers:
+            process.join()
+            connection.close()
+        self.workers = []
+        if self.arrays_block is not None:
+            # The views have to go before the block can be closed
+            self.arrays = None
+            self.arrays_block.close()
+            self.arrays_block.unlink()
+            self.arrays_block = None
+        if self.shared_levels is not None:
+            self.shared_levels.close()
+            self.shared_levels = None
+
+
+def main():
+    """Steps a batch of games with random actions and reports the throughput"""
+    parser = argparse.ArgumentParser(description="Step many headless games at once.")
+    parser.add_argument("--envs", type=int, default=16, help="number of games")
+    parser.add_argument("--backend", choices=BACKENDS, default=BACKEND_PROCESS, help="how the games are run")
+    parser.add_argument("--workers", type=int, help="worker processes, one per core by default")
+    parser.add_argument("--steps", type=int, default=1000, help="number of steps")
+    parser.add_argument("--level", type=int, default=1, help="level every game starts on")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the random actions")
+    args = parser.parse_args()
+
+    rng = numpy.random.default_rng(args.seed)
+    with VecEnv(args.envs, args.level, args.backend, args.workers) as env:
+        env.reset()
+        total_reward = 0.0
+        games_done = 0
+        start_time = time.perf_counter()
+        for _ in range(args.steps):
+            _, rewards, dones = env.step(rng.integers(0, ACTION_COUNT, args.envs))
+            total_reward += rewards.sum()
+            games_done += int(dones.sum())
+        elapsed = time.perf_counter() - start_time
+
+    print("Game ticks per second: {:.0f}".format(args.envs * args.steps / elapsed))
+    print("Steps per second: {:.0f}".format(args.steps / elapsed))
+    print("Reward: {:.0f} Games finished: {}".format(total_reward, games_done))
+
+
+if __name__ == "__main__":
+    main()